@@ -0,0 +1,46 @@
+"""
+Synthetic GLDAS Noah v2.1 image files for the benchmarks.
+
+The number of days in the synthetic archive can be set with the environment
+variable GLDAS_BENCH_DAYS (default: 2).
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from gldas.synthetic import create_archive
+
+PARAMETERS = [
+    "SoilMoi0_10cm_inst",
+    "SoilMoi10_40cm_inst",
+    "SoilMoi40_100cm_inst",
+    "SoilMoi100_200cm_inst",
+    "SoilTMP0_10cm_inst",
+]
+
+START = datetime(2015, 1, 1)
+
+
+@pytest.fixture(scope="session")
+def n_days():
+    return int(os.environ.get("GLDAS_BENCH_DAYS", 2))
+
+
+@pytest.fixture(scope="session")
+def archive(tmp_path_factory, n_days):
+    """Root of a synthetic archive with 3-hourly images of n_days days"""
+    root = str(tmp_path_factory.mktemp("gldas_archive"))
+    end = START + timedelta(days=n_days) - timedelta(hours=3)
+    create_archive(
+        root, START, end, parameters=PARAMETERS, n_proc=os.cpu_count()
+    )
+    return root
+
+
+@pytest.fixture(scope="session")
+def image_file(archive):
+    return os.path.join(
+        archive, "2015", "001", "GLDAS_NOAH025_3H.A20150101.0000.021.nc4"
+    )
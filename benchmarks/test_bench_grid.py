@@ -0,0 +1,41 @@
+"""
+Benchmarks for creating the GLDAS grids.
+"""
+
+import pytest
+
+from gldas import grid
+
+
+def clear_caches():
+    grid._cached_grid.cache_clear()
+    grid._load_grid_arrays.cache_clear()
+
+
+@pytest.mark.parametrize("only_land", [False, True])
+def test_create_grid(benchmark, only_land):
+    result = benchmark.pedantic(
+        grid.GLDAS025Grids,
+        kwargs={"only_land": only_land},
+        setup=clear_caches,
+        rounds=3,
+    )
+    assert result.activegpis.size == (
+        grid.GLDAS025LandGrid().activegpis.size if only_land else 1036800
+    )
+
+
+@pytest.mark.parametrize("only_land", [False, True])
+def test_load_cached_grid(benchmark, tmp_path, only_land):
+    cache_dir = str(tmp_path)
+    grid.GLDAS025Grids(cache_dir=cache_dir)  # create the cache file
+    benchmark.pedantic(
+        grid.GLDAS025Grids,
+        kwargs={"only_land": only_land, "cache_dir": cache_dir},
+        setup=clear_caches,
+        rounds=5,
+    )
+
+
+def test_cached_grid(benchmark):
+    benchmark(grid.GLDAS025LandGrid)
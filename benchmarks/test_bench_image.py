@@ -0,0 +1,40 @@
+"""
+Benchmarks for reading GLDAS Noah v2 image files.
+"""
+
+import pytest
+
+from gldas.interface import GLDAS_Noah_v2_025Img
+from gldas.grid import GLDAS025Cellgrid, GLDAS025LandGrid, subgrid4bbox
+
+from conftest import PARAMETERS
+
+GRIDS = {
+    "global": GLDAS025Cellgrid,
+    "land": GLDAS025LandGrid,
+    "bbox": lambda: subgrid4bbox(
+        GLDAS025LandGrid(), 41.125, 11.125, 63.875, 23.875
+    ),
+}
+
+
+@pytest.mark.parametrize("n_params", [1, len(PARAMETERS)])
+@pytest.mark.parametrize("grid", list(GRIDS))
+def test_read_1d(benchmark, image_file, grid, n_params):
+    img = GLDAS_Noah_v2_025Img(
+        image_file,
+        parameter=PARAMETERS[:n_params],
+        subgrid=GRIDS[grid](),
+        array_1D=True,
+    )
+    image = benchmark(img.read)
+    assert len(image.data) == n_params
+
+
+@pytest.mark.parametrize("n_params", [1, len(PARAMETERS)])
+def test_read_2d(benchmark, image_file, n_params):
+    img = GLDAS_Noah_v2_025Img(
+        image_file, parameter=PARAMETERS[:n_params], array_1D=False
+    )
+    image = benchmark(img.read)
+    assert image.data[PARAMETERS[0]].shape == (720, 1440)
@@ -0,0 +1,54 @@
+"""
+Benchmarks for the image time stamps and the conversion to time series.
+"""
+
+import glob
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from gldas.utils import tstamps_for_daterange
+from gldas.interface import GLDAS_Noah_v21_025Ds
+from gldas.grid import load_grid
+from gldas.reshuffle import reshuffle
+
+from conftest import PARAMETERS, START
+
+
+@pytest.mark.parametrize("years", [1, 20])
+def test_tstamps_for_daterange(benchmark, years):
+    end = datetime(2000 + years, 1, 1)
+    timestamps = benchmark(tstamps_for_daterange, datetime(2000, 1, 1), end)
+    assert timestamps.size == (end - datetime(2000, 1, 1)).days * 8 + 1
+
+
+def test_dataset_tstamps_for_daterange(benchmark, archive):
+    ds = GLDAS_Noah_v21_025Ds(archive, array_1D=True)
+    timestamps = benchmark(
+        ds.tstamps_for_daterange, datetime(2000, 1, 1), datetime(2020, 1, 1)
+    )
+    assert len(timestamps) > 0
+
+
+@pytest.mark.parametrize("n_params", [1, len(PARAMETERS)])
+def test_reshuffle(benchmark, archive, n_days, tmp_path, n_params):
+    grid = load_grid(land_points=True, bbox=(0.0, 30.0, 20.0, 50.0))
+    end = START + timedelta(days=n_days) - timedelta(hours=3)
+    outputs = iter(range(100))
+
+    def run():
+        outputpath = str(tmp_path / str(next(outputs)))
+        reshuffle(
+            archive,
+            outputpath,
+            START,
+            end,
+            PARAMETERS[:n_params],
+            input_grid=grid,
+            imgbuffer=8,
+        )
+        return outputpath
+
+    outputpath = benchmark.pedantic(run, rounds=3)
+    assert len(glob.glob(os.path.join(outputpath, "*.nc"))) > 1
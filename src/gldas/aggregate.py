@@ -0,0 +1,200 @@
+"""
+Module for aggregating the 3-hourly GLDAS images to daily or monthly means
+while they are read, so that only the aggregated images are converted.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+from pygeobase.object_base import Image
+
+from gldas.utils import tstamps_for_daterange
+
+aggregations = ("daily", "monthly")
+
+# fill value of the image readers
+_fill_value = 9999.0
+
+
+def period_start(timestamp, aggregation):
+    """
+    Start of the aggregation period that contains a time stamp.
+
+    Parameters
+    ----------
+    timestamp : datetime
+        Time stamp.
+    aggregation : str
+        'daily' or 'monthly'
+
+    Returns
+    -------
+    start : datetime
+        Start of the day or month.
+    """
+    if aggregation == "daily":
+        return datetime(timestamp.year, timestamp.month, timestamp.day)
+    if aggregation == "monthly":
+        return datetime(timestamp.year, timestamp.month, 1)
+    raise ValueError(
+        f"Unknown aggregation: {aggregation}. Use one of {aggregations}"
+    )
+
+
+def next_period(start, aggregation):
+    """
+    Start of the aggregation period after the one that starts at `start`.
+    """
+    if aggregation == "daily":
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def period_images(start, aggregation):
+    """
+    Time stamps of the 3-hourly images in the period that starts at `start`.
+    """
+    end = next_period(start, aggregation) - timedelta(hours=3)
+    return tstamps_for_daterange(start, end, as_list=True)
+
+
+def complete_periods(start_date, end_date, aggregation):
+    """
+    Start of all aggregation periods whose 3-hourly images are all between
+    two dates.
+
+    Parameters
+    ----------
+    start_date : datetime
+        First image.
+    end_date : datetime
+        Last image.
+    aggregation : str
+        'daily' or 'monthly'
+
+    Returns
+    -------
+    starts : list
+        Start of each complete period.
+    """
+    start = period_start(start_date, aggregation)
+    if start < start_date:
+        start = next_period(start, aggregation)
+    starts = []
+    while next_period(start, aggregation) - timedelta(hours=3) <= end_date:
+        starts.append(start)
+        start = next_period(start, aggregation)
+    return starts
+
+
+class GLDASAggregatedDs:
+    """
+    Image dataset that returns the daily or monthly mean of the 3-hourly
+    images of another GLDAS image dataset. The images of a period are read
+    one after the other and added up to a running sum and count for each
+    point, fill values are ignored. Points without any valid value are set
+    to the fill value (9999).
+
+    Parameters
+    ----------
+    dataset : GLDAS_Noah_v21_025Ds or GLDAS_Noah_v1_025Ds
+        Dataset of the 3-hourly images (with array_1D=True).
+    aggregation : str
+        'daily' or 'monthly'
+    available : set or dict, optional (default: None)
+        Time stamps of the images that exist (e.g. from
+        `ArchiveInventory.files`). Only these images are read, and periods
+        without any image are skipped. If None is passed, all images are
+        read and missing ones are skipped.
+    """
+
+    def __init__(self, dataset, aggregation, available=None):
+        if aggregation not in aggregations:
+            raise ValueError(
+                f"Unknown aggregation: {aggregation}. Use one of "
+                f"{aggregations}"
+            )
+        self.dataset = dataset
+        self.aggregation = aggregation
+        self.available = None if available is None else set(available)
+        self.grid = dataset.grid
+
+    def _images(self, start):
+        images = period_images(start, self.aggregation)
+        if self.available is not None:
+            images = [t for t in images if t in self.available]
+        return images
+
+    def tstamps_for_daterange(self, start_date, end_date):
+        """
+        Start of the aggregation periods between two dates.
+
+        Parameters
+        ----------
+        start_date : datetime
+            Start date.
+        end_date : datetime
+            End date.
+
+        Returns
+        -------
+        timestamps : list
+            Start of each period that starts between start_date and
+            end_date and contains at least one image.
+        """
+        start = period_start(start_date, self.aggregation)
+        if start < start_date:
+            start = next_period(start, self.aggregation)
+        timestamps = []
+        while start <= end_date:
+            if self.available is None or self._images(start):
+                timestamps.append(start)
+            start = next_period(start, self.aggregation)
+        return timestamps
+
+    def read(self, timestamp, **kwargs):
+        """
+        Read the mean image of a period.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Start of the period.
+
+        Returns
+        -------
+        image : Image
+            Mean of the images in the period.
+        """
+        sums, counts = {}, {}
+        lon, lat, metadata = None, None, {}
+        for t in self._images(timestamp):
+            try:
+                image = self.dataset.read(t, **kwargs)
+            except IOError:
+                continue
+            if lon is None:
+                lon, lat, metadata = image.lon, image.lat, image.metadata
+            for param, values in image.data.items():
+                values = np.ma.getdata(values)
+                valid = np.isfinite(values) & (values != _fill_value)
+                if param not in sums:
+                    sums[param] = np.zeros(values.shape, dtype=np.float64)
+                    counts[param] = np.zeros(values.shape, dtype=np.int32)
+                np.add(sums[param], values, out=sums[param], where=valid)
+                counts[param] += valid
+
+        if lon is None:
+            raise IOError(f"No images found for the period at {timestamp}")
+
+        data = {}
+        for param, total in sums.items():
+            mean = np.full(total.shape, _fill_value, dtype=np.float64)
+            np.divide(total, counts[param], out=mean, where=counts[param] > 0)
+            data[param] = mean
+        return Image(lon, lat, data, metadata, timestamp)
+
+    def close(self):
+        self.dataset.close()
@@ -0,0 +1,198 @@
+"""
+Module for writing GLDAS images into a (time, lat, lon) data cube, which is
+optimized for reading spatial slices (in contrast to the time series format).
+"""
+
+import os
+
+import numpy as np
+from netCDF4 import Dataset, date2num
+
+from gldas import interface
+from gldas.utils import last_time
+
+
+class GLDASCubeWriter:
+    """
+    Write GLDAS images into a chunked and compressed netCDF4 data cube with
+    the dimensions (time, lat, lon). The cube covers the smallest lat/lon
+    window of the global 0.25 DEG grid that contains all points of the
+    (sub)grid, latitudes are in ascending order (origin in the bottom left).
+    Points of the window that are not in the grid are set to the fill value.
+
+    The file is only opened while data is written, so the writer can be
+    passed to other processes.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the netCDF4 file to create (an existing file is replaced).
+    grid : BasicGrid or CellGrid
+        (Sub)grid of the global 0.25 DEG GLDAS grid, the data that is passed
+        to :meth:`write` must be in the order of the active gpis.
+    chunks : tuple, optional (default: (1, 120, 240))
+        Chunk shape (time, lat, lon), each size is limited to the size of
+        the cube in that dimension.
+    complevel : int, optional (default: 4)
+        zlib compression level (0 to turn off compression).
+    dtype : str, optional (default: 'float32')
+        Data type of the cube variables.
+    fill_value : float, optional (default: 9999.0)
+        Fill value for points without data.
+    attributes : dict, optional (default: None)
+        Attributes for each variable, e.g. the image metadata.
+    global_attr : dict, optional (default: None)
+        Global attributes of the file.
+    time_units : str, optional (default: 'days since 1900-01-01 00:00:00')
+        Units of the time variable.
+    append : bool, optional (default: False)
+        Append to an existing cube file (for the same grid) instead of
+        replacing it.
+    """
+
+    n_lon = 1440
+    resolution = 0.25
+
+    def __init__(
+        self,
+        filename,
+        grid,
+        chunks=(1, 120, 240),
+        complevel=4,
+        dtype="float32",
+        fill_value=9999.0,
+        attributes=None,
+        global_attr=None,
+        time_units="days since 1900-01-01 00:00:00",
+        append=False,
+    ):
+        self.filename = filename
+        self.complevel = complevel
+        self.dtype = dtype
+        self.fill_value = fill_value
+        self.attributes = attributes or {}
+        self.time_units = time_units
+
+        gpis = grid.activegpis
+        row, col = gpis // self.n_lon, gpis % self.n_lon
+        r0, c0 = row.min(), col.min()
+        n_lat, n_lon = row.max() - r0 + 1, col.max() - c0 + 1
+        self.shape = (n_lat, n_lon)
+        self.cube_idx = (row - r0) * self.shape[1] + (col - c0)
+        self.chunks = (
+            int(chunks[0]),
+            int(min(chunks[1], self.shape[0])),
+            int(min(chunks[2], self.shape[1])),
+        )
+
+        if append and os.path.isfile(filename):
+            with interface.netcdf_lock, Dataset(filename, "r") as ds:
+                if ds["lat"].size != n_lat or ds["lon"].size != n_lon:
+                    raise ValueError(
+                        f"Cube in {filename} was created for another grid"
+                    )
+                self.time_units = ds["time"].units
+            return
+
+        with interface.netcdf_lock, Dataset(filename, "w") as ds:
+            ds.setncatts(global_attr or {})
+            ds.createDimension("time", None)
+            ds.createDimension("lat", self.shape[0])
+            ds.createDimension("lon", self.shape[1])
+
+            lat = ds.createVariable("lat", "float64", ("lat",))
+            lat[:] = -90 + self.resolution * (np.arange(r0, r0 + n_lat) + 0.5)
+            lat.setncatts(
+                {"units": "degrees_north", "standard_name": "latitude"}
+            )
+            lon = ds.createVariable("lon", "float64", ("lon",))
+            lon[:] = -180 + self.resolution * (np.arange(c0, c0 + n_lon) + 0.5)
+            lon.setncatts(
+                {"units": "degrees_east", "standard_name": "longitude"}
+            )
+            time = ds.createVariable(
+                "time", "float64", ("time",), chunksizes=(self.chunks[0],)
+            )
+            time.setncatts(
+                {
+                    "units": self.time_units,
+                    "calendar": "standard",
+                    "standard_name": "time",
+                }
+            )
+
+    def _create_variable(self, ds, name):
+        var = ds.createVariable(
+            name,
+            self.dtype,
+            ("time", "lat", "lon"),
+            zlib=self.complevel > 0,
+            complevel=max(self.complevel, 1),
+            chunksizes=self.chunks,
+            fill_value=self.fill_value,
+        )
+        var.setncatts(self.attributes.get(name, {}))
+        return var
+
+    def write(self, data, timestamps, start=None):
+        """
+        Append a stack of images to the cube.
+
+        Parameters
+        ----------
+        data : dict
+            Data for each variable as array of shape (n_timestamps, n_gpi).
+        timestamps : list or np.ndarray
+            Time stamps of the images (datetime), after the last time stamp
+            that was written before.
+        start : int, optional (default: None)
+            Time index to write the first image to, e.g. to overwrite images
+            of an interrupted write. If None is passed, the images are
+            appended.
+
+        Returns
+        -------
+        n_time : int
+            Number of images in the cube after writing.
+        """
+        n_t = len(timestamps)
+
+        with interface.netcdf_lock, Dataset(self.filename, "a") as ds:
+            t0 = len(ds.dimensions["time"]) if start is None else start
+            if n_t == 0:
+                return t0
+            ds["time"][t0 : t0 + n_t] = date2num(
+                list(timestamps), self.time_units, calendar="standard"
+            )
+            for name, values in data.items():
+                if name in ds.variables:
+                    var = ds.variables[name]
+                else:
+                    var = self._create_variable(ds, name)
+                block = np.full(
+                    (n_t, self.shape[0] * self.shape[1]),
+                    self.fill_value,
+                    dtype=self.dtype,
+                )
+                block[:, self.cube_idx] = np.ma.filled(values, self.fill_value)
+                var[t0 : t0 + n_t] = block.reshape((n_t,) + self.shape)
+
+        return t0 + n_t
+
+
+def get_cube_last_timestamp(filename):
+    """
+    Find the last time stamp in a data cube file.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the data cube file.
+
+    Returns
+    -------
+    last_timestamp : datetime or None
+        Last time stamp in the cube, None if the cube is empty.
+    """
+    with interface.netcdf_lock, Dataset(filename, "r") as ds:
+        return last_time(ds["time"])
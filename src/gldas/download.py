@@ -3,201 +3,717 @@ Module managing download of NOAH GLDAS data.
 """
 
 import os
+import re
 import sys
-import glob
+import time
+import zlib
+import hashlib
 import argparse
+import warnings
+import threading
 from functools import partial
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
 
-from trollsift.parser import validate, parse, globify
-from datetime import datetime
+import requests
+from requests.cookies import RequestsCookieJar
+from datetime import datetime, timezone
 from datedown.interface import mkdate
-from datedown.dates import daily
-from datedown.urlcreator import create_dt_url
-from datedown.fname_creator import create_dt_fpath
-from datedown.interface import download_by_dt
-from datedown.down import download
 
+from gldas.inventory import ArchiveInventory
+from gldas.utils import tstamps_for_daterange
 
-def gldas_folder_get_version_first_last(
-    root, fmt=None, subpaths=["{time:%Y}", "{time:%j}"]
-):
+
+def utcnow():
+    """
+    Current time in UTC, as naive datetime like the GLDAS time stamps.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def gldas_folder_get_version_first_last(root):
     """
-    Get product version and first and last product which exists under the root folder.
+    Get product version and first and last product which exists under the
+    root folder (see ArchiveInventory).
 
     Parameters
     ----------
     root: string
-        Root folder on local filesystem
-    fmt: string, optional
-        Formatting string
-        (default: "GLDAS_NOAH025_3H.A{time:%Y%m%d.%H%M}.0{version:2s}.nc4")
-    subpaths: list, optional
-        Format of the subdirectories under root (default: ['{:%Y}', '{:%j}']).
+        Root folder on local filesystem (with %Y/%j subdirectories)
 
     Returns
     -------
     version: string
-        Found product version
+        Found product version, None if the archive is empty or contains
+        several versions.
     start: datetime.datetime
         First found product datetime
     end: datetime.datetime
         Last found product datetime
     """
-    if fmt is None:
-        fmt = "GLDAS_NOAH025_3H{ep}.A{time:%Y%m%d.%H%M}.0{version:2s}.nc4"
+    inventory = ArchiveInventory(root)
+    return inventory.version, inventory.first, inventory.last
+
+
+def get_gldas_start_date(product):
+    """
+    Get NOAH GLDAS start date.
 
-    start = None
-    end = None
-    version = None
-    first_folder = get_first_gldas_folder(root, subpaths)
-    last_folder = get_last_gldas_folder(root, subpaths)
+    Parameters
+    ----------
+    product : str
+        Product name.
+
+    Returns
+    -------
+    start_date : datetime
+        Start date of NOAH GLDAS product.
+    """
+    dt_dict = {
+        "GLDAS_Noah_v20_025": datetime(1948, 1, 1, 3),
+        "GLDAS_Noah_v21_025": datetime(2000, 1, 1, 3),
+        "GLDAS_Noah_v21_025_EP": datetime(2000, 1, 1, 3),
+    }
 
-    if first_folder is not None:
-        files = sorted(glob.glob(os.path.join(first_folder, globify(fmt))))
-        data = parse(fmt, os.path.split(files[0])[1])
-        start = data["time"]
-        ep = data["ep"]
-        version = f"GLDAS_Noah_v{data['version']}_025{data['ep']}"
+    return dt_dict[product]
 
-    if last_folder is not None:
-        files = sorted(glob.glob(os.path.join(last_folder, globify(fmt))))
-        data = parse(fmt, os.path.split(files[-1])[1])
-        end = data["time"]
 
-    return version, start, end
+# bit reversed bytes, to compute the POSIX cksum CRC with zlib
+_reversed_bits = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
 
 
-def get_last_gldas_folder(root, subpaths):
+def read_sidecar(filename):
     """
-    Get last GLDAS folder name.
+    Read the size and checksum of a granule from its (S4PA) .xml metadata
+    file, as provided next to each GLDAS image file.
 
     Parameters
     ----------
-    root : str
-        Root path.
-    subpaths : list of str
-        Subpath information.
+    filename : str
+        Path of the .xml file.
 
     Returns
     -------
-    directory : str
-        Last folder name.
+    metadata : dict
+        Size (in bytes), checksum type and checksum value of the granule,
+        None for elements that are not in the file.
     """
-    directory = root
-    for level, subpath in enumerate(subpaths):
-        last_dir = get_last_formatted_dir_in_dir(directory, subpath)
-        if last_dir is None:
-            directory = None
-            break
-        directory = os.path.join(directory, last_dir)
+    values = {}
+    for element in ElementTree.parse(filename).getroot().iter():
+        values[element.tag.split("}")[-1]] = (element.text or "").strip()
+
+    size = values.get("SizeBytesDataGranule")
+    return {
+        "size": int(size) if size else None,
+        "checksum_type": values.get("CheckSumType"),
+        "checksum": values.get("CheckSumValue"),
+    }
 
-    return directory
 
+def file_checksum(filename, checksum_type="CRC32", chunksize=1024**2):
+    """
+    Compute the checksum of a file.
 
-def get_first_gldas_folder(root, subpaths):
+    Parameters
+    ----------
+    filename : str
+        Path of the file.
+    checksum_type : str, optional (default: 'CRC32')
+        'CRC32' for the POSIX cksum CRC (as used by GES DISC) or the name of
+        a hashlib algorithm, e.g. 'MD5'.
+    chunksize : int, optional (default: 1024**2)
+        Size of the chunks that are read at once.
+
+    Returns
+    -------
+    checksum : str
+        Checksum, as decimal number for CRC32 or as hex digest.
+    """
+    if checksum_type.upper() == "CRC32":
+        # cksum uses the non-reflected CRC-32, which is the bit reversed
+        # zlib CRC of the bit reversed data, with the length appended
+        crc, length = 0xFFFFFFFF, 0
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(chunksize), b""):
+                crc = zlib.crc32(chunk.translate(_reversed_bits), crc)
+                length += len(chunk)
+        n_bytes = (length.bit_length() + 7) // 8
+        length_bytes = length.to_bytes(n_bytes, "little")
+        crc = zlib.crc32(length_bytes.translate(_reversed_bits), crc)
+        return str(int(f"{crc:032b}"[::-1], 2))
+
+    h = hashlib.new(checksum_type.lower().replace("-", ""))
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def verify_file(filename, sidecar=None, checksum=False):
     """
-    Get first GLDAS folder name.
+    Verify a downloaded file against its .xml metadata file.
 
     Parameters
     ----------
-    root : str
-        Root path.
-    subpaths : list of str
-        Subpath information.
+    filename : str
+        Path of the file.
+    sidecar : str, optional (default: None)
+        Path of the metadata file. If None is passed, the file name with
+        the extension .xml is used.
+    checksum : bool, optional (default: False)
+        Also compare the checksum, otherwise only the file size is checked.
 
     Returns
     -------
-    directory : str
-        First folder name.
+    error : str or None
+        Description of the problem, None if the file is complete.
     """
-    directory = root
-    for level, subpath in enumerate(subpaths):
-        last_dir = get_first_formatted_dir_in_dir(directory, subpath)
-        if last_dir is None:
-            directory = None
-            break
-        directory = os.path.join(directory, last_dir)
+    sidecar = filename + ".xml" if sidecar is None else sidecar
+    if not os.path.isfile(filename):
+        return "file is missing"
+    if not os.path.isfile(sidecar):
+        return "metadata file is missing"
+    try:
+        metadata = read_sidecar(sidecar)
+    except ElementTree.ParseError:
+        return "metadata file is invalid"
+
+    size = os.path.getsize(filename)
+    if metadata["size"] is not None and size != metadata["size"]:
+        return f"size is {size} bytes instead of {metadata['size']}"
 
-    return directory
+    if checksum and metadata["checksum"]:
+        value = file_checksum(filename, metadata["checksum_type"] or "CRC32")
+        if value.lower() != metadata["checksum"].lower():
+            return f"checksum is {value} instead of {metadata['checksum']}"
 
+    return None
 
-def get_last_formatted_dir_in_dir(folder, fmt):
+
+class DownloadError(IOError):
     """
-    Get the (alphabetically) last directory in a directory
-    which can be formatted according to fmt.
+    Error for a failed request.
 
     Parameters
     ----------
-    folder : str
-        Folder name.
-    fmt : str
-        Format string.
+    url : str
+        Requested URL.
+    status : int or str
+        HTTP status code of the response, or a description of the error.
+    """
 
-    Returns
-    -------
-    last_elem : str
-        Last formatted directory.
+    def __init__(self, url, status):
+        self.url = url
+        self.status = status
+        super().__init__(f"Download of {url} failed: {status}")
+
+    @property
+    def retry(self):
+        """Whether the request may succeed when it is repeated"""
+        return isinstance(self.status, int) and (
+            self.status >= 500 or self.status == 429
+        )
+
+
+class _LoginSession(requests.Session):
     """
-    last_elem = None
-    root_elements = sorted(os.listdir(folder))
-    for root_element in root_elements[::-1]:
-        if os.path.isdir(os.path.join(folder, root_element)):
-            if validate(fmt, root_element):
-                last_elem = root_element
-                break
+    requests session that also sends the credentials to the login hosts
+    when it is redirected there (requests drops them on redirects to other
+    hosts).
+    """
+
+    def __init__(self, credentials=None, auth_hosts=()):
+        super().__init__()
+        self.credentials = credentials
+        self.auth_hosts = set(auth_hosts)
 
-    return last_elem
+    def rebuild_auth(self, prepared_request, response):
+        super().rebuild_auth(prepared_request, response)
+        host = urlsplit(prepared_request.url).hostname
+        if self.credentials is not None and host in self.auth_hosts:
+            prepared_request.prepare_auth(self.credentials)
 
 
-def get_first_formatted_dir_in_dir(folder, fmt):
+class HTTPSession:
     """
-    Get the (alphabetically) first directory in a directory
-    which can be formatted according to fmt.
+    HTTP(S) client for the NASA Earthdata login, based on a requests
+    session: persistent (keep-alive) connections, cookies, redirects and
+    basic authentication. A session must only be used by one thread at a
+    time.
 
     Parameters
     ----------
-    folder : str
-        Folder name.
-    fmt : str
-        Format string.
+    username : str, optional (default: None)
+        Username for basic authentication.
+    password : str, optional (default: None)
+        Password for basic authentication.
+    cookies : http.cookiejar.CookieJar, optional (default: None)
+        Cookie jar, can be shared between sessions to reuse a login.
+    auth_hosts : tuple, optional (default: ("urs.earthdata.nasa.gov",))
+        Hosts that the credentials are sent to without being asked for.
+        Other hosts get them only when they answer with 401.
+    timeout : float, optional (default: 60)
+        Timeout for connecting and reading in seconds.
+    max_redirects : int, optional (default: 10)
+        Maximum number of redirects to follow for one request.
+    """
 
-    Returns
-    -------
-    first_elem : str
-        First formatted directory.
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        cookies=None,
+        auth_hosts=("urs.earthdata.nasa.gov",),
+        timeout=60,
+        max_redirects=10,
+    ):
+        if username is not None and password is not None:
+            credentials = (username, password)
+        else:
+            credentials = None
+        self.session = _LoginSession(credentials, auth_hosts)
+        self.session.max_redirects = max_redirects
+        if cookies is not None:
+            self.session.cookies = cookies
+        self.cookies = self.session.cookies
+        self.timeout = timeout
+
+    def _request(self, url, auth=None):
+        try:
+            return self.session.get(
+                url, auth=auth, stream=True, timeout=self.timeout
+            )
+        except requests.TooManyRedirects:
+            raise DownloadError(url, "too many redirects")
+
+    def get(self, url, target=None, chunksize=1024**2):
+        """
+        Request a URL and follow redirects.
+
+        Parameters
+        ----------
+        url : str
+            URL to request.
+        target : str, optional (default: None)
+            Path to store the content in. The content is written to a
+            temporary file first, which is renamed when it is complete.
+            If None is passed, the content is returned.
+        chunksize : int, optional (default: 1024**2)
+            Size of the chunks that are written to the target file.
+
+        Returns
+        -------
+        content : bytes or str
+            The content, or the target path.
+        """
+        credentials = self.session.credentials
+        auth = None
+        if urlsplit(url).hostname in self.session.auth_hosts:
+            auth = credentials
+        response = self._request(url, auth=auth)
+        if response.status_code == 401 and credentials and auth is None:
+            # read the body, so that the connection is reused
+            response.content
+            response = self._request(response.url, auth=credentials)
+
+        with response:
+            if response.status_code != 200:
+                response.content
+                raise DownloadError(url, response.status_code)
+
+            if target is None:
+                return response.content
+
+            tmp_file = target + ".part"
+            with open(tmp_file, "wb") as f:
+                for chunk in response.iter_content(chunksize):
+                    f.write(chunk)
+            length = response.headers.get("Content-Length")
+            if (
+                length is not None
+                and "Content-Encoding" not in response.headers
+                and os.path.getsize(tmp_file) != int(length)
+            ):
+                os.remove(tmp_file)
+                raise DownloadError(url, "incomplete transfer")
+            os.replace(tmp_file, target)
+            return target
+
+    def close(self):
+        """Close all connections"""
+        self.session.close()
+
+
+class GLDASDownloader:
     """
-    first_elem = None
-    root_elements = sorted(os.listdir(folder))
-    for root_element in root_elements:
-        if os.path.isdir(os.path.join(folder, root_element)):
-            if validate(fmt, root_element):
-                first_elem = root_element
-                break
+    Download engine for GLDAS image files. A bounded pool of worker threads
+    downloads the individual files concurrently, each worker reuses its own
+    persistent session (the login cookies are shared). Failed requests are
+    repeated with exponential backoff.
 
-    return first_elem
+    Parameters
+    ----------
+    n_workers : int, optional (default: 4)
+        Number of concurrent downloads (and sessions).
+    username : str, optional (default: None)
+        Earthdata username.
+    password : str, optional (default: None)
+        Earthdata password.
+    retries : int, optional (default: 3)
+        How often a failed request is repeated.
+    backoff : float, optional (default: 1.0)
+        Wait time before the first repetition in seconds, doubled for each
+        further repetition.
+    session_kws : dict, optional (default: None)
+        Additional keyword arguments for each HTTPSession.
+    """
 
+    def __init__(
+        self,
+        n_workers=4,
+        username=None,
+        password=None,
+        retries=3,
+        backoff=1.0,
+        session_kws=None,
+    ):
+        self.n_workers = n_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.session_kws = dict(session_kws or {})
+        self.session_kws.update(username=username, password=password)
+        self.session_kws.setdefault("cookies", RequestsCookieJar())
+
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _session(self):
+        """Session of the current thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = HTTPSession(**self.session_kws)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _retry(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except DownloadError as e:
+                if not e.retry or attempt == self.retries:
+                    raise
+            except (requests.RequestException, OSError):
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2**attempt)
+
+    def list_files(self, url, filetypes=("nc4", "nc4.xml")):
+        """
+        Get the names of the files in a remote directory (listing).
+
+        Parameters
+        ----------
+        url : str
+            URL of the directory.
+        filetypes : tuple, optional (default: ("nc4", "nc4.xml"))
+            File extensions to include.
+
+        Returns
+        -------
+        fnames : list
+            Sorted file names.
+        """
+        content = self._retry(self._session().get, url.rstrip("/") + "/")
+        content = content.decode(errors="ignore")
+        hrefs = re.findall(r'href="([^"?#]+)"', content)
+        fnames = {
+            href.rstrip("/").split("/")[-1]
+            for href in hrefs
+            if any(href.endswith("." + ft) for ft in filetypes)
+        }
+        return sorted(fnames)
+
+    def download_file(self, url, target):
+        """
+        Download one file. The target directory is created if necessary.
+
+        Parameters
+        ----------
+        url : str
+            URL of the file.
+        target : str
+            Local path of the file.
+
+        Returns
+        -------
+        target : str
+            Local path of the file.
+        """
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return self._retry(self._session().get, url, target)
+
+    def download_dirs(
+        self, dirs, filetypes=("nc4", "nc4.xml"), verify="size"
+    ):
+        """
+        Download all files of remote directories, files that exist locally
+        (and pass the verification) are skipped.
+
+        Parameters
+        ----------
+        dirs : list
+            Tuples of the URL of a remote directory, the local path to
+            store its files in and optionally the number of data files the
+            directory is expected to contain. A local directory that
+            contains this number of verified files is skipped without
+            requesting its listing.
+        filetypes : tuple, optional (default: ("nc4", "nc4.xml"))
+            File extensions to download.
+        verify : str or None, optional (default: 'size')
+            Verify files against their .xml metadata files: 'size' compares
+            the file size, 'checksum' also the checksum. Files that fail are
+            downloaded again, up to the number of retries. None to only
+            check whether files exist.
+
+        Returns
+        -------
+        failed : list
+            Tuples of URL and error for each directory or file that could
+            not be downloaded.
+        """
+        failed = []
+        check = partial(self._check, verify=verify)
+
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            dirs = [
+                d
+                for d, complete in zip(
+                    dirs,
+                    executor.map(
+                        lambda d: self._dir_complete(d, filetypes, check),
+                        dirs,
+                    ),
+                )
+                if not complete
+            ]
+            listings = list(
+                executor.map(
+                    lambda d: self._safe(
+                        failed, self.list_files, d[0], filetypes
+                    ),
+                    dirs,
+                )
+            )
+            files = [
+                (url.rstrip("/") + "/" + fname, os.path.join(path, fname))
+                for (url, path, *_), fnames in zip(dirs, listings)
+                if fnames is not None
+                for fname in fnames
+            ]
+            self._fetch(executor, files, verify, failed)
+
+        return failed
+
+    def download_files(self, files, verify="size"):
+        """
+        Download individual files together with their .xml metadata files,
+        files that exist locally (and pass the verification) are skipped.
+
+        Parameters
+        ----------
+        files : list
+            Tuples of the URL of a file and the local path to store it in.
+        verify : str or None, optional (default: 'size')
+            Verify files against their .xml metadata files, see
+            `download_dirs`.
+
+        Returns
+        -------
+        failed : list
+            Tuples of URL and error for each file that could not be
+            downloaded.
+        """
+        failed = []
+        files = [
+            f
+            for url, path in files
+            for f in [(url, path), (url + ".xml", path + ".xml")]
+        ]
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            self._fetch(executor, files, verify, failed)
+        return failed
+
+    @staticmethod
+    def _safe(failed, func, url, *args):
+        """Call func, errors are added to the failed requests"""
+        try:
+            return func(url, *args)
+        except (requests.RequestException, OSError) as e:
+            failed.append((url, e))
+            return None
+
+    @staticmethod
+    def _check(path, has_sidecar, verify):
+        """Problem with a local file, None if it is complete"""
+        if not (verify and has_sidecar):
+            return None if os.path.isfile(path) else "file is missing"
+        return verify_file(path, checksum=verify == "checksum")
+
+    def _fetch(self, executor, files, verify, failed):
+        """
+        Download files (URL and local path) that are missing or fail the
+        verification. The metadata files are downloaded first, they are
+        needed to verify the data files.
+        """
+
+        def sidecar_ok(path):
+            try:
+                read_sidecar(path)
+                return True
+            except (ElementTree.ParseError, OSError):
+                return False
+
+        sidecars = [f for f in files if f[1].endswith(".xml")]
+        names = {path for _, path in sidecars}
+        data = [
+            (url, path, path + ".xml" in names)
+            for url, path in files
+            if not path.endswith(".xml")
+        ]
+        list(
+            executor.map(
+                lambda d: self._safe(failed, self.download_file, *d),
+                [d for d in sidecars if not sidecar_ok(d[1])],
+            )
+        )
 
-def get_gldas_start_date(product):
+        downloads = [d for d in data if self._check(*d[1:], verify)]
+        for attempt in range(self.retries + 1):
+            if not downloads:
+                break
+            list(
+                executor.map(
+                    lambda d: self._safe(failed, self.download_file, *d[:2]),
+                    downloads,
+                )
+            )
+            # files that could not be downloaded are already reported
+            downloads = [
+                d
+                for d in downloads
+                if os.path.isfile(d[1]) and self._check(*d[1:], verify)
+            ]
+
+        for url, path, has_sidecar in downloads:
+            error = self._check(path, has_sidecar, verify)
+            os.remove(path)
+            failed.append(
+                (url, DownloadError(url, f"verification failed: {error}"))
+            )
+
+    @staticmethod
+    def _dir_complete(d, filetypes, check):
+        """Whether a local directory holds the expected number of files"""
+        if len(d) < 3 or d[2] is None or not os.path.isdir(d[1]):
+            return False
+        datatypes = tuple(
+            "." + f for f in filetypes if not f.endswith(".xml")
+        )
+        with os.scandir(d[1]) as it:
+            paths = [
+                e.path
+                for e in it
+                if e.is_file() and e.name.endswith(datatypes)
+            ]
+        if len(paths) < d[2]:
+            return False
+        has_sidecar = any(f.endswith(".xml") for f in filetypes)
+        return all(check(p, has_sidecar) is None for p in paths)
+
+    def close(self):
+        """Close the connections of all sessions"""
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+
+
+def plan_downloads(
+    inventory,
+    start,
+    end,
+    first,
+    urlroot,
+    urlsubdirs,
+    fname_templ,
+    subdirs=("%Y", "%j"),
+):
     """
-    Get NOAH GLDAS start date.
+    Plan the download of the 3-hourly images of all days in a period that
+    are not in the local archive. The images of days that are partly
+    available are requested individually (only the missing ones are
+    downloaded), days without any local image are downloaded completely
+    (from the listing of their remote directory).
 
     Parameters
     ----------
-    product : str
-        Product name.
+    inventory : gldas.inventory.ArchiveInventory
+        Inventory of the local archive.
+    start : datetime
+        First day of the period.
+    end : datetime
+        Last day of the period, images are planned until 21:00 of this
+        day, but not after the current time.
+    first : datetime
+        First image of the product.
+    urlroot : str
+        Root URL of the product, e.g. "https://hydro1.gesdisc.eosdis.nasa.gov"
+    urlsubdirs : list
+        Remote subdirectories, as strftime formats.
+    fname_templ : str
+        Image file name, as strftime format.
+    subdirs : tuple, optional (default: ("%Y", "%j"))
+        Local subdirectories, as strftime formats.
 
     Returns
     -------
-    start_date : datetime
-        Start date of NOAH GLDAS product.
+    dirs : list
+        Tuples of the URL of a remote directory, the local directory and
+        the number of images of the day, for days that are either complete
+        (verified locally by `GLDASDownloader.download_dirs`) or missing.
+    files : list
+        Tuples of the URL of an image file and its local path, for the
+        images of days that are partly available.
     """
-    dt_dict = {
-        "GLDAS_Noah_v20_025": datetime(1948, 1, 1, 3),
-        "GLDAS_Noah_v21_025": datetime(2000, 1, 1, 3),
-        "GLDAS_Noah_v21_025_EP": datetime(2000, 1, 1, 3),
-    }
-
-    return dt_dict[product]
+    start = max(datetime(start.year, start.month, start.day), first)
+    end = min(datetime(end.year, end.month, end.day, 21), utcnow())
+
+    days = {}
+    for t in tstamps_for_daterange(start, end, as_list=True):
+        days.setdefault(t.date(), []).append(t)
+
+    dirs, files = [], []
+    for timestamps in days.values():
+        t = timestamps[0]
+        url = "/".join([urlroot] + [t.strftime(d) for d in urlsubdirs])
+        path = os.path.join(inventory.root, *[t.strftime(d) for d in subdirs])
+        n_missing = sum(t not in inventory.files for t in timestamps)
+        if n_missing in (0, len(timestamps)):
+            dirs.append((url, path, len(timestamps)))
+        else:
+            # existing files are verified locally and skipped
+            files += [
+                (
+                    url + "/" + t.strftime(fname_templ),
+                    os.path.join(path, t.strftime(fname_templ)),
+                )
+                for t in timestamps
+            ]
+    return dirs, files
 
 
 def parse_args(args):
@@ -230,8 +746,9 @@ def parse_args(args):
         type=mkdate,
         help=(
             "Startdate as YYYY-MM-DD. "
-            "If not given then the target"
-            "folder is scanned for a start date. If no data"
+            "If not given then the target "
+            "folder is scanned for the first missing image "
+            "(or the last image if there are no gaps). If no data "
             "is found there then the first available date "
             "of the product is used."
         ),
@@ -278,27 +795,49 @@ def parse_args(args):
 
     parser.add_argument(
         "--n_proc",
-        default=1,
+        default=4,
+        type=int,
+        help="Number of files to download concurrently.",
+    )
+
+    parser.add_argument(
+        "--retries",
+        default=3,
         type=int,
-        help="Number of parallel processes to use for" "downloading.",
+        help="How often a failed request is repeated (with backoff).",
+    )
+
+    parser.add_argument(
+        "--verify",
+        choices=["none", "size", "checksum"],
+        default="size",
+        help=(
+            "Verify downloaded (and existing) files against their .xml "
+            "metadata files\nand download files that fail again. "
+            "Days with complete files are skipped\nwithout contacting "
+            "the server. Default: size"
+        ),
     )
 
     args = parser.parse_args(args)
     # set defaults that can not be handled by argparse
 
     # Compare versions to prevent mixing data sets
-    version, first, last = gldas_folder_get_version_first_last(args.localroot)
-    if args.product and version and (args.product != version):
+    inventory = ArchiveInventory(args.localroot)
+    versions = set(inventory.versions)
+    if args.product and versions and (versions != {args.product}):
         raise Exception(
             "Error: Found products of different version ({}) "
-            "in {}. Abort download!".format(version, args.localroot)
+            "in {}. Abort download!".format(
+                ", ".join(sorted(versions)), args.localroot
+            )
         )
 
     if args.start is None or args.end is None:
         if not args.product:
-            args.product = version
+            args.product = inventory.version
         if args.start is None:
-            if last is None:
+            if inventory.last is None:
                 if args.product:
                     args.start = get_gldas_start_date(args.product)
                 else:
@@ -306,27 +845,35 @@ def parse_args(args):
                     # start time, because it has the longest time span
                     args.start = get_gldas_start_date("GLDAS_Noah_v20_025")
             else:
-                args.start = last
+                # continue at the first gap in the archive, complete days
+                # after it are skipped
+                missing = inventory.missing()
+                args.start = missing[0] if missing else inventory.last
         if args.end is None:
-            args.end = datetime.now()
+            args.end = utcnow()
 
     prod_urls = {
         "GLDAS_Noah_v20_025": {
             "root": "hydro1.gesdisc.eosdis.nasa.gov",
             "dirs": ["data", "GLDAS", "GLDAS_NOAH025_3H.2.0", "%Y", "%j"],
+            "fname": "GLDAS_NOAH025_3H.A%Y%m%d.%H%M.020.nc4",
         },
         "GLDAS_Noah_v21_025": {
             "root": "hydro1.gesdisc.eosdis.nasa.gov",
             "dirs": ["data", "GLDAS", "GLDAS_NOAH025_3H.2.1", "%Y", "%j"],
+            "fname": "GLDAS_NOAH025_3H.A%Y%m%d.%H%M.021.nc4",
         },
         "GLDAS_Noah_v21_025_EP": {
             "root": "hydro1.gesdisc.eosdis.nasa.gov",
             "dirs": ["data", "GLDAS", "GLDAS_NOAH025_3H_EP.2.1", "%Y", "%j"],
+            "fname": "GLDAS_NOAH025_3H_EP.A%Y%m%d.%H%M.021.nc4",
         },
     }
 
     args.urlroot = prod_urls[args.product]["root"]
     args.urlsubdirs = prod_urls[args.product]["dirs"]
+    args.fname_templ = prod_urls[args.product]["fname"]
+    args.inventory = inventory
     args.localsubdirs = ["%Y", "%j"]
 
     print(
@@ -349,28 +896,53 @@ def main(args):
     """
     args = parse_args(args)
 
-    dts = list(daily(args.start, args.end))
-    url_create_fn = partial(
-        create_dt_url, root=args.urlroot, fname="", subdirs=args.urlsubdirs
-    )
-    fname_create_fn = partial(
-        create_dt_fpath,
-        root=args.localroot,
-        fname="",
+    urlroot = args.urlroot
+    if "://" not in urlroot:
+        urlroot = "https://" + urlroot
+
+    dirs, files = plan_downloads(
+        args.inventory,
+        args.start,
+        args.end,
+        get_gldas_start_date(args.product),
+        urlroot,
+        args.urlsubdirs,
+        args.fname_templ,
         subdirs=args.localsubdirs,
     )
+    print(
+        f"Checking {len(files)} images of partly available days "
+        f"individually and {len(dirs)} days as a whole."
+    )
 
-    down_func = partial(
-        download,
-        num_proc=args.n_proc,
+    downloader = GLDASDownloader(
+        n_workers=args.n_proc,
         username=args.username,
-        password="'" + args.password + "'",
-        recursive=True,
-        filetypes=["nc4", "nc4.xml"],
+        password=args.password,
+        retries=args.retries,
     )
-    download_by_dt(
-        dts, url_create_fn, fname_create_fn, down_func, recursive=True
+    verify = None if args.verify == "none" else args.verify
+    failed = downloader.download_dirs(
+        dirs, filetypes=("nc4", "nc4.xml"), verify=verify
     )
+    failed += downloader.download_files(files, verify=verify)
+    downloader.close()
+
+    # recent images are published with a delay
+    unavailable = [
+        url for url, e in failed if getattr(e, "status", None) == 404
+    ]
+    failed = [(url, e) for url, e in failed if url not in unavailable]
+    if len(unavailable) > 0:
+        print(
+            f"{len(unavailable)} days / files are not available (yet):\n"
+            + "\n".join(unavailable)
+        )
+    if len(failed) > 0:
+        warnings.warn(
+            "Not all files were downloaded:\n"
+            + "\n".join(f"{url}: {e}" for url, e in failed)
+        )
 
 
 def run():
@@ -0,0 +1,289 @@
+"""
+Module for indexing the image files of a local GLDAS archive, so that the
+file for a time stamp can be found without searching the file system.
+"""
+
+import os
+import re
+import json
+from datetime import datetime
+from threading import RLock
+
+# regular expressions for the strftime directives used in GLDAS file names
+_directive_regex = {
+    "%Y": r"\d{4}",
+    "%m": r"\d{2}",
+    "%d": r"\d{2}",
+    "%j": r"\d{3}",
+    "%H": r"\d{2}",
+    "%M": r"\d{2}",
+}
+
+
+def templ2regex(fname_templ, datetime_format, dtime_placeholder="datetime"):
+    """
+    Create a regular expression from a (glob) file name template, as used
+    by the image datasets, to find and parse matching file names.
+
+    Parameters
+    ----------
+    fname_templ : str
+        File name template, e.g. "GLDAS_NOAH025_3H*.A{datetime}.*.nc4"
+    datetime_format : str
+        Format of the datetime in the file name, e.g. "%Y%m%d.%H%M"
+    dtime_placeholder : str, optional (default: "datetime")
+        Placeholder for the datetime in the template.
+
+    Returns
+    -------
+    regex : re.Pattern
+        Compiled expression with a group `datetime`.
+    """
+    dt_regex = re.escape(datetime_format)
+    for directive, regex in _directive_regex.items():
+        dt_regex = dt_regex.replace(re.escape(directive), regex)
+
+    parts = [
+        re.escape(p).replace(r"\*", ".*").replace(r"\?", ".")
+        for p in fname_templ.split("{" + dtime_placeholder + "}")
+    ]
+
+    return re.compile(
+        "^" + f"(?P<datetime>{dt_regex})".join(parts) + "$"
+    )
+
+
+class FileIndex:
+    """
+    In-memory index of the image files below a root directory, mapping the
+    image time stamps to the file paths. The index is created from one walk
+    through the directory tree, and can be stored in a (json) sidecar file
+    to reuse it in later sessions.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the image files.
+    fname_templ : str
+        Image file name template, e.g. "GLDAS_NOAH025_3H*.A{datetime}.*.nc4"
+    datetime_format : str
+        Format of the datetime in the file names, e.g. "%Y%m%d.%H%M"
+    n_subdirs : int, optional (default: 2)
+        Number of directory levels below the root, e.g. 2 for %Y/%j.
+    index_file : str, optional (default: None)
+        Path to the sidecar file to load the index from and store it to.
+        If None is passed, the index is only kept in memory. An index that
+        is loaded from the file is used without scanning the directories,
+        it is only updated when a time stamp is not found in it (once) or
+        when refresh is called.
+
+    The index can be shared by several threads (e.g. the threads that read
+    images ahead), updating and storing it is done by one thread at a time.
+    """
+
+    def __init__(
+        self,
+        root,
+        fname_templ,
+        datetime_format,
+        n_subdirs=2,
+        index_file=None,
+    ):
+        self.root = root
+        self.fname_templ = fname_templ
+        self.datetime_format = datetime_format
+        self.n_subdirs = n_subdirs
+        self.index_file = index_file
+        self.regex = templ2regex(fname_templ, datetime_format)
+        self._lock = RLock()
+
+        # directory (relative to root) -> (mtime, {filename: timestamp})
+        self.dirs = {}
+        self.lookup = {}
+        # whether the index was loaded and not updated since
+        self.stale = False
+
+        if index_file is not None and os.path.isfile(index_file):
+            self.load()
+        if not self.stale:
+            self.refresh()
+
+    def __getstate__(self):
+        # the lock can not be pickled, the copy (e.g. in another process)
+        # gets its own
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = RLock()
+
+    def _leaf_dirs(self):
+        """
+        Find all directories at the lowest subdirectory level.
+        """
+        dirs = [""]
+        for _ in range(self.n_subdirs):
+            subdirs = []
+            for d in dirs:
+                with os.scandir(os.path.join(self.root, d)) as it:
+                    subdirs.extend(
+                        os.path.join(d, e.name) for e in it if e.is_dir()
+                    )
+            dirs = subdirs
+        return dirs
+
+    def _scan_dir(self, reldir):
+        """
+        Find and parse all matching image files in a directory.
+        """
+        files = {}
+        with os.scandir(os.path.join(self.root, reldir)) as it:
+            for entry in it:
+                match = self.regex.match(entry.name)
+                if match is None or not entry.is_file():
+                    continue
+                files[entry.name] = datetime.strptime(
+                    match.group("datetime"), self.datetime_format
+                )
+        return files
+
+    def refresh(self):
+        """
+        Update the index. Only directories that are new or whose content
+        changed since the last update (e.g. days that were downloaded in
+        the meantime) are scanned for files.
+
+        Returns
+        -------
+        n_changed : int
+            Number of updated directories.
+        """
+        with self._lock:
+            changed = 0
+            leaf_dirs = set(self._leaf_dirs())
+
+            for reldir in list(self.dirs.keys()):
+                if reldir not in leaf_dirs:
+                    self.dirs.pop(reldir)
+                    changed += 1
+
+            for reldir in sorted(leaf_dirs):
+                mtime = os.stat(os.path.join(self.root, reldir)).st_mtime_ns
+                if reldir in self.dirs and self.dirs[reldir][0] == mtime:
+                    continue
+                self.dirs[reldir] = (mtime, self._scan_dir(reldir))
+                changed += 1
+
+            if changed > 0:
+                self._build_lookup()
+                if self.index_file is not None:
+                    self.save()
+            self.stale = False
+
+        return changed
+
+    def _build_lookup(self):
+        # replace the lookup at once, it is read without the lock
+        lookup = {}
+        for reldir, (_, files) in self.dirs.items():
+            for fname, timestamp in files.items():
+                path = os.path.join(self.root, reldir, fname)
+                lookup.setdefault(timestamp, []).append(path)
+        self.lookup = lookup
+
+    def get(self, timestamp):
+        """
+        Get the paths of all image files for a time stamp. If the index was
+        loaded from a file and has no file for the time stamp, it is
+        updated first.
+
+        Parameters
+        ----------
+        timestamp : datetime
+            Image time stamp.
+
+        Returns
+        -------
+        filenames : list
+            Paths of the found files (empty if there is no file).
+        """
+        if self.stale and timestamp not in self.lookup:
+            with self._lock:
+                # another thread may have updated the index in the meantime
+                if self.stale and timestamp not in self.lookup:
+                    self.refresh()
+        return list(self.lookup.get(timestamp, []))
+
+    @property
+    def timestamps(self):
+        """Sorted time stamps of all indexed images"""
+        return sorted(self.lookup.keys())
+
+    def save(self, index_file=None):
+        """
+        Store the index in a json sidecar file.
+
+        Parameters
+        ----------
+        index_file : str, optional (default: None)
+            Path to the file. If None is passed, the path from the
+            initialisation is used.
+        """
+        index_file = index_file or self.index_file
+        with self._lock:
+            content = {
+                "fname_templ": self.fname_templ,
+                "datetime_format": self.datetime_format,
+                "dirs": {
+                    reldir: {
+                        "mtime": mtime,
+                        "files": {
+                            f: t.isoformat()
+                            for f, t in sorted(files.items())
+                        },
+                    }
+                    for reldir, (mtime, files) in sorted(self.dirs.items())
+                },
+            }
+            # write to a temporary file first, in case of concurrent processes
+            tmp_file = f"{index_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(content, f)
+            os.replace(tmp_file, index_file)
+
+    def load(self, index_file=None):
+        """
+        Load the index from a json sidecar file. Index files created for a
+        different file name template are ignored.
+
+        Parameters
+        ----------
+        index_file : str, optional (default: None)
+            Path to the file. If None is passed, the path from the
+            initialisation is used.
+        """
+        index_file = index_file or self.index_file
+        with open(index_file) as f:
+            content = json.load(f)
+
+        if (content["fname_templ"] != self.fname_templ) or (
+            content["datetime_format"] != self.datetime_format
+        ):
+            return
+
+        dirs = {
+            reldir: (
+                d["mtime"],
+                {
+                    f: datetime.fromisoformat(t)
+                    for f, t in d["files"].items()
+                },
+            )
+            for reldir, d in content["dirs"].items()
+        }
+        with self._lock:
+            self.dirs = dirs
+            self._build_lookup()
+            self.stale = True
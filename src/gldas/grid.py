@@ -1,6 +1,7 @@
 import numpy as np
-from pygeogrids.grids import BasicGrid
+from pygeogrids.grids import BasicGrid, CellGrid
 from netCDF4 import Dataset
+from functools import cached_property, lru_cache
 import os
 
 def subgrid4bbox(grid, min_lon, min_lat, max_lon, max_lat):
@@ -39,22 +40,217 @@ def subgrid4bbox(grid, min_lon, min_lat, max_lon, max_lat):
     return grid.subgrid_from_gpis(bbox_gpis)
 
 
-def GLDAS025Grids(only_land=False):
+class GLDASImageIndex:
     """
-    Create global 0.25 DEG gldas grids (origin in bottom left)
+    Precomputed index to gather the points of a (sub)grid from GLDAS image
+    files.
+
+    GLDAS image files contain 600 x 1440 points, the southernmost 120 rows of
+    the global 0.25 DEG grid (below 60 DEG S) are not stored. The index
+    contains the smallest window of rows and columns in the file arrays that
+    covers all grid points and the position of each grid point in it. Points
+    that are not stored in the files are set to a fill value.
 
     Parameters
-    ---------
-    only_land : bool, optional (default: False)
-        Uses the land mask to reduce the GLDAS 0.25DEG land grid to land points
-        only.
+    ----------
+    grid : BasicGrid or CellGrid
+        (Sub)grid of the global 0.25 DEG GLDAS grid.
+    """
+
+    n_lon = 1440
+    n_lat = 720
+    n_skip_rows = 120
+
+    def __init__(self, grid):
+        gpis = grid.activegpis
+        self.n_gpi = gpis.size
+        self._lon = grid.activearrlon
+        self._lat = grid.activearrlat
+
+        row = gpis // self.n_lon - self.n_skip_rows
+        col = gpis % self.n_lon
+        self.outside = np.flatnonzero(row < 0)
+        self._row = np.where(row < 0, 0, row)
+        self._col = np.where(row < 0, 0, col)
+
+        if self.outside.size == self.n_gpi:
+            self.rows, self.cols = slice(0, 0), slice(0, 0)
+            self.window_idx = np.zeros(self.n_gpi, dtype=np.intp)
+        else:
+            inside = row >= 0
+            r0, c0 = row[inside].min(), col[inside].min()
+            self.rows = slice(r0, row[inside].max() + 1)
+            self.cols = slice(c0, col[inside].max() + 1)
+            self.window_idx = (self._row - r0) * (self.cols.stop - c0) + (
+                self._col - c0
+            )
+            self.window_idx[self.outside] = 0
+
+    @property
+    def window_shape(self):
+        """Shape of the file window that covers all grid points"""
+        return (
+            self.rows.stop - self.rows.start,
+            self.cols.stop - self.cols.start,
+        )
+
+    @cached_property
+    def file_idx(self):
+        """Position of each grid point in the flattened file array"""
+        return self._row * self.n_lon + self._col
+
+    @cached_property
+    def _flip_order(self):
+        """Order of the grid points in the flipped (north up) 2D layout"""
+        return np.flipud(
+            np.arange(self.n_gpi).reshape(self.n_lat, self.n_lon)
+        ).ravel()
+
+    @cached_property
+    def _flip_outside(self):
+        outside = np.zeros(self.n_gpi, dtype=bool)
+        outside[self.outside] = True
+        return np.flatnonzero(outside[self._flip_order])
+
+    @cached_property
+    def _flip_window_idx(self):
+        return self.window_idx[self._flip_order]
+
+    @cached_property
+    def _flip_file_idx(self):
+        return self.file_idx[self._flip_order]
+
+    def _take_idx(self, window, flip):
+        if flip:
+            idx = self._flip_window_idx if window else self._flip_file_idx
+            return idx, self._flip_outside
+        else:
+            idx = self.window_idx if window else self.file_idx
+            return idx, self.outside
+
+    @cached_property
+    def lonlat_2d(self):
+        """
+        Read-only 2D (720 x 1440, north up) longitudes and latitudes of the
+        grid points. Only available for the global grid.
+        """
+        coords = []
+        for arr in (self._lon, self._lat):
+            arr = np.ascontiguousarray(
+                np.flipud(arr.reshape(self.n_lat, self.n_lon))
+            )
+            arr.flags.writeable = False
+            coords.append(arr)
+        return tuple(coords)
+
+    def gather(
+        self, data, window=True, fill_value=9999.0, out=None, flip=False
+    ):
+        """
+        Gather the grid points from a file array in one pass.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Either the window ``[rows, cols]`` or the full file array read
+            from a GLDAS image file.
+        window : bool, optional (default: True)
+            Set to False if the full file array is passed.
+        fill_value : float, optional (default: 9999.0)
+            Value for points that are not stored in the file.
+        out : np.ndarray, optional (default: None)
+            Array of size n_gpi that is filled in place. If None is passed,
+            a new float64 array is created.
+        flip : bool, optional (default: False)
+            Gather the points of the global grid directly in the order of the
+            flipped (north up) 2D layout, see :attr:`lonlat_2d`.
+
+        Returns
+        -------
+        out : np.ndarray
+            Data for each grid point.
+        """
+        if out is None:
+            out = np.empty(self.n_gpi, dtype=np.float64)
+
+        idx, outside = self._take_idx(window, flip)
+        data = np.asarray(data, dtype=out.dtype).ravel()
+        if data.size > 0:
+            np.take(data, idx, out=out)
+        out[outside] = fill_value
+
+        return out
+
+    def gather_stack(
+        self, data, window=True, fill_value=9999.0, out=None, flip=False
+    ):
+        """
+        Gather the grid points for a stack of parameters in one pass.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Stack of file arrays, i.e. the window ``[rows, cols]`` or the full
+            file array for each parameter along the first axis.
+        window : bool, optional (default: True)
+            Set to False if the full file arrays are passed.
+        fill_value : float, optional (default: 9999.0)
+            Value for points that are not stored in the file.
+        out : np.ndarray, optional (default: None)
+            Array of shape (n_params, n_gpi) that is filled in place. If None
+            is passed, a new float64 array is created.
+        flip : bool, optional (default: False)
+            Gather the points of the global grid directly in the order of the
+            flipped (north up) 2D layout, see :attr:`lonlat_2d`.
+
+        Returns
+        -------
+        out : np.ndarray
+            Data for each parameter (rows) and grid point (columns).
+        """
+        if out is None:
+            out = np.empty((len(data), self.n_gpi), dtype=np.float64)
+
+        idx, outside = self._take_idx(window, flip)
+        data = np.asarray(data, dtype=out.dtype)
+        n_params = data.shape[0]
+        data = data.reshape(n_params, int(np.prod(data.shape[1:])))
+        if data.size > 0:
+            # taking each (contiguous) row is faster than one strided take
+            for i in range(n_params):
+                np.take(data[i], idx, out=out[i])
+        out[:, outside] = fill_value
+
+        return out
+
+
+def image_index(grid):
+    """
+    Get the image file index for a grid. The index is created once and
+    cached on the grid object.
+
+    Parameters
+    ----------
+    grid : BasicGrid or CellGrid
+        (Sub)grid of the global 0.25 DEG GLDAS grid.
 
     Returns
-    --------
-    grid : pygeogrids.CellGrid
-        Either a land grid or a global grid
+    -------
+    index : GLDASImageIndex
+        Image file index for the grid.
     """
+    try:
+        return grid._gldas_image_index
+    except AttributeError:
+        grid._gldas_image_index = GLDASImageIndex(grid)
+        return grid._gldas_image_index
+
 
+def _create_grid_arrays():
+    """
+    Compute the coordinates and cells of the global 0.25 DEG grid and the
+    gpis of the land points from the land mask.
+    """
     resolution = 0.25
     glob_lons = np.arange(
         -180 + resolution / 2, 180 + resolution / 2, resolution
@@ -63,42 +259,120 @@ def GLDAS025Grids(only_land=False):
         -90 + resolution / 2, 90 + resolution / 2, resolution
     )
     lon, lat = np.meshgrid(glob_lons, glob_lats)
-    glob_grid = BasicGrid(lon.flatten(), lat.flatten()).to_cell_grid(
-        cellsize=5.0
-    )
+    # the kd-tree is not needed for the intermediate grid
+    glob_grid = BasicGrid(
+        lon.flatten(), lat.flatten(), setup_kdTree=False
+    ).to_cell_grid(cellsize=5.0)
 
-    if only_land:
-        ds = Dataset(
-            os.path.join(
-                os.path.abspath(os.path.dirname(__file__)),
-                "GLDASp4_landmask_025d.nc4",
-            )
+    with Dataset(
+        os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            "GLDASp4_landmask_025d.nc4",
         )
+    ) as ds:
         land_lats = ds.variables["lat"][:]
         land_mask = ds.variables["GLDAS_mask"][:].flatten().filled() == 0.0
-        dlat = glob_lats.size - land_lats.size
+    dlat = glob_lats.size - land_lats.size
+
+    land_mask = np.concatenate((np.ones(dlat * glob_lons.size), land_mask))
+    land_points = np.ma.masked_array(glob_grid.get_grid_points()[0], land_mask)
+
+    return (
+        glob_grid.arrlon,
+        glob_grid.arrlat,
+        glob_grid.arrcell,
+        land_points[~land_points.mask].filled(),
+    )
 
-        land_mask = np.concatenate((np.ones(dlat * glob_lons.size), land_mask))
-        land_points = np.ma.masked_array(
-            glob_grid.get_grid_points()[0], land_mask
-        )
 
-        land_grid = glob_grid.subgrid_from_gpis(
-            land_points[~land_points.mask].filled()
+@lru_cache(maxsize=None)
+def _load_grid_arrays(cache_dir=None):
+    """
+    Load the grid arrays from the cache file in cache_dir, or compute them
+    (and store them in the cache file).
+    """
+    if cache_dir is None:
+        return _create_grid_arrays()
+
+    cache_file = os.path.join(cache_dir, "gldas025_grid.npz")
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as data:
+            return data["lon"], data["lat"], data["cell"], data["land_gpi"]
+
+    lon, lat, cell, land_gpi = _create_grid_arrays()
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, in case of concurrent processes
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(f, lon=lon, lat=lat, cell=cell, land_gpi=land_gpi)
+    os.replace(tmp_file, cache_file)
+
+    return lon, lat, cell, land_gpi
+
+
+@lru_cache(maxsize=None)
+def _cached_grid(only_land, cache_dir):
+    lon, lat, cell, land_gpi = _load_grid_arrays(cache_dir)
+    if only_land:
+        grid = CellGrid(
+            lon[land_gpi], lat[land_gpi], cell[land_gpi], gpis=land_gpi
         )
-        return land_grid
     else:
-        return glob_grid
+        grid = CellGrid(lon, lat, cell)
+    # the grid is shared, make accidental changes of its arrays fail
+    for arr in vars(grid).values():
+        if isinstance(arr, np.ndarray):
+            arr.flags.writeable = False
+    return grid
+
+
+def GLDAS025Grids(only_land=False, cache_dir=None):
+    """
+    Create global 0.25 DEG gldas grids (origin in bottom left)
+
+    The grids are created only once per process and the same (cached) grid
+    object is returned for each call. The returned grid is therefore shared
+    by all callers (e.g. all image readers) and must not be modified (its
+    arrays are read-only), use e.g. copy.deepcopy(grid) or a subgrid
+    (subgrid_from_gpis) for changes.
+    If a cache directory is used, the grid coordinates and cells are also
+    stored there and loaded from there in later processes.
+
+    Parameters
+    ---------
+    only_land : bool, optional (default: False)
+        Uses the land mask to reduce the GLDAS 0.25DEG land grid to land points
+        only.
+    cache_dir : str, optional (default: None)
+        Directory of the grid cache file. If None is passed, the environment
+        variable GLDAS_GRID_CACHE_DIR is used if it is set, otherwise the grid
+        is computed.
+
+    Returns
+    --------
+    grid : pygeogrids.CellGrid
+        Either a land grid or a global grid
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get("GLDAS_GRID_CACHE_DIR", None)
 
+    return _cached_grid(only_land, cache_dir)
 
-def GLDAS025Cellgrid():
-    """Alias to create a global 0.25 DEG grid without gaps w. 5 DEG cells """
-    return GLDAS025Grids(only_land=False)
 
+def GLDAS025Cellgrid(cache_dir=None):
+    """
+    Alias to create a global 0.25 DEG grid without gaps w. 5 DEG cells
+    (shared, must not be modified, see GLDAS025Grids)
+    """
+    return GLDAS025Grids(only_land=False, cache_dir=cache_dir)
 
-def GLDAS025LandGrid():
-    """Alias to create a global 0.25 DEG grid over land only w. 5 DEG cells """
-    return GLDAS025Grids(only_land=True)
+
+def GLDAS025LandGrid(cache_dir=None):
+    """
+    Alias to create a global 0.25 DEG grid over land only w. 5 DEG cells
+    (shared, must not be modified, see GLDAS025Grids)
+    """
+    return GLDAS025Grids(only_land=True, cache_dir=cache_dir)
 
 def load_grid(land_points=True, bbox=None):
     """
@@ -111,6 +385,12 @@ def load_grid(land_points=True, bbox=None):
     bbox : tuple, optional (default: True)
         (min_lat, min_lon, max_lat, max_lon)
         Bounding box to limit reshuffling to.
+
+    Returns
+    -------
+    subgrid : CellGrid or None
+        The grid. Without bbox, the land grid is the shared grid of
+        GLDAS025LandGrid, which must not be modified.
     """
     if land_points:
         subgrid = GLDAS025LandGrid()
@@ -1,5 +1,6 @@
 ﻿import warnings
 import numpy as np
+import pandas as pd
 import os
 
 try:
@@ -12,12 +13,33 @@ from pygeobase.io_base import ImageBase, MultiTemporalImageBase
 from pygeobase.object_base import Image
 from pynetcf.time_series import GriddedNcOrthoMultiTs
 
+import copy
 from datetime import timedelta
-
-from gldas.grid import GLDAS025Cellgrid
-from netCDF4 import Dataset
+from contextlib import nullcontext
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from threading import Lock, get_ident
+
+from gldas.grid import GLDAS025Cellgrid, image_index
+from gldas.file_index import FileIndex
+from netCDF4 import Dataset, num2date
 from pygeogrids.netcdf import load_grid
-from gldas.utils import deprecated, PygribError
+from gldas.utils import deprecated, PygribError, tstamps_for_daterange
+
+# the netCDF/HDF5 libraries must not be called from multiple threads at the
+# same time
+netcdf_lock = Lock()
+
+
+def _reset_netcdf_lock():
+    # a forked process inherits the lock in the state it had in the parent,
+    # where it may have been held by another thread
+    global netcdf_lock
+    netcdf_lock = Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_netcdf_lock)
 
 
 class GLDAS_Noah_v2_025Img(ImageBase):
@@ -56,9 +78,9 @@ class GLDAS_Noah_v2_025Img(ImageBase):
             parameter = [parameter]
 
         self.parameters = parameter
-        self.fill_values = np.repeat(9999.0, 1440 * 120)
         self.grid = GLDAS025Cellgrid() if not subgrid else subgrid
         self.array_1D = array_1D
+        self.index = image_index(self.grid)
 
     def read(self, timestamp=None):
 
@@ -69,56 +91,57 @@ class GLDAS_Noah_v2_025Img(ImageBase):
         return_img = {}
         return_metadata = {}
 
-        try:
-            dataset = Dataset(self.filename)
-        except IOError:
-            raise IOError(f"Error opening file {self.filename}")
+        shape = self.index.window_shape
 
-        param_names = []
-        for parameter in self.parameters:
-            param_names.append(parameter)
+        with netcdf_lock:
+            try:
+                dataset = Dataset(self.filename)
+            except IOError:
+                raise IOError(f"Error opening file {self.filename}")
+
+            # keep the order of the variables in the file
+            param_names = [
+                parameter
+                for parameter in dataset.variables.keys()
+                if parameter in self.parameters
+            ]
+
+            # all requested parameters are read into one stack, fill values
+            # and the grid subset are then applied to all of them at once.
+            param_stack = np.empty(
+                (len(param_names),) + shape, dtype=np.float64
+            )
 
-        for parameter, variable in dataset.variables.items():
-            if parameter in param_names:
+            for i, parameter in enumerate(param_names):
+                variable = dataset.variables[parameter]
                 param_metadata = {}
-                param_data = {}
                 for attrname in variable.ncattrs():
                     if attrname in ["long_name", "units"]:
                         param_metadata.update(
                             {str(attrname): getattr(variable, attrname)}
                         )
+                return_metadata.update({str(parameter): param_metadata})
 
-                param_data = dataset.variables[parameter][:]
-                np.ma.set_fill_value(param_data, 9999)
-                param_data = np.concatenate(
-                    (
-                        self.fill_values,
-                        np.ma.getdata(param_data.filled()).flatten(),
-                    )
+                param_data = variable[..., self.index.rows, self.index.cols]
+                np.copyto(
+                    param_stack[i], np.ma.getdata(param_data).reshape(shape)
                 )
-
-                return_img.update(
-                    {str(parameter): param_data[self.grid.activegpis]}
+                np.putmask(
+                    param_stack[i],
+                    np.ma.getmaskarray(param_data).reshape(shape),
+                    9999.0,
                 )
 
-                return_metadata.update({str(parameter): param_metadata})
+            dataset.close()
 
-                # Check for corrupt files
-                try:
-                    return_img[parameter]
-                except KeyError:
-                    path, thefile = os.path.split(self.filename)
-                    print(
-                        "%s in %s is corrupt - filling"
-                        "image with NaN values" % (parameter, thefile)
-                    )
-                    return_img[parameter] = np.empty(self.grid.n_gpi).fill(
-                        np.nan
-                    )
-
-                    return_metadata["corrupt_parameters"].append()
+        # in 2D mode, the points are gathered directly in the flipped layout
+        param_stack = self.index.gather_stack(
+            param_stack, flip=not self.array_1D
+        )
 
-        dataset.close()
+        # the data of each parameter is a view on the stack
+        for i, parameter in enumerate(param_names):
+            return_img.update({str(parameter): param_stack[i]})
 
         if self.array_1D:
             return Image(
@@ -130,17 +153,10 @@ class GLDAS_Noah_v2_025Img(ImageBase):
             )
         else:
             for key in return_img:
-                return_img[key] = np.flipud(
-                    return_img[key].reshape((720, 1440))
-                )
+                return_img[key] = return_img[key].reshape((720, 1440))
 
-            return Image(
-                np.flipud(self.grid.activearrlon.reshape((720, 1440))),
-                np.flipud(self.grid.activearrlat.reshape((720, 1440))),
-                return_img,
-                return_metadata,
-                timestamp,
-            )
+            lons, lats = self.index.lonlat_2d
+            return Image(lons, lats, return_img, return_metadata, timestamp)
 
     def write(self, data):
         raise NotImplementedError()
@@ -222,9 +238,9 @@ class GLDAS_Noah_v1_025Img(ImageBase):
         if type(parameter) != list:
             parameter = [parameter]
         self.parameters = parameter
-        self.fill_values = np.repeat(9999.0, 1440 * 120)
         self.grid = subgrid if subgrid else GLDAS025Cellgrid()
         self.array_1D = array_1D
+        self.index = image_index(self.grid)
 
     def read(self, timestamp=None):
 
@@ -259,28 +275,21 @@ class GLDAS_Noah_v1_025Img(ImageBase):
                     )
 
                     if parameter in self.parameters:
-                        param_data = np.concatenate(
-                            (
-                                self.fill_values,
-                                np.ma.getdata(message["values"]).flatten(),
-                            )
+                        return_img[parameter] = self.index.gather(
+                            np.ma.getdata(message["values"]),
+                            window=False,
+                            flip=not self.array_1D,
                         )
-
-                        return_img[parameter] = param_data[
-                            self.grid.activegpis
-                        ]
                         return_metadata[parameter] = param_metadata
                     layers[parameter_id] += 1
 
                 else:
                     parameter = parameter_id
-                    param_data = np.concatenate(
-                        (
-                            self.fill_values,
-                            np.ma.getdata(message["values"]).flatten(),
-                        )
+                    return_img[parameter] = self.index.gather(
+                        np.ma.getdata(message["values"]),
+                        window=False,
+                        flip=not self.array_1D,
                     )
-                    return_img[parameter] = param_data[self.grid.activegpis]
                     return_metadata[parameter] = param_metadata
 
         grbs.close()
@@ -304,14 +313,11 @@ class GLDAS_Noah_v1_025Img(ImageBase):
                 timestamp,
             )
         else:
+            # the points are gathered directly in the flipped layout
             for key in return_img:
-                return_img[key] = np.flipud(
-                    return_img[key].reshape((720, 1440))
-                )
-
-            lons = np.flipud(self.grid.activearrlon.reshape((720, 1440)))
-            lats = np.flipud(self.grid.activearrlat.reshape((720, 1440)))
+                return_img[key] = return_img[key].reshape((720, 1440))
 
+            lons, lats = self.index.lonlat_2d
             return Image(lons, lats, return_img, return_metadata, timestamp)
 
     def write(self, data):
@@ -323,6 +329,27 @@ class GLDAS_Noah_v1_025Img(ImageBase):
     def close(self):
         pass
 
+# Dataset used by the image reading functions in prefetch worker processes
+_prefetch_dataset = None
+
+
+def _init_prefetch_worker(dataset):
+    global _prefetch_dataset
+    _prefetch_dataset = dataset
+
+
+def _prefetch_read(timestamp, dataset=None):
+    """
+    Read the image for a timestamp with a new image reader object, so that
+    this can be called concurrently for multiple timestamps.
+    """
+    if dataset is None:
+        dataset = _prefetch_dataset
+    filepath = dataset._build_filename(timestamp)
+    img = dataset.ioclass(filepath, mode=dataset.mode, **dataset.ioclass_kws)
+    return img.read(timestamp=timestamp)
+
+
 class GLDAS_Noah_v21_025Ds(MultiTemporalImageBase):
     """
     Class for reading GLDAS v2.1 images in nc format.
@@ -339,6 +366,30 @@ class GLDAS_Noah_v21_025Ds(MultiTemporalImageBase):
     array_1D: boolean, optional
         If set then the data is read into 1D arrays.
         Needed for some legacy code.
+    prefetch : int, optional (default: 0)
+        Number of following (3-hourly) images that are read in the
+        background while the current image is processed, e.g. when using
+        iter_images. 0 means that images are only read on request. Only
+        images within the range of the last call to tstamps_for_daterange
+        (or iter_images) and whose files exist are read ahead.
+    prefetch_executor : str, optional (default: 'thread')
+        Either 'thread' or 'process'. Whether images are prefetched by a
+        pool of threads or of processes. The netCDF/HDF5 libraries are not
+        thread-safe, so threads read and decompress the files one after
+        the other (under the netcdf_lock) and only overlap this with the
+        processing of the current image. Use 'process' to decode several
+        images in parallel.
+    file_index : bool, optional (default: False)
+        If True, all image files under data_path are indexed once (see
+        :class:`gldas.file_index.FileIndex`) and files are looked up in the
+        index instead of searching the file system for each image.
+        Call `refresh_file_index` to add new files to the index.
+    index_file : str, optional (default: None)
+        Sidecar file to store the file index in, so that it can be reused
+        (and updated incrementally) later. Activates the file index. An
+        index loaded from this file is not checked against the file system
+        at startup, it is updated when an image is not found in it, or
+        with `refresh_file_index`.
     """
 
     def __init__(
@@ -347,10 +398,32 @@ class GLDAS_Noah_v21_025Ds(MultiTemporalImageBase):
         parameter="SoilMoi0_10cm_inst",
         subgrid=None,
         array_1D=False,
+        prefetch=0,
+        prefetch_executor="thread",
+        file_index=False,
+        index_file=None,
     ):
+        if prefetch_executor not in ["thread", "process"]:
+            raise ValueError(
+                f"Unknown prefetch executor: {prefetch_executor}. "
+                f"Choose 'thread' or 'process'."
+            )
+
+        self.prefetch = prefetch
+        self.prefetch_executor = prefetch_executor
+        self._pool = None
+        self._pending = {}
+        # period of the last tstamps_for_daterange call, images after its
+        # end are not prefetched
+        self._prefetch_range = None
+
+        # all image readers share the same grid (and image index)
+        self.grid = GLDAS025Cellgrid() if not subgrid else subgrid
+        image_index(self.grid)
+
         ioclass_kws = {
             "parameter": parameter,
-            "subgrid": subgrid,
+            "subgrid": self.grid,
             "array_1D": array_1D,
         }
 
@@ -367,7 +440,134 @@ class GLDAS_Noah_v21_025Ds(MultiTemporalImageBase):
             ioclass_kws=ioclass_kws,
         )
 
-    def tstamps_for_daterange(self, start_date, end_date):
+        if file_index or (index_file is not None):
+            self.file_index = FileIndex(
+                data_path,
+                filename_templ,
+                self.datetime_format,
+                n_subdirs=len(sub_path),
+                index_file=index_file,
+            )
+        else:
+            self.file_index = None
+
+    def refresh_file_index(self):
+        """
+        Add new (and remove deleted) image files to/from the file index.
+        """
+        if self.file_index is None:
+            raise ValueError("The file index is not activated.")
+        self.file_index.refresh()
+
+    def _search_files(self, timestamp, **kwargs):
+        """
+        Search the image files for a timestamp, in the file index (if
+        activated) or on the file system.
+        """
+        if (self.file_index is None) or any(
+            v is not None for v in kwargs.values()
+        ):
+            return super(GLDAS_Noah_v21_025Ds, self)._search_files(
+                timestamp, **kwargs
+            )
+        return self.file_index.get(timestamp)
+
+    def __getstate__(self):
+        # pools can not be pickled, they are created again after unpickling
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pending"] = {}
+        return state
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.prefetch_executor == "process":
+                worker_ds = self.__getstate__()
+                worker_ds.update({"prefetch": 0, "fid": None})
+                dataset = object.__new__(type(self))
+                dataset.__dict__.update(worker_ds)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.prefetch,
+                    initializer=_init_prefetch_worker,
+                    initargs=(dataset,),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.prefetch)
+        return self._pool
+
+    def _submit(self, timestamp):
+        if self.prefetch_executor == "process":
+            return self._get_pool().submit(_prefetch_read, timestamp)
+        else:
+            return self._get_pool().submit(_prefetch_read, timestamp, self)
+
+    def _prefetch_tstamps(self, timestamp):
+        """
+        Time stamps of the images to read ahead after timestamp: the
+        following 3-hourly images within the current period whose files
+        exist.
+        """
+        end = None
+        if self._prefetch_range is not None:
+            start_date, end_date = self._prefetch_range
+            if start_date <= timestamp <= end_date:
+                end = end_date
+
+        timestamps = []
+        for i in range(1, self.prefetch + 1):
+            t = timestamp + timedelta(hours=3 * i)
+            if end is not None and t > end:
+                break
+            if t in self._pending:
+                timestamps.append(t)
+            elif self.file_index is not None:
+                if t in self.file_index.lookup:
+                    timestamps.append(t)
+            elif self._search_files(t):
+                timestamps.append(t)
+        return timestamps
+
+    def read(self, timestamp, **kwargs):
+        """
+        Return an image for a specific timestamp. If prefetching is
+        activated, the following images are read in the background.
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime
+            Time stamp.
+
+        Returns
+        -------
+        image : object
+            pygeobase.object_base.Image object
+        """
+        if self.prefetch < 1 or kwargs:
+            return super(GLDAS_Noah_v21_025Ds, self).read(timestamp, **kwargs)
+
+        # images before the current one are not needed anymore
+        for t in [t for t in self._pending if t < timestamp]:
+            self._pending.pop(t).cancel()
+
+        # errors (e.g. of a missing file) are raised by the read of the
+        # current image
+        for t in [timestamp] + self._prefetch_tstamps(timestamp):
+            if t not in self._pending:
+                self._pending[t] = self._submit(t)
+
+        return self._pending.pop(timestamp).result()
+
+    def close(self):
+        """
+        Close file and stop prefetching.
+        """
+        super(GLDAS_Noah_v21_025Ds, self).close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._pending = {}
+
+    def tstamps_for_daterange(self, start_date, end_date, as_datetime64=False):
         """
         return timestamps for daterange,
 
@@ -377,34 +577,20 @@ class GLDAS_Noah_v21_025Ds(MultiTemporalImageBase):
             start of date range
         end_date: datetime
             end of date range
+        as_datetime64: bool, optional (default: False)
+            Return the timestamps as datetime64[s] array instead of a list.
 
         Returns
         -------
         timestamps : list
-            list of datetime objects of each available image between
+            list of datetime objects of each (3-hourly) image between
             start_date and end_date
         """
-        img_offsets = np.array(
-            [
-                timedelta(hours=0),
-                timedelta(hours=3),
-                timedelta(hours=6),
-                timedelta(hours=9),
-                timedelta(hours=12),
-                timedelta(hours=15),
-                timedelta(hours=18),
-                timedelta(hours=21),
-            ]
+        self._prefetch_range = (start_date, end_date)
+        return tstamps_for_daterange(
+            start_date, end_date, as_list=not as_datetime64
         )
 
-        timestamps = []
-        diff = end_date - start_date
-        for i in range(diff.days + 1):
-            daily_dates = start_date + timedelta(days=i) + img_offsets
-            timestamps.extend(daily_dates.tolist())
-
-        return timestamps
-
 
 class GLDAS_Noah_v1_025Ds(MultiTemporalImageBase):
     """
@@ -436,9 +622,13 @@ class GLDAS_Noah_v1_025Ds(MultiTemporalImageBase):
         if not pygrib_available:
             raise PygribError
 
+        # all image readers share the same grid (and image index)
+        self.grid = subgrid if subgrid else GLDAS025Cellgrid()
+        image_index(self.grid)
+
         ioclass_kws = {
             "parameter": parameter,
-            "subgrid": subgrid,
+            "subgrid": self.grid,
             "array_1D": array_1D,
         }
 
@@ -455,7 +645,7 @@ class GLDAS_Noah_v1_025Ds(MultiTemporalImageBase):
             ioclass_kws=ioclass_kws,
         )
 
-    def tstamps_for_daterange(self, start_date, end_date):
+    def tstamps_for_daterange(self, start_date, end_date, as_datetime64=False):
         """
         return timestamps for daterange,
 
@@ -465,37 +655,35 @@ class GLDAS_Noah_v1_025Ds(MultiTemporalImageBase):
             start of date range
         end_date: datetime
             end of date range
+        as_datetime64: bool, optional (default: False)
+            Return the timestamps as datetime64[s] array instead of a list.
 
         Returns
         -------
         timestamps : list
-            list of datetime objects of each available image between
+            list of datetime objects of each (3-hourly) image between
             start_date and end_date
         """
-        img_offsets = np.array(
-            [
-                timedelta(hours=0),
-                timedelta(hours=3),
-                timedelta(hours=6),
-                timedelta(hours=9),
-                timedelta(hours=12),
-                timedelta(hours=15),
-                timedelta(hours=18),
-                timedelta(hours=21),
-            ]
+        return tstamps_for_daterange(
+            start_date, end_date, as_list=not as_datetime64
         )
 
-        timestamps = []
-        diff = end_date - start_date
-        for i in range(diff.days + 1):
-            daily_dates = start_date + timedelta(days=i) + img_offsets
-            timestamps.extend(daily_dates.tolist())
 
-        return timestamps
+# time stamps, location ids and time series variables of a cell file
+_CellInfo = namedtuple(
+    "_CellInfo", ["dates", "times", "loc_ids", "order", "variables"]
+)
 
 
 class GLDASTs(GriddedNcOrthoMultiTs):
-    def __init__(self, ts_path, grid_path=None, **kwargs):
+    # read_multi reads the locations of a cell as one hyperslab (all rows
+    # between the first and last location), unless the slab has more than
+    # slab_factor times as many rows as locations
+    slab_factor = 4
+
+    def __init__(
+        self, ts_path, grid_path=None, cache_size=16, lock=True, **kwargs
+    ):
         """
         Class for reading GLDAS time series after reshuffling.
 
@@ -507,6 +695,24 @@ class GLDASTs(GriddedNcOrthoMultiTs):
             Path to grid file, that is used to organize the location of time
             series to read. If None is passed, grid.nc is searched for in the
             ts_path.
+        cache_size : int, optional (default: 16)
+            Number of cell files that are kept open, and of cells whose
+            decoded time stamps are kept in memory. Reading locations in
+            recently used cells does not open the file or decode the time
+            stamps again.
+        lock : bool, optional (default: True)
+            Serialize the netCDF calls of all threads with the netcdf_lock.
+            Set to False only if the netCDF/HDF5 libraries are built
+            thread-safe, threads then also read from the files in parallel.
+
+        The reader can be shared by several threads. Each thread keeps its
+        own open cell files (cache_size per thread), the time stamps and
+        location ids of the cells are shared. Only the netCDF calls (opening,
+        reading and closing files) are done while the netcdf_lock is held,
+        as the netCDF/HDF5 libraries are not thread-safe. Decoding the time
+        stamps, finding the locations, scaling and creating the data frames
+        run in parallel. In forked processes, or copies that are pickled to
+        other processes, the cell files are opened again.
 
         Optional keyword arguments that are passed to the Gridded Base:
         ------------------------------------------------------------------------
@@ -524,12 +730,506 @@ class GLDASTs(GriddedNcOrthoMultiTs):
                         and subsequent calls to read_ts read from the cache and not from disk
                         this makes reading complete files faster#
                     read_dates : boolean, optional (default:False)
-                        if false dates will not be read automatically but only on specific
-                        request useable for bulk reading because currently the netCDF
-                        num2date routine is very slow for big datasets
+                        if set to True the time stamps are decoded for each
+                        read, otherwise they are decoded once per cell and
+                        cached (see cache_size)
         """
         if grid_path is None:
             grid_path = os.path.join(ts_path, "grid.nc")
 
         grid = load_grid(grid_path)
         super(GLDASTs, self).__init__(ts_path, grid, **kwargs)
+
+        self.cache_size = cache_size
+        self.lock = lock
+        self.read_dates = self.ioclass_kws.get("read_dates", False)
+        # time stamps, location ids etc. of the cells (shared by all
+        # threads), least recently used first
+        self._cells = OrderedDict()
+        self._init_process()
+
+    def _init_process(self):
+        # open cell files of each thread, and the lock for the shared state
+        self._pools = {}
+        self._cache_lock = Lock()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        # open netCDF files and locks can not be pickled, the copy (e.g. in
+        # another process) opens the files again
+        state = self.__dict__.copy()
+        del state["_pools"], state["_cache_lock"]
+        state.update(fid=None, previous_cell=None)
+        if self.grid.kdTree is not None:
+            # the kd-tree (built for lon/lat reads) can not be pickled either,
+            # it is built again by the copy when needed
+            state["grid"] = copy.copy(self.grid)
+            state["grid"].kdTree = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_process()
+
+    def _netcdf_lock(self):
+        """Lock to hold during netCDF calls"""
+        return netcdf_lock if self.lock else nullcontext()
+
+    @property
+    def _fids(self):
+        """
+        Pool of open cell files of the calling thread. In a forked process
+        the files inherited from the parent are dropped (without closing
+        them, as they are still used by the parent) and opened again when
+        needed.
+        """
+        if self._pid != os.getpid():
+            self._init_process()
+            self.fid, self.previous_cell = None, None
+        pool = self._pools.get(get_ident())
+        if pool is None:
+            with self._cache_lock:
+                pool = self._pools.setdefault(get_ident(), OrderedDict())
+        return pool
+
+    def _cell_filename(self, cell):
+        return os.path.join(self.path, f"{self.fn_format.format(cell)}.nc")
+
+    def _cell_fid(self, cell):
+        """
+        Get the open cell file from the pool of the thread, or open it and
+        close the least recently used file if the pool is full. The
+        netcdf_lock must be held by the caller.
+        """
+        pool = self._fids
+        fid = pool.pop(cell, None)
+        if fid is None:
+            fid = self.ioclass(
+                self._cell_filename(cell), mode="r", **self.ioclass_kws
+            )
+            while pool and len(pool) >= self.cache_size:
+                evicted = pool.popitem(last=False)[1]
+                if evicted is self.fid:
+                    # the current file of the base class methods
+                    self.fid, self.previous_cell = None, None
+                evicted.close()
+        pool[cell] = fid
+        return fid
+
+    def _try_cell_fid(self, cell):
+        """
+        Like _cell_fid, but warn and return None if the file can not be
+        opened.
+        """
+        try:
+            return self._cell_fid(cell)
+        except (IOError, RuntimeError):
+            warnings.warn(
+                f"I/O error {self._cell_filename(cell)}", RuntimeWarning
+            )
+            return None
+
+    def _cell_info(self, cell, fid):
+        """
+        Time stamps, location ids and time series variables of a cell file.
+        They are read once per cell (again if the file has grown, or for
+        each read if read_dates is set) and shared by all threads.
+
+        Returns
+        -------
+        info : _CellInfo
+            Decoded time stamps (datetime64[ns]), time values as stored in
+            the file, location ids, their sort order and the names of the
+            time series variables.
+        """
+        with self._netcdf_lock():
+            variables = fid.dataset.variables
+            time = variables[fid.time_var]
+            n_times = time.size
+        with self._cache_lock:
+            info = self._cells.get(cell)
+            if info is not None and not self.read_dates:
+                if info.dates.size == n_times:
+                    self._cells.move_to_end(cell)
+                    return info
+
+        with self._netcdf_lock():
+            times = np.ma.getdata(time[:])
+            units = time.units
+            calendar = getattr(time, "calendar", "standard")
+            loc_ids = np.ma.getdata(variables[fid.loc_ids_name][:])
+            ts_variables = [
+                name
+                for name, var in variables.items()
+                if name not in fid.not_timeseries
+                and fid.obs_dim_name in var.dimensions
+            ]
+
+        dates = num2date(
+            times,
+            units=units,
+            calendar=calendar,
+            only_use_cftime_datetimes=False,
+            only_use_python_datetimes=True,
+        )
+        info = _CellInfo(
+            dates=np.asarray(dates, dtype="datetime64[ns]"),
+            times=times,
+            loc_ids=loc_ids,
+            order=np.argsort(loc_ids, kind="stable"),
+            variables=ts_variables,
+        )
+        with self._cache_lock:
+            self._cells.pop(cell, None)
+            while self._cells and len(self._cells) >= self.cache_size:
+                self._cells.popitem(last=False)
+            self._cells[cell] = info
+        return info
+
+    @staticmethod
+    def _locate(info, gpis):
+        """
+        Rows of grid points in a cell file.
+
+        Parameters
+        ----------
+        info : _CellInfo
+            Cell information (see _cell_info).
+        gpis : np.ndarray
+            Grid point indices.
+
+        Returns
+        -------
+        found : np.ndarray
+            Whether each grid point is in the cell file.
+        rows : np.ndarray
+            Rows of the grid points that were found.
+        """
+        if info.loc_ids.size == 0:
+            return np.zeros(gpis.shape, dtype=bool), np.array([], dtype=int)
+        sorted_ids = info.loc_ids[info.order]
+        pos = np.searchsorted(sorted_ids, gpis)
+        pos[pos == sorted_ids.size] = 0
+        found = sorted_ids[pos] == gpis
+        return found, info.order[pos[found]]
+
+    @staticmethod
+    def _time_slice(dates, period):
+        """
+        Index range of the time stamps within a period.
+
+        Parameters
+        ----------
+        dates : np.ndarray
+            Sorted time stamps (datetime64[ns]).
+        period : list or None
+            Start and end of the period (both included), either can be None
+            to not limit the period on this side.
+
+        Returns
+        -------
+        time_slice : slice
+            Slice of the time stamps within the period.
+        """
+        if period is None:
+            return slice(None)
+        start, end = period
+        i0, i1 = 0, dates.size
+        if start is not None:
+            start = pd.Timestamp(start).to_datetime64()
+            i0 = np.searchsorted(dates, start, side="left")
+        if end is not None:
+            end = pd.Timestamp(end).to_datetime64()
+            i1 = np.searchsorted(dates, end, side="right")
+        return slice(i0, max(i0, i1))
+
+    @staticmethod
+    def _read_var(fid, row, param, time_slice):
+        """Read the time series of a parameter in a row of a cell file"""
+        if fid.read_bulk:
+            if param not in fid.variables:
+                fid.variables[param] = fid.dataset.variables[param][:]
+            return fid.variables[param][row, time_slice]
+        return fid.dataset.variables[param][row, time_slice]
+
+    def _open(self, gp):
+        """
+        Make the cell file of a grid point the current file (self.fid).
+
+        Parameters
+        ----------
+        gp : int
+            Grid point.
+
+        Returns
+        -------
+        success : boolean
+            Flag if opening the file was successful.
+        """
+        if self.mode != "r":
+            return super(GLDASTs, self)._open(gp)
+
+        cell = self.grid.gpi2cell(gp)
+        with self._netcdf_lock():
+            self.fid = self._try_cell_fid(cell)
+        self.previous_cell = None if self.fid is None else cell
+        return self.fid is not None
+
+    def _scale(self, param, values):
+        """Apply the scale factor and offset of a parameter"""
+        if self.scale_factors is not None and param in self.scale_factors:
+            values = values * self.scale_factors[param]
+        if self.offsets is not None and param in self.offsets:
+            values = values + self.offsets[param]
+        return values
+
+    def _read_gp(self, gpi, period=None, dates_direct=False):
+        """
+        Read the time series of a grid point.
+
+        Parameters
+        ----------
+        gpi : int
+            Grid point.
+        period : list, optional (default: None)
+            2 element list containing datetimes [start, end]. Only the data
+            within this period is read from the file. Either can be None to
+            read from the first or until the last time stamp.
+        dates_direct : bool, optional (default: False)
+            Use the time values from the file as index, without conversion
+            to datetime.
+
+        Returns
+        -------
+        ts : pandas.DataFrame
+            Time series data, None if the cell file could not be read.
+        """
+        if self.mode in ["w", "a"]:
+            raise IOError("trying to read file is in write/append mode")
+
+        # the open cell files belong to the thread, only the netCDF calls
+        # are serialized
+        cell = self.grid.gpi2cell(gpi)
+        with self._netcdf_lock():
+            fid = self._try_cell_fid(cell)
+        if fid is None:
+            return None
+        info = self._cell_info(cell, fid)
+        found, rows = self._locate(info, np.atleast_1d(gpi))
+        if not found[0]:
+            raise IOError(
+                f"Location {gpi} is not in {self._cell_filename(cell)}"
+            )
+        parameters = self.parameters
+        if parameters is None:
+            parameters = info.variables
+        time_slice = self._time_slice(info.dates, period)
+        with self._netcdf_lock():
+            data = {
+                p: self._read_var(fid, rows[0], p, time_slice)
+                for p in parameters
+            }
+        if dates_direct:
+            index = info.times[time_slice]
+        else:
+            index = info.dates[time_slice]
+
+        ts = pd.DataFrame(data, index=index)
+
+        if self.dtypes is not None:
+            for column, dtype in self.dtypes.items():
+                if column in ts.columns:
+                    try:
+                        ts[column] = ts[column].astype(dtype)
+                    except ValueError:
+                        raise ValueError(
+                            "Dtype conversion did not work. Try turning off "
+                            "automatic masking."
+                        )
+
+        for column in ts.columns:
+            ts[column] = self._scale(column, ts[column])
+
+        return ts
+
+    def _read_cell(self, cell, gpis, parameters, period=None):
+        """
+        Read the time series of several locations in a cell file, as one
+        hyperslab (all rows between the first and the last location) per
+        parameter, or row by row if the locations are far apart (see
+        slab_factor).
+
+        Parameters
+        ----------
+        cell : int
+            Cell number.
+        gpis : np.ndarray
+            Grid point indices in the cell (unique).
+        parameters : list or None
+            Parameters to read, all time series variables if None is passed.
+        period : list, optional (default: None)
+            Start and end of the period to read.
+
+        Returns
+        -------
+        dates : np.ndarray
+            Time stamps (datetime64[ns]) of the cell file within the period.
+        found : np.ndarray
+            Whether each location is in the cell file.
+        data : dict
+            (location, time) arrays (values) for each parameter (keys), for
+            the locations that were found.
+        """
+        with self._netcdf_lock():
+            fid = self._cell_fid(cell)
+        info = self._cell_info(cell, fid)
+        if parameters is None:
+            parameters = info.variables
+        found, rows = self._locate(info, gpis)
+        dates = info.dates
+        time_slice = self._time_slice(dates, period)
+        if not found.any():
+            return dates[time_slice], found, {}
+
+        start, stop = rows.min(), rows.max() + 1
+        if stop - start <= self.slab_factor * rows.size:
+            index, rows = slice(start, stop), rows - start
+        else:
+            # rows of the requested locations only, in ascending order
+            index, rows = np.unique(rows, return_inverse=True)
+        with self._netcdf_lock():
+            slabs = {
+                p: self._read_var(fid, index, p, time_slice)
+                for p in parameters
+            }
+        data = {p: slab[rows] for p, slab in slabs.items()}
+        return dates[time_slice], found, data
+
+    def close(self):
+        """
+        Close all open cell files.
+        """
+        if self.mode != "r":
+            return super(GLDASTs, self).close()
+        self._fids  # drops the files inherited by a forked process
+        with self._cache_lock:
+            pools = list(self._pools.values())
+        with self._netcdf_lock():
+            for pool in pools:
+                while pool:
+                    pool.popitem()[1].close()
+        self.fid, self.previous_cell = None, None
+
+    def read_multi(
+        self, *args, parameters=None, period=None, max_dist=np.inf
+    ):
+        """
+        Read the time series of many locations at once. The locations are
+        grouped by cell, so that each cell file is opened once and the
+        data of all its locations is read together.
+
+        Parameters
+        ----------
+        *args
+            Either an array of grid point indices, or arrays of longitudes
+            and latitudes (the nearest grid points are read).
+        parameters : list, optional (default: None)
+            Parameters to read, if None is passed, the parameters passed at
+            initialisation (or all parameters in the files) are read.
+        period : list, optional (default: None)
+            Start and end of the period to read, both included. Either can be
+            None to read from the first or until the last time stamp.
+        max_dist : float, optional (default: np.inf)
+            Maximum distance [m] between a lon/lat location and its nearest
+            grid point.
+
+        Returns
+        -------
+        data : dict
+            (time, location) pandas.DataFrame (values) for each parameter
+            (keys), with the time stamps as index and the grid point indices
+            as columns (in the order of the requested locations). Locations
+            that are not in the grid or without data are NaN, and an empty
+            dict is returned if there is no data for any location. Locations
+            that are missing in their cell file, and cell files that can not
+            be read, are reported with a RuntimeWarning.
+        """
+        if len(args) == 1:
+            gpis = np.atleast_1d(np.asarray(args[0], dtype=np.int64))
+        elif len(args) == 2:
+            gpis, _ = self.grid.find_nearest_gpi(
+                np.atleast_1d(args[0]), np.atleast_1d(args[1]), max_dist
+            )
+            gpis = np.atleast_1d(gpis).astype(np.int64)
+        else:
+            raise ValueError("Pass either gpis or lons and lats.")
+        if parameters is None:
+            parameters = self.parameters
+
+        valid = np.isin(gpis, self.grid.activegpis)
+        cells = np.full(gpis.shape, -1, dtype=np.int64)
+        cells[valid] = self.grid.gpi2cell(gpis[valid])
+
+        results = []
+        for cell in np.unique(cells[valid]):
+            in_cell = np.flatnonzero(cells == cell)
+            unique_gpis, inverse = np.unique(
+                gpis[in_cell], return_inverse=True
+            )
+            try:
+                dates, found, data = self._read_cell(
+                    cell, unique_gpis, parameters, period
+                )
+            except (IOError, RuntimeError):
+                warnings.warn(
+                    f"I/O error {self._cell_filename(cell)}", RuntimeWarning
+                )
+                continue
+            if not found.all():
+                warnings.warn(
+                    f"Locations {unique_gpis[~found].tolist()} are not in "
+                    f"{self._cell_filename(cell)}",
+                    RuntimeWarning,
+                )
+                if not found.any():
+                    continue
+                # position of each location in the data of the cell
+                position = np.cumsum(found) - 1
+                keep = found[inverse]
+                in_cell, inverse = in_cell[keep], position[inverse[keep]]
+            results.append((in_cell, inverse, dates, data))
+
+        if not results:
+            return {}
+
+        # the cells of a conversion have the same time stamps, otherwise
+        # the data is aligned on the union of all time stamps
+        dates = results[0][2]
+        aligned = all(np.array_equal(r[2], dates) for r in results)
+        if not aligned:
+            dates = np.unique(np.concatenate([r[2] for r in results]))
+
+        columns = {}
+        for in_cell, inverse, cell_dates, data in results:
+            for param, values in data.items():
+                if param not in columns:
+                    dtype = np.result_type(values.dtype, np.float32)
+                    columns[param] = np.full(
+                        (dates.size, gpis.size), np.nan, dtype=dtype
+                    )
+                values = np.ma.filled(
+                    values[inverse].astype(columns[param].dtype), np.nan
+                ).T
+                if aligned:
+                    columns[param][:, in_cell] = values
+                else:
+                    rows = np.searchsorted(dates, cell_dates)
+                    columns[param][rows[:, None], in_cell] = values
+
+        index = pd.DatetimeIndex(dates)
+        result = {}
+        for param, values in columns.items():
+            result[param] = pd.DataFrame(
+                self._scale(param, values), index=index, columns=gpis
+            )
+        return result
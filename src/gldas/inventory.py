@@ -0,0 +1,359 @@
+"""
+Module for taking the inventory of a local GLDAS archive: the product
+versions, the covered period, missing time stamps and duplicate files.
+"""
+
+import os
+import re
+import sys
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from gldas.utils import tstamps_for_daterange
+
+# image file names of the supported products, with the datetime format
+_products = [
+    (
+        re.compile(
+            r"^GLDAS_NOAH025_3H(?P<ep>_EP)?\.A(?P<datetime>\d{8}\.\d{4})"
+            r"\.0(?P<version>\d{2})\.nc4$"
+        ),
+        "%Y%m%d.%H%M",
+    ),
+    (
+        re.compile(
+            r"^GLDAS_NOAH025SUBP_3H\.A(?P<datetime>\d{7}\.\d{4})"
+            r"\.0(?P<version>01)\.\d+\.grb$"
+        ),
+        "%Y%j.%H%M",
+    ),
+]
+
+# names of the year and day of year directories
+_year_regex = re.compile(r"^\d{4}$")
+_doy_regex = re.compile(r"^\d{3}$")
+
+
+def parse_filename(fname):
+    """
+    Parse the product version and time stamp from a GLDAS image file name.
+
+    Parameters
+    ----------
+    fname : str
+        File name, e.g. "GLDAS_NOAH025_3H.A20150101.0300.021.nc4"
+
+    Returns
+    -------
+    version : str or None
+        Product version, e.g. "GLDAS_Noah_v21_025", None if the file is not
+        a GLDAS image file.
+    timestamp : datetime or None
+        Time stamp of the image.
+    """
+    for regex, datetime_format in _products:
+        match = regex.match(fname)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        version = "GLDAS_Noah_v{}_025{}".format(
+            groups["version"].lstrip("0"), groups.get("ep") or ""
+        )
+        return version, datetime.strptime(groups["datetime"], datetime_format)
+    return None, None
+
+
+class ArchiveInventory:
+    """
+    Inventory of the image files in a local GLDAS archive (with %Y/%j
+    subdirectories), created from a single, parallel scan of the directory
+    tree.
+
+    Parameters
+    ----------
+    root : str
+        Root directory of the archive.
+    n_workers : int, optional (default: 8)
+        Number of threads that scan the day directories.
+    start : datetime, optional (default: None)
+        Only scan the images from this time stamp on.
+    end : datetime, optional (default: None)
+        Only scan the images up to this time stamp.
+
+    Attributes
+    ----------
+    files : dict
+        Paths of the image files (values) for each time stamp (keys).
+    versions : dict
+        Number of image files (values) for each product version (keys).
+    """
+
+    def __init__(self, root, n_workers=8, start=None, end=None):
+        self.root = root
+        self.n_workers = n_workers
+        self.start, self.end = start, end
+        self.files = {}
+        self.versions = {}
+        self.scan()
+
+    def _in_period(self, timestamp):
+        return (self.start is None or timestamp >= self.start) and (
+            self.end is None or timestamp <= self.end
+        )
+
+    def _day_dirs(self):
+        """Find all %Y/%j directories below the root within the period"""
+        if not os.path.isdir(self.root):
+            return []
+        first = None if self.start is None else self.start.date()
+        last = None if self.end is None else self.end.date()
+        days = []
+        with os.scandir(self.root) as years:
+            for year in years:
+                if not (_year_regex.match(year.name) and year.is_dir()):
+                    continue
+                if (first is not None and int(year.name) < first.year) or (
+                    last is not None and int(year.name) > last.year
+                ):
+                    continue
+                with os.scandir(year.path) as it:
+                    for e in it:
+                        if not (_doy_regex.match(e.name) and e.is_dir()):
+                            continue
+                        day = datetime(int(year.name), 1, 1).date()
+                        day += timedelta(days=int(e.name) - 1)
+                        if (first is None or day >= first) and (
+                            last is None or day <= last
+                        ):
+                            days.append(e.path)
+        return days
+
+    @staticmethod
+    def _scan_dir(path):
+        """Parse all image file names in a directory"""
+        found = []
+        with os.scandir(path) as it:
+            for entry in it:
+                version, timestamp = parse_filename(entry.name)
+                if version is not None and entry.is_file():
+                    found.append((timestamp, version, entry.path))
+        return found
+
+    def scan(self):
+        """
+        (Re-)scan the archive.
+        """
+        self.files, self.versions = {}, {}
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            for found in executor.map(self._scan_dir, self._day_dirs()):
+                for timestamp, version, path in found:
+                    if not self._in_period(timestamp):
+                        continue
+                    self.files.setdefault(timestamp, []).append(path)
+                    self.versions[version] = self.versions.get(version, 0) + 1
+
+    @property
+    def version(self):
+        """
+        Product version of the archive, None if it is empty or contains
+        files of several versions (see `versions`).
+        """
+        return next(iter(self.versions)) if len(self.versions) == 1 else None
+
+    @property
+    def timestamps(self):
+        """Sorted time stamps of all images in the archive"""
+        return sorted(self.files.keys())
+
+    @property
+    def first(self):
+        """Time stamp of the first image, None for an empty archive"""
+        return min(self.files) if self.files else None
+
+    @property
+    def last(self):
+        """Time stamp of the last image, None for an empty archive"""
+        return max(self.files) if self.files else None
+
+    @property
+    def duplicates(self):
+        """Paths of all images with more than one file for a time stamp"""
+        return {
+            t: sorted(paths)
+            for t, paths in sorted(self.files.items())
+            if len(paths) > 1
+        }
+
+    def available(self, start=None, end=None):
+        """
+        Time stamps of the images in the archive within a period.
+
+        Parameters
+        ----------
+        start : datetime, optional (default: None)
+            Start of the period, the first image if None is passed.
+        end : datetime, optional (default: None)
+            End of the period, the last image if None is passed.
+
+        Returns
+        -------
+        timestamps : list
+            Sorted time stamps.
+        """
+        start = self.first if start is None else start
+        end = self.last if end is None else end
+        return [t for t in self.timestamps if start <= t <= end]
+
+    def missing(self, start=None, end=None):
+        """
+        3-hourly time stamps within a period for which there is no image.
+
+        Parameters
+        ----------
+        start : datetime, optional (default: None)
+            Start of the period, the first image if None is passed.
+        end : datetime, optional (default: None)
+            End of the period, the last image if None is passed.
+
+        Returns
+        -------
+        timestamps : list
+            Sorted time stamps of the missing images.
+        """
+        start = self.first if start is None else start
+        end = self.last if end is None else end
+        if start is None or end is None:
+            return []
+        return [
+            t
+            for t in tstamps_for_daterange(start, end, as_list=True)
+            if t not in self.files
+        ]
+
+    def coverage(self, start=None, end=None):
+        """
+        Fraction of the 3-hourly time stamps within a period for which there
+        is an image.
+
+        Parameters
+        ----------
+        start : datetime, optional (default: None)
+            Start of the period, the first image if None is passed.
+        end : datetime, optional (default: None)
+            End of the period, the last image if None is passed.
+
+        Returns
+        -------
+        coverage : float
+            Coverage between 0 and 1, nan for an empty period.
+        """
+        start = self.first if start is None else start
+        end = self.last if end is None else end
+        if start is None or end is None:
+            return float("nan")
+        n_expected = len(tstamps_for_daterange(start, end))
+        if n_expected == 0:
+            return float("nan")
+        return 1 - len(self.missing(start, end)) / n_expected
+
+    def report(self, start=None, end=None):
+        """
+        Summary of the archive (within a period) as text.
+
+        Parameters
+        ----------
+        start : datetime, optional (default: None)
+            Start of the period, the first image if None is passed.
+        end : datetime, optional (default: None)
+            End of the period, the last image if None is passed.
+
+        Returns
+        -------
+        report : str
+            Versions, period, coverage, missing and duplicate images.
+        """
+        if not self.files:
+            return f"No GLDAS images found in {self.root}."
+
+        start = self.first if start is None else start
+        end = self.last if end is None else end
+        missing = self.missing(start, end)
+        duplicates = {
+            t: p for t, p in self.duplicates.items() if start <= t <= end
+        }
+        lines = [
+            f"Archive: {self.root}",
+            "Versions: "
+            + ", ".join(f"{v} ({n} files)" for v, n in self.versions.items()),
+            f"Period: {start} to {end}",
+            f"Coverage: {100 * self.coverage(start, end):.2f} %",
+            f"Missing images: {len(missing)}",
+        ]
+        lines += [f"  {t}" for t in missing]
+        lines += [f"Duplicate images: {len(duplicates)}"]
+        for t, paths in duplicates.items():
+            lines += [f"  {t}"] + [f"    {p}" for p in paths]
+        return "\n".join(lines)
+
+
+def parse_args(args):
+    """
+    Parse command line parameters for the archive inventory.
+
+    Parameters
+    ----------
+    args : list of str
+        Command line parameters as list of strings.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Report the contents of a local GLDAS archive: product "
+        "versions, covered period, missing time stamps and duplicate files."
+    )
+    parser.add_argument(
+        "localroot", help="Root of the local archive (with %%Y/%%j folders)."
+    )
+    parser.add_argument(
+        "-s",
+        "--start",
+        type=datetime.fromisoformat,
+        help="Start of the period to check, e.g. 2010-01-01. Default: first "
+        "image in the archive.",
+    )
+    parser.add_argument(
+        "-e",
+        "--end",
+        type=datetime.fromisoformat,
+        help="End of the period to check, e.g. 2010-12-31T21:00. Default: "
+        "last image in the archive.",
+    )
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=8,
+        help="Number of threads that scan the folders. Default: 8",
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main routine used for command line interface.
+
+    Parameters
+    ----------
+    args : list of str
+        Command line arguments.
+    """
+    args = parse_args(args)
+    inventory = ArchiveInventory(args.localroot, n_workers=args.n_workers)
+    print(inventory.report(args.start, args.end))
+
+
+def run():
+    main(sys.argv[1:])
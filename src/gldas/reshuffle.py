@@ -26,18 +26,338 @@ time series format using the repurpose package
 """
 
 import os
+import re
 import sys
+import json
 import argparse
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import numpy as np
+from netCDF4 import Dataset, date2num
 from pygeogrids import BasicGrid
 
 from repurpose.img2ts import Img2Ts
+from pynetcf.time_series import OrthoMultiTs
 from gldas.interface import GLDAS_Noah_v1_025Ds, GLDAS_Noah_v21_025Ds
 from gldas.grid import load_grid
+from gldas.cube import GLDASCubeWriter, get_cube_last_timestamp
+from gldas.inventory import ArchiveInventory
+from gldas.aggregate import (
+    GLDASAggregatedDs,
+    aggregations,
+    complete_periods,
+    next_period,
+)
+from gldas.utils import last_time
 import warnings
 
 
+class ReshuffleJournal:
+    """
+    Progress journal of a conversion, to resume it after it was interrupted.
+
+    The journal records which buffers of images were completely converted,
+    which cells of the current buffer were written and the size of the data
+    cube. A conversion that is started again with the same settings
+    continues from there.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the journal file. If the file exists, the progress is loaded
+        from it.
+    config : dict
+        Settings of the conversion (json serializable), including the
+        requested start and end date. The settings must match the ones in an
+        existing journal. Only the converted period ('period') is taken
+        from the journal, because it also depends on the images that were
+        available when the conversion was started.
+    """
+
+    _period = ("period",)
+
+    def __init__(self, filename, config):
+        self.filename = filename
+        self.config = dict(config)
+        self.bulks = set()
+        self.cells = {}
+        self.cube_bulk, self.cube_len = None, None
+
+        # whether an interrupted conversion is continued
+        self.resumed = os.path.isfile(filename)
+        if self.resumed:
+            self._load()
+        else:
+            self._dump()
+
+    def _load(self):
+        with open(self.filename) as f:
+            lines = f.readlines()
+        config = json.loads(lines[0])
+        for key, value in config.items():
+            if key not in self._period and self.config.get(key) != value:
+                raise ValueError(
+                    f"Journal {self.filename} was created with {key}={value}"
+                    f" (now: {self.config.get(key)}). Remove it, or pass "
+                    f"restart=True (--restart) to start a new conversion."
+                )
+        self.config = config
+
+        # the last line is skipped if the process was killed while writing it
+        for line in lines[1:]:
+            if not line.endswith("\n"):
+                break
+            kind, *values = line.split()
+            if kind == "bulk":
+                self.bulks.add(int(values[0]))
+            elif kind == "cell":
+                self.cells.setdefault(int(values[0]), set()).add(
+                    int(values[1])
+                )
+            elif kind == "cube":
+                self.cube_bulk, self.cube_len = int(values[0]), int(values[1])
+
+        for bulk in self.bulks:
+            self.cells.pop(bulk, None)
+
+    def _dump(self):
+        lines = [json.dumps(self.config)]
+        lines += [f"bulk {bulk}" for bulk in sorted(self.bulks)]
+        if self.cube_len is not None:
+            lines.append(f"cube {self.cube_bulk} {self.cube_len}")
+        tmp_file = self.filename + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.filename)
+
+    def record(self, kind, *values):
+        """
+        Append a record to the journal. Cells can be recorded from parallel
+        processes.
+        """
+        with open(self.filename, "a") as f:
+            f.write(" ".join(str(v) for v in (kind,) + values) + "\n")
+
+    def cell_done(self, bulk, cell):
+        self.record("cell", bulk, cell)
+
+    def cube_done(self, bulk, cube_len):
+        self.cube_bulk, self.cube_len = bulk, cube_len
+        self.record("cube", bulk, cube_len)
+
+    def bulk_done(self, bulk):
+        """
+        Mark a buffer as converted. The cell records are not needed anymore
+        and removed from the journal file.
+        """
+        self.bulks.add(bulk)
+        self.cells.pop(bulk, None)
+        self._dump()
+
+    def remove(self):
+        """Remove the journal file after the conversion finished"""
+        os.remove(self.filename)
+
+
+class GLDASImg2Ts(Img2Ts):
+    """
+    Img2Ts that can additionally write each buffer of images that was read
+    into a (time, lat, lon) data cube, so that both output formats are
+    created in one pass over the image files. The progress can be recorded
+    in a journal, to skip converted buffers and cells when an interrupted
+    conversion is started again.
+
+    Parameters
+    ----------
+    cube : GLDASCubeWriter, optional (default: None)
+        Writer for the data cube. If None is passed, no cube is written.
+    write_ts : bool, optional (default: True)
+        Set to False to only write the data cube.
+    journal : ReshuffleJournal, optional (default: None)
+        Journal to record the progress in. If None is passed, the progress
+        is not recorded.
+    kwargs :
+        Passed to Img2Ts
+    """
+
+    def __init__(self, cube=None, write_ts=True, journal=None, **kwargs):
+        super(GLDASImg2Ts, self).__init__(**kwargs)
+        self.cube = cube
+        self.write_ts = write_ts
+        self.journal = journal
+        self._bulk = None
+        self._done_cells = set()
+        self._check_cells = False
+
+    def _bulk_dates(self):
+        """Time stamps of the images in each buffer"""
+        timestamps = list(
+            self.imgin.tstamps_for_daterange(self.startdate, self.enddate)
+        )
+        n = len(timestamps) if self.imgbuffer == -1 else self.imgbuffer
+        return [timestamps[i : i + n] for i in range(0, len(timestamps), n)]
+
+    def img_bulk(self):
+        # the cube writer is not needed (and not passed) in the processes
+        # that read images or write time series.
+        cube, self.cube = self.cube, None
+        journal = self.journal
+        startdate, enddate = self.startdate, self.enddate
+        try:
+            for bulk, dates in enumerate(self._bulk_dates()):
+                if journal is not None and bulk in journal.bulks:
+                    continue
+                if journal is not None:
+                    self._done_cells = journal.cells.get(bulk, set())
+                    # cells can only be partly written in the first buffer
+                    # after an interruption
+                    self._check_cells = journal.resumed and self._bulk is None
+                self._bulk = bulk
+
+                # read only the images of this buffer
+                self.startdate, self.enddate = dates[0], dates[-1]
+                for img_dict, timestamps in super(
+                    GLDASImg2Ts, self
+                ).img_bulk():
+                    if journal is None:
+                        if cube is not None:
+                            cube.write(img_dict, timestamps)
+                    elif cube is not None and journal.cube_bulk != bulk:
+                        # overwrite images of an interrupted write
+                        cube_len = cube.write(
+                            img_dict, timestamps, start=journal.cube_len
+                        )
+                        journal.cube_done(bulk, cube_len)
+                    yield img_dict, timestamps
+                self.startdate, self.enddate = startdate, enddate
+
+                if journal is not None:
+                    journal.bulk_done(bulk)
+        finally:
+            self.cube = cube
+            self.startdate, self.enddate = startdate, enddate
+            self._bulk, self._done_cells = None, set()
+            self._check_cells = False
+
+    def _write_orthogonal(self, cell, **kwargs):
+        if cell in self._done_cells:
+            return
+
+        if self._check_cells:
+            filename = os.path.join(
+                self.outputpath, self.filename_templ % cell
+            )
+            if os.path.isfile(filename):
+                offset, complete = cell_progress(
+                    filename, kwargs["timestamps"]
+                )
+                if complete:
+                    # written before the interruption, but not recorded
+                    self.journal.cell_done(self._bulk, cell)
+                    return
+                if offset is not None:
+                    self._overwrite_orthogonal(filename, offset, **kwargs)
+                    self.journal.cell_done(self._bulk, cell)
+                    return
+
+        super(GLDASImg2Ts, self)._write_orthogonal(cell, **kwargs)
+
+        if self.journal is not None:
+            self.journal.cell_done(self._bulk, cell)
+
+    def _overwrite_orthogonal(
+        self,
+        filename,
+        offset,
+        cell_gpis,
+        cell_lons,
+        cell_lats,
+        timestamps,
+        **celldata,
+    ):
+        """
+        Write the time series of a buffer into a cell file from a time index
+        on, replacing the data of an interrupted write of the same buffer.
+        """
+        idx = np.argsort(cell_gpis)
+        with OrthoMultiTs(
+            filename,
+            n_loc=cell_gpis.size,
+            mode="a",
+            zlib=self.zlib,
+            unlim_chunksize=self.unlim_chunksize,
+            time_units=self.time_units,
+        ) as dataout:
+            dataout.write_offset = offset
+            dataout.write_all(
+                cell_gpis[idx],
+                {k: v[idx] for k, v in celldata.items()},
+                timestamps,
+                lons=cell_lons[idx],
+                lats=cell_lats[idx],
+                attributes=self.ts_attributes,
+            )
+
+    def calc(self):
+        if self.write_ts:
+            super(GLDASImg2Ts, self).calc()
+        else:
+            for _ in self.img_bulk():
+                pass
+
+
+def cell_progress(filename, timestamps):
+    """
+    Check how far the time series of a buffer were written into a cell file
+    before a conversion was interrupted.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the cell file.
+    timestamps : np.ndarray
+        Time stamps (datetime) of the buffer.
+
+    Returns
+    -------
+    offset : int or None
+        Time index of the first time stamp of the buffer, None if nothing
+        of the buffer was written.
+    complete : bool
+        Whether the whole buffer was written.
+    """
+    with Dataset(filename) as ds:
+        time = ds.variables["time"]
+        values = time[:]
+        size = time.size
+        first, last = date2num(
+            [timestamps[0], timestamps[-1]],
+            units=time.units,
+            calendar="standard",
+        )
+        # half a minute in the time units
+        tolerance = abs(
+            date2num(
+                timestamps[0] + timedelta(seconds=30),
+                units=time.units,
+                calendar="standard",
+            )
+            - first
+        )
+
+    valid = ~np.ma.getmaskarray(values)
+    data = np.ma.getdata(values)
+    offset = int(np.sum(valid & (data < first - tolerance)))
+    if size <= offset:
+        return None, False
+    complete = (
+        size == offset + len(timestamps)
+        and bool(valid[-1])
+        and abs(data[-1] - last) <= tolerance
+    )
+    return offset, complete
+
+
 def get_filetype(inpath):
     """
     Tries to find out the file type by searching for
@@ -99,6 +419,112 @@ def str2bool(val):
         return False
 
 
+def parse_memory(value):
+    """
+    Parse a memory size, e.g. '16GB', '512MB' or a number of bytes.
+
+    Parameters
+    ----------
+    value : str or int
+        Memory size with an optional unit (B, KB, MB, GB or TB, powers
+        of 1024).
+
+    Returns
+    -------
+    n_bytes : int
+        Memory size in bytes.
+    """
+    match = re.match(
+        r"^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)I?B?\s*$", str(value).upper()
+    )
+    if match is None:
+        raise ValueError(f"Could not parse memory size: {value}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** "_KMGT".index(unit or "_"))
+
+
+def estimate_imgbuffer(
+    max_memory, n_gpi, n_params, dtype=np.float64, prefetch=0, n_proc=1
+):
+    """
+    Estimate the largest image buffer that can be converted within a memory
+    budget. Img2Ts keeps up to about 3 copies of the buffered data (the
+    images, the stacked arrays and the data sorted by cells) and their masks.
+    With parallel processes, the data of the cells is also copied to the
+    processes that write them. Images that are read ahead (prefetch) or by
+    the parallel processes are subtracted from the budget first.
+
+    Parameters
+    ----------
+    max_memory : int
+        Memory budget for the buffered data in bytes.
+    n_gpi : int
+        Number of grid points in each image.
+    n_params : int
+        Number of parameters in each image.
+    dtype : np.dtype, optional (default: np.float64)
+        Data type of the image data (the image readers return float64).
+    prefetch : int, optional (default: 0)
+        Number of images that are read ahead.
+    n_proc : int, optional (default: 1)
+        Number of parallel processes.
+
+    Returns
+    -------
+    imgbuffer : int
+        Number of images to read at once (at least 1).
+    """
+    n_values = n_gpi * n_params
+    itemsize = np.dtype(dtype).itemsize
+    bytes_per_image = n_values * (3 * itemsize + 2)
+    if n_proc > 1:
+        bytes_per_image += n_values * (itemsize + 1)
+
+    # images that are read in the background, or by the processes
+    in_flight = prefetch + (n_proc if n_proc > 1 else 0)
+    max_memory = max_memory - in_flight * n_values * itemsize
+
+    return max(1, int(max_memory // bytes_per_image))
+
+
+def get_last_timestamp(ts_path, fname_regex=r"^\d{4}\.nc$"):
+    """
+    Find the last time stamp in the time series cell files of a previous
+    conversion. All cell files must end at the same time stamp.
+
+    Parameters
+    ----------
+    ts_path : str
+        Directory of the time series cell files.
+    fname_regex : str, optional
+        Expression for the names of the cell files, by default the file
+        names of Img2Ts, e.g. 0001.nc
+
+    Returns
+    -------
+    last_timestamp : datetime or None
+        Last time stamp in the cell files, None if there are no (non-empty)
+        cell files.
+    """
+    last_timestamps = set()
+    for fname in sorted(os.listdir(ts_path)):
+        if re.match(fname_regex, fname) is None:
+            continue
+        with Dataset(os.path.join(ts_path, fname)) as ds:
+            last = last_time(ds.variables["time"])
+        if last is not None:
+            last_timestamps.add(last)
+
+    if len(last_timestamps) == 0:
+        return None
+    if len(last_timestamps) > 1:
+        raise ValueError(
+            f"Time series cells in {ts_path} end at different time stamps: "
+            f"{sorted(last_timestamps)}"
+        )
+    return last_timestamps.pop()
+
+
 def reshuffle(
     input_root,
     outputpath,
@@ -107,6 +533,17 @@ def reshuffle(
     parameters,
     input_grid=None,
     imgbuffer=50,
+    n_proc=1,
+    prefetch=0,
+    cube_file=None,
+    cube_chunks=(1, 120, 240),
+    cube_complevel=4,
+    write_ts=True,
+    append=False,
+    max_memory=None,
+    aggregation=None,
+    restart=False,
+    check_archive=True,
 ):
     """
     Reshuffle method applied to GLDAS data.
@@ -117,10 +554,12 @@ def reshuffle(
         input path where gldas data was downloaded
     outputpath : string
         Output path.
-    startdate : datetime
-        Start date.
-    enddate : datetime
-        End date.
+    startdate : datetime or None
+        Start date. If None is passed, the first image in input_root is used.
+    enddate : datetime or None
+        End date, the time stamp of the last image to convert (e.g.
+        datetime(2002, 1, 1, 21) for all images of that day). If None is
+        passed, the last image in input_root is used.
     parameters: list
         parameters to read and convert
     input_grid : CellGrid, optional (default: None)
@@ -128,7 +567,176 @@ def reshuffle(
         from data.
     imgbuffer: int, optional
         How many images to read at once before writing time series.
+    n_proc: int, optional (default: 1)
+        Number of parallel processes. If > 1, the images of each buffer are
+        read in parallel and the 5x5 degree cells are distributed among the
+        processes, so that each cell file is written by exactly one process.
+    prefetch: int, optional (default: 0)
+        Number of images to read ahead in the background while the current
+        image is processed. Only used for netCDF data and if n_proc is 1.
+        The images are read by threads, which do not decode images in
+        parallel (see GLDAS_Noah_v21_025Ds), use n_proc for that.
+    cube_file: str, optional (default: None)
+        If a path is passed, the images are also written into a
+        (time, lat, lon) netCDF4 data cube in this file, which is optimized
+        for reading spatial slices.
+    cube_chunks: tuple, optional (default: (1, 120, 240))
+        Chunk shape (time, lat, lon) of the data cube.
+    cube_complevel: int, optional (default: 4)
+        Compression level of the data cube (0 to turn off compression).
+    write_ts: bool, optional (default: True)
+        Set to False to only write the data cube, and no time series.
+    append: bool, optional (default: False)
+        Append to the time series (and data cube) of a previous conversion
+        in outputpath. Only images after the last time stamp in the existing
+        files are converted, startdate is moved accordingly.
+    max_memory: int or str, optional (default: None)
+        Memory budget for the image buffer, e.g. '16GB'. If passed, the
+        largest image buffer that fits is used instead of imgbuffer. Images
+        that are read ahead and the data copied to parallel processes are
+        included (see estimate_imgbuffer).
+    aggregation: str, optional (default: None)
+        'daily' or 'monthly' to convert the daily or monthly means of the
+        3-hourly images (with the start of the day / month as time stamp)
+        instead of the images. The means are computed while the images are
+        read, only complete days / months within the period are converted.
+        The image buffer is then counted in days / months.
+    restart: bool, optional (default: False)
+        Discard the journal of an interrupted conversion in outputpath and
+        start a new conversion instead of resuming it. The files written by
+        the interrupted conversion are not removed, the new conversion is
+        written into them (remove them first).
+    check_archive: bool, optional (default: True)
+        Take the inventory of input_root within the period before the
+        conversion (see below). Set to False to skip it, the images are then
+        searched by the image dataset while they are read. The inventory
+        is always taken if startdate or enddate is None.
+
+    The period is limited to the images found in input_root (with a
+    warning), missing and duplicate images within the period are reported
+    before the conversion. Only the directories within the period are
+    scanned. If the inventory of input_root finds no images in the period
+    (e.g. for unknown file names), the images are searched by the image
+    dataset instead, without these checks.
+
+    The progress is recorded in a journal file in outputpath. If the
+    conversion is interrupted, it continues from there when it is started
+    again with the same settings (including startdate and enddate, a
+    ValueError is raised otherwise, see restart). The journal is removed when
+    the conversion is finished.
     """
+    if not write_ts and cube_file is None:
+        raise ValueError("No output selected, pass a cube file")
+
+    if aggregation is not None and aggregation not in aggregations:
+        raise ValueError(
+            f"Unknown aggregation: {aggregation}. Use one of {aggregations}"
+        )
+
+    # the requested period, which must match the journal of a conversion
+    # that is resumed
+    requested = [
+        None if date is None else date.isoformat()
+        for date in (startdate, enddate)
+    ]
+
+    inventory = None
+    if check_archive or startdate is None or enddate is None:
+        # only the directories within the period are scanned
+        inventory = ArchiveInventory(input_root, start=startdate, end=enddate)
+    if inventory is not None and inventory.first is None:
+        # e.g. file names that the dataset finds, but the inventory does not
+        # know, the images are then searched while they are read
+        if startdate is None or enddate is None:
+            raise ValueError(
+                f"No GLDAS images found in {input_root}, pass startdate and "
+                f"enddate to search the images of the dataset"
+            )
+        warnings.warn(
+            f"No GLDAS images between {startdate} and {enddate} found in "
+            f"{input_root} by the inventory, the period is not checked"
+        )
+        inventory = None
+    elif inventory is not None:
+        if startdate is None:
+            startdate = inventory.first
+        elif startdate < inventory.first:
+            warnings.warn(
+                f"Start date {startdate} is before the first image, using "
+                f"{inventory.first}"
+            )
+            startdate = inventory.first
+        if enddate is None:
+            enddate = inventory.last
+        elif enddate > inventory.last:
+            warnings.warn(
+                f"End date {enddate} is after the last image, using "
+                f"{inventory.last}"
+            )
+            enddate = inventory.last
+
+    journal_file = os.path.join(outputpath, "reshuffle_journal.txt")
+    if restart and os.path.isfile(journal_file):
+        print(f"Discarding the journal {journal_file}.")
+        os.remove(journal_file)
+    resume = os.path.isfile(journal_file)
+
+    if append and not resume:
+        last_timestamps = set()
+        if write_ts and os.path.exists(outputpath):
+            last_timestamps.add(get_last_timestamp(outputpath))
+        if cube_file is not None and os.path.isfile(cube_file):
+            last_timestamps.add(get_cube_last_timestamp(cube_file))
+        last_timestamps.discard(None)
+        if len(last_timestamps) > 1:
+            raise ValueError(
+                "Time series and data cube end at different time stamps: "
+                f"{sorted(last_timestamps)}"
+            )
+        if len(last_timestamps) == 1:
+            last_timestamp = last_timestamps.pop()
+            startdate = max(startdate, last_timestamp + timedelta(hours=3))
+            if startdate > enddate or (
+                aggregation is not None
+                and not complete_periods(startdate, enddate, aggregation)
+            ):
+                print(f"Nothing to append, data ends at {last_timestamp}.")
+                return
+
+    if aggregation is not None:
+        # only convert complete periods, from the first to the last image
+        periods = complete_periods(startdate, enddate, aggregation)
+        if not periods:
+            raise ValueError(
+                f"No complete {aggregation} period between {startdate} and "
+                f"{enddate}"
+            )
+        startdate = periods[0]
+        enddate = next_period(periods[-1], aggregation) - timedelta(hours=3)
+
+    if inventory is not None and not inventory.available(startdate, enddate):
+        warnings.warn(
+            f"No images between {startdate} and {enddate} in the inventory "
+            f"of {input_root} (images are available from {inventory.first} "
+            f"to {inventory.last}), searching the images of the dataset"
+        )
+        inventory = None
+    if inventory is not None:
+        missing = inventory.missing(startdate, enddate)
+        if missing:
+            warnings.warn(
+                f"{len(missing)} images between {startdate} and {enddate} "
+                f"are missing in {input_root}, first missing: {missing[0]}"
+            )
+        duplicates = [
+            t for t in inventory.duplicates if startdate <= t <= enddate
+        ]
+        if duplicates:
+            warnings.warn(
+                f"{len(duplicates)} images between {startdate} and "
+                f"{enddate} have more than one file in {input_root}, first "
+                f"duplicate: {duplicates[0]}"
+            )
 
     if get_filetype(input_root) == "grib":
         if input_grid is not None:
@@ -139,23 +747,105 @@ def reshuffle(
         )
     else:
         input_dataset = GLDAS_Noah_v21_025Ds(
-            input_root, parameters, subgrid=input_grid, array_1D=True
+            input_root,
+            parameters,
+            subgrid=input_grid,
+            array_1D=True,
+            prefetch=prefetch if n_proc == 1 else 0,
         )
 
     if not os.path.exists(outputpath):
         os.makedirs(outputpath)
 
+    if max_memory is not None:
+        imgbuffer = estimate_imgbuffer(
+            parse_memory(max_memory),
+            input_dataset.grid.activegpis.size,
+            len(parameters),
+            dtype=np.float64,
+            prefetch=prefetch if n_proc == 1 else 0,
+            n_proc=n_proc,
+        )
+        print(
+            f"Using an image buffer of {imgbuffer} images for a memory "
+            f"budget of {max_memory}."
+        )
+
+    journal = ReshuffleJournal(
+        journal_file,
+        {
+            "startdate": requested[0],
+            "enddate": requested[1],
+            "period": [startdate.isoformat(), enddate.isoformat()],
+            "parameters": list(parameters),
+            "n_gpi": int(input_dataset.grid.activegpis.size),
+            "imgbuffer": imgbuffer,
+            "write_ts": write_ts,
+            "cube_file": cube_file,
+            "aggregation": aggregation,
+        },
+    )
+    if journal.resumed:
+        startdate, enddate = map(
+            datetime.fromisoformat, journal.config["period"]
+        )
+        print(f"Resuming the conversion from {journal_file}.")
+
     global_attr = {"product": "GLDAS"}
 
     # get time series attributes from first day of data.
-    data = input_dataset.read(startdate)
+    if inventory is not None:
+        data = input_dataset.read(inventory.available(startdate, enddate)[0])
+    else:
+        data = None
+        for timestamp in input_dataset.tstamps_for_daterange(
+            startdate, enddate
+        ):
+            try:
+                data = input_dataset.read(timestamp)
+                break
+            except IOError:
+                continue
+        if data is None:
+            raise ValueError(
+                f"No images between {startdate} and {enddate} in "
+                f"{input_root}"
+            )
     ts_attributes = data.metadata
     if input_grid is None:
         grid = BasicGrid(data.lon, data.lat)
     else:
         grid = input_grid
 
-    reshuffler = Img2Ts(
+    if aggregation is not None:
+        global_attr["time_aggregation"] = aggregation
+        ts_attributes = {
+            param: dict(attrs, cell_methods="time: mean")
+            for param, attrs in ts_attributes.items()
+        }
+        input_dataset = GLDASAggregatedDs(
+            input_dataset,
+            aggregation,
+            available=None if inventory is None else inventory.files,
+        )
+
+    if cube_file is not None:
+        cube = GLDASCubeWriter(
+            cube_file,
+            input_dataset.grid,
+            chunks=cube_chunks,
+            complevel=cube_complevel,
+            attributes=ts_attributes,
+            global_attr=global_attr,
+            append=append or journal.resumed,
+        )
+    else:
+        cube = None
+
+    reshuffler = GLDASImg2Ts(
+        cube=cube,
+        write_ts=write_ts,
+        journal=journal,
         input_dataset=input_dataset,
         outputpath=outputpath,
         startdate=startdate,
@@ -165,12 +855,17 @@ def reshuffle(
         cellsize_lat=5.0,
         cellsize_lon=5.0,
         global_attr=global_attr,
-        n_proc=1,
+        n_proc=n_proc,
+        # the image dataset keeps one open reader object, which must not be
+        # shared between threads. Use separate processes instead.
+        backend="loky",
         zlib=True,
         unlim_chunksize=1000,
         ts_attributes=ts_attributes,
     )
     reshuffler.calc()
+    input_dataset.close()
+    journal.remove()
 
 
 def parse_args(args):
@@ -212,7 +907,11 @@ def parse_args(args):
     parser.add_argument(
         "end",
         type=mkdate,
-        help=("Enddate. Either in format YYYY-MM-DD or " "YYYY-MM-DDTHH:MM."),
+        help=(
+            "Enddate, the time stamp of the last image to convert. Either in "
+            "format YYYY-MM-DD or YYYY-MM-DDTHH:MM (e.g. 2002-01-01T21:00 "
+            "for all images of a day)."
+        ),
     )
 
     parser.add_argument(
@@ -259,6 +958,110 @@ def parse_args(args):
         ),
     )
 
+    parser.add_argument(
+        "--max_memory",
+        type=str,
+        default=None,
+        help=(
+            "Memory budget for the image buffer, e.g. 16GB. If set, the "
+            "largest image buffer that fits is used instead of --imgbuffer."
+        ),
+    )
+
+    parser.add_argument(
+        "--n_proc",
+        type=int,
+        default=1,
+        help=(
+            "Number of parallel processes to use for reading images and "
+            "writing time series cells."
+        ),
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help=(
+            "Number of images to read ahead in the background while the "
+            "current image is processed (only used if n_proc is 1). Images "
+            "are not decoded in parallel, use n_proc for that."
+        ),
+    )
+
+    parser.add_argument(
+        "--cube_file",
+        type=str,
+        default=None,
+        help=(
+            "Also write the images into a (time, lat, lon) netCDF4 data "
+            "cube in this file, for fast reading of spatial slices."
+        ),
+    )
+
+    parser.add_argument(
+        "--cube_chunks",
+        type=int,
+        default=[1, 120, 240],
+        nargs=3,
+        help="time lat lon. Chunk shape of the data cube.",
+    )
+
+    parser.add_argument(
+        "--cube_complevel",
+        type=int,
+        default=4,
+        help="Compression level of the data cube (0 to turn off).",
+    )
+
+    parser.add_argument(
+        "--cube_only",
+        type=str2bool,
+        default="False",
+        help="Set True to only write the data cube and no time series.",
+    )
+
+    parser.add_argument(
+        "--append",
+        type=str2bool,
+        default="False",
+        help=(
+            "Set True to append to the time series of a previous conversion "
+            "in timeseries_root. Only images after the last time stamp in "
+            "the existing files are converted."
+        ),
+    )
+
+    parser.add_argument(
+        "--aggregation",
+        choices=aggregations,
+        default=None,
+        help=(
+            "Convert the daily or monthly means of the 3-hourly images "
+            "instead of the images (only complete days / months)."
+        ),
+    )
+
+    parser.add_argument(
+        "--check_archive",
+        type=str2bool,
+        default="True",
+        help=(
+            "Set False to skip the inventory of the images in dataset_root "
+            "(missing and duplicate images) before the conversion."
+        ),
+    )
+
+    parser.add_argument(
+        "--restart",
+        type=str2bool,
+        default="False",
+        help=(
+            "Set True to discard the journal of an interrupted conversion "
+            "in timeseries_root and start a new one instead of resuming it."
+        ),
+    )
+
     args = parser.parse_args(args)
     # set defaults that can not be handled by argparse
 
@@ -296,6 +1099,17 @@ def main(args):
         args.parameters,
         input_grid=input_grid,
         imgbuffer=args.imgbuffer,
+        n_proc=args.n_proc,
+        prefetch=args.prefetch,
+        cube_file=args.cube_file,
+        cube_chunks=tuple(args.cube_chunks),
+        cube_complevel=args.cube_complevel,
+        write_ts=not args.cube_only,
+        append=args.append,
+        max_memory=args.max_memory,
+        aggregation=args.aggregation,
+        restart=args.restart,
+        check_archive=args.check_archive,
     )
 
 
@@ -0,0 +1,619 @@
+"""
+Module for creating synthetic GLDAS Noah archives, e.g. to test and
+benchmark the readers, the conversion to time series and the download
+offline at any scale.
+
+The image files have the layout of the files from GES DISC: the %Y/%j
+folders and file names, the 600 x 1440 (-59.875 to 89.875 DEG) grid, the
+variable names, units, fill values and compression of GLDAS Noah v2.x
+netCDF4 files, or the parameter ids and layers of the GLDAS Noah v1 GRIB
+files. Ocean points (from the GLDAS land mask) are missing. The values are
+smooth, deterministic functions of the location and time within the
+valid range of each variable.
+"""
+
+import os
+import sys
+import math
+import argparse
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from netCDF4 import Dataset
+
+from gldas.utils import tstamps_for_daterange
+
+n_lat, n_lon = 600, 1440
+lats = np.arange(n_lat) * 0.25 - 59.875
+lons = np.arange(n_lon) * 0.25 - 179.875
+
+# GLDAS Noah v2.x variables: long name, units, valid range, cell methods
+variables = {
+    "Swnet_tavg": ("Net short wave radiation flux", "W m-2", 0, 1000, "mean"),
+    "Lwnet_tavg": ("Net long-wave radiation flux", "W m-2", -300, 50, "mean"),
+    "Qle_tavg": ("Latent heat net flux", "W m-2", -50, 600, "mean"),
+    "Qh_tavg": ("Sensible heat net flux", "W m-2", -300, 600, "mean"),
+    "Qg_tavg": ("Heat flux", "W m-2", -200, 200, "mean"),
+    "Snowf_tavg": ("Snow precipitation rate", "kg m-2 s-1", 0, 0.01, "mean"),
+    "Rainf_tavg": ("Rain precipitation rate", "kg m-2 s-1", 0, 0.02, "mean"),
+    "Evap_tavg": ("Evapotranspiration", "kg m-2 s-1", 0, 3e-4, "mean"),
+    "Qs_acc": ("Storm surface runoff", "kg m-2", 0, 50, "sum"),
+    "Qsb_acc": ("Baseflow-groundwater runoff", "kg m-2", 0, 50, "sum"),
+    "Qsm_acc": ("Snow melt", "kg m-2", 0, 50, "sum"),
+    "AvgSurfT_inst": ("Average Surface Skin temperature", "K", 200, 340, None),
+    "Albedo_inst": ("Albedo", "%", 5, 90, None),
+    "SWE_inst": ("Snow depth water equivalent", "kg m-2", 0, 500, None),
+    "SnowDepth_inst": ("Snow depth", "m", 0, 3, None),
+    "SoilMoi0_10cm_inst": ("Soil moisture", "kg m-2", 2, 50, None),
+    "SoilMoi10_40cm_inst": ("Soil moisture", "kg m-2", 6, 150, None),
+    "SoilMoi40_100cm_inst": ("Soil moisture", "kg m-2", 12, 300, None),
+    "SoilMoi100_200cm_inst": ("Soil moisture", "kg m-2", 20, 500, None),
+    "SoilTMP0_10cm_inst": ("Soil temperature", "K", 220, 330, None),
+    "SoilTMP10_40cm_inst": ("Soil temperature", "K", 220, 330, None),
+    "SoilTMP40_100cm_inst": ("Soil temperature", "K", 220, 330, None),
+    "SoilTMP100_200cm_inst": ("Soil temperature", "K", 220, 330, None),
+    "PotEvap_tavg": ("Potential evaporation rate", "W m-2", 0, 1000, "mean"),
+    "ECanop_tavg": ("Interception evaporation", "W m-2", 0, 300, "mean"),
+    "Tveg_tavg": ("Transpiration", "W m-2", 0, 500, "mean"),
+    "ESoil_tavg": (
+        "Direct Evaporation from Bare Soil",
+        "W m-2",
+        0,
+        300,
+        "mean",
+    ),
+    "RootMoist_inst": ("Root zone soil moisture", "kg m-2", 20, 600, None),
+    "CanopInt_inst": ("Plant canopy surface water", "kg m-2", 0, 1, None),
+    "Wind_f_inst": ("Wind speed", "m s-1", 0, 25, None),
+    "Rainf_f_tavg": (
+        "Total precipitation rate",
+        "kg m-2 s-1",
+        0,
+        0.02,
+        "mean",
+    ),
+    "Tair_f_inst": ("Temperature", "K", 200, 330, None),
+    "Qair_f_inst": ("Specific humidity", "kg kg-1", 0, 0.03, None),
+    "Psurf_f_inst": ("Pressure", "Pa", 50000, 105000, None),
+    "SWdown_f_tavg": (
+        "Downward short-wave radiation flux",
+        "W m-2",
+        0,
+        1200,
+        "mean",
+    ),
+    "LWdown_f_tavg": (
+        "Downward long-wave radiation flux",
+        "W m-2",
+        100,
+        500,
+        "mean",
+    ),
+}
+
+# GLDAS Noah v1 GRIB messages: parameter id, soil layer (top and bottom in
+# cm, None for surface parameters), decimal scale factor and valid range
+grib_messages = [
+    (1, None, 0, 50000, 105000),
+    (11, None, 2, 200, 330),
+    (32, None, 2, 0, 25),
+    (51, None, 5, 0, 0.03),
+    (57, None, 7, 0, 3e-4),
+    (65, None, 2, 0, 500),
+    (71, None, 2, 0, 100),
+    (85, (0, 10), 2, 220, 330),
+    (85, (10, 40), 2, 220, 330),
+    (85, (40, 100), 2, 220, 330),
+    (85, (100, 200), 2, 220, 330),
+    (86, (0, 10), 3, 2, 50),
+    (86, (10, 40), 3, 6, 150),
+    (86, (40, 100), 3, 12, 300),
+    (86, (100, 200), 3, 20, 500),
+    (99, None, 2, 0, 50),
+    (111, None, 2, 0, 1000),
+    (112, None, 2, -300, 50),
+    (121, None, 2, -50, 600),
+    (122, None, 2, -300, 600),
+    (131, None, 7, 0, 0.01),
+    (132, None, 7, 0, 0.02),
+    (138, None, 2, 200, 340),
+    (155, None, 2, -200, 200),
+    (204, None, 2, 0, 1200),
+    (205, None, 2, 100, 500),
+    (234, None, 2, 0, 50),
+    (235, None, 2, 0, 50),
+]
+
+products = {
+    "GLDAS_Noah_v20_025": "GLDAS_NOAH025_3H.A{:%Y%m%d.%H%M}.020.nc4",
+    "GLDAS_Noah_v21_025": "GLDAS_NOAH025_3H.A{:%Y%m%d.%H%M}.021.nc4",
+    "GLDAS_Noah_v21_025_EP": "GLDAS_NOAH025_3H_EP.A{:%Y%m%d.%H%M}.021.nc4",
+    "GLDAS_Noah_v1_025": (
+        "GLDAS_NOAH025SUBP_3H.A{:%Y%j.%H%M}.001.{:%Y%j%H%M%S}.grb"
+    ),
+}
+
+
+@lru_cache(maxsize=None)
+def land_mask():
+    """
+    Land mask (600 x 1440, south up) of the GLDAS grid.
+    """
+    with Dataset(
+        os.path.join(
+            os.path.abspath(os.path.dirname(__file__)),
+            "GLDASp4_landmask_025d.nc4",
+        )
+    ) as ds:
+        mask = ds.variables["GLDAS_mask"][0].filled(0.0) == 1.0
+    mask.flags.writeable = False
+    return mask
+
+
+def synthetic_field(timestamp, index, vmin, vmax):
+    """
+    Smooth field (600 x 1440) within a valid range, which varies with the
+    time of the day and the season.
+
+    Parameters
+    ----------
+    timestamp : datetime
+        Time stamp of the image.
+    index : int
+        Index of the variable, to create different fields per variable.
+    vmin : float
+        Minimum value.
+    vmax : float
+        Maximum value.
+
+    Returns
+    -------
+    field : np.ndarray
+        Field as float32 array.
+    """
+    hours = (timestamp - datetime(2000, 1, 1)).total_seconds() / 3600
+    day = 2 * math.pi * hours / 24
+    year = 2 * math.pi * hours / (24 * 365.25)
+    lat = np.radians(lats)[:, np.newaxis]
+    lon = np.radians(lons)[np.newaxis, :]
+    frac = (
+        0.5
+        + 0.25 * np.cos(lat * (index % 3 + 1) + year + index)
+        + 0.2 * np.sin(lon * (index % 4 + 1) + day)
+    )
+    return (vmin + (vmax - vmin) * frac).astype(np.float32)
+
+
+def write_nc4_image(
+    filename, timestamp, parameters=None, complevel=4, version="2.1"
+):
+    """
+    Write a synthetic GLDAS Noah v2.x netCDF4 image file.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file.
+    timestamp : datetime
+        Time stamp of the image.
+    parameters : list, optional (default: None)
+        Variables to write, all GLDAS Noah v2.x variables if None is passed.
+    complevel : int, optional (default: 4)
+        Deflate level of the variables (with shuffle filter), as in the
+        files from GES DISC.
+    version : str, optional (default: '2.1')
+        GLDAS version for the global attributes.
+    """
+    parameters = list(variables) if parameters is None else parameters
+    ocean = ~land_mask()
+
+    with Dataset(filename, "w") as ds:
+        ds.setncatts(
+            {
+                "missing_value": np.float32(-9999.0),
+                "time_definition": "3-hourly",
+                "title": f"GLDAS{version} LIS land surface model output "
+                "(synthetic)",
+                "institution": "NASA GSFC",
+                "source": "Noah_3.6",
+                "history": f"created on date: {datetime.now():%c}",
+                "conventions": "CF-1.6",
+                "MAP_PROJECTION": "EQUIDISTANT CYLINDRICAL",
+                "SOUTH_WEST_CORNER_LAT": np.float32(-59.875),
+                "SOUTH_WEST_CORNER_LON": np.float32(-179.875),
+                "DX": np.float32(0.25),
+                "DY": np.float32(0.25),
+            }
+        )
+        ds.createDimension("lon", n_lon)
+        ds.createDimension("lat", n_lat)
+        ds.createDimension("time", None)
+        ds.createDimension("bnds", 2)
+
+        for name, values, units in [
+            ("lon", lons, "degrees_east"),
+            ("lat", lats, "degrees_north"),
+        ]:
+            var = ds.createVariable(
+                name,
+                "f4",
+                (name,),
+                zlib=complevel > 0,
+                complevel=complevel,
+                shuffle=True,
+                fill_value=np.float32(-9999.0),
+            )
+            var.setncatts(
+                {
+                    "units": units,
+                    "standard_name": {"lon": "longitude", "lat": "latitude"}[
+                        name
+                    ],
+                    "long_name": {"lon": "longitude", "lat": "latitude"}[name],
+                    "missing_value": np.float32(-9999.0),
+                    "vmin": np.float32(values[0]),
+                    "vmax": np.float32(values[-1]),
+                }
+            )
+            var[:] = values
+
+        time = ds.createVariable("time", "f8", ("time",))
+        time.setncatts(
+            {
+                "units": f"days since {timestamp:%Y-%m-%d %H:%M:%S}",
+                "long_name": "time",
+                "time_increment": "10800",
+                "bounds": "time_bnds",
+            }
+        )
+        time[:] = [0.0]
+        ds.createVariable("time_bnds", "f8", ("time", "bnds"))[:] = [
+            [-0.125, 0.0]
+        ]
+
+        for parameter in parameters:
+            long_name, units, vmin, vmax, method = variables[parameter]
+            var = ds.createVariable(
+                parameter,
+                "f4",
+                ("time", "lat", "lon"),
+                zlib=complevel > 0,
+                complevel=complevel,
+                shuffle=True,
+                chunksizes=(1, n_lat, n_lon),
+                fill_value=np.float32(-9999.0),
+            )
+            var.setncatts(
+                {
+                    "units": units,
+                    "standard_name": long_name.lower().replace(" ", "_"),
+                    "long_name": long_name,
+                    "missing_value": np.float32(-9999.0),
+                    "vmin": np.float32(vmin),
+                    "vmax": np.float32(vmax),
+                }
+            )
+            if method is not None:
+                var.cell_methods = f"time: {method}"
+            data = synthetic_field(
+                timestamp, list(variables).index(parameter), vmin, vmax
+            )
+            data[ocean] = -9999.0
+            var[0] = data
+
+
+def _ibm_float(value):
+    """
+    Encode a number as IBM single precision float (GRIB1 reference value),
+    rounded towards minus infinity, and return the bytes and the value.
+    """
+    if value == 0:
+        return bytes(4), 0.0
+    sign = 0x80 if value < 0 else 0
+    exponent = math.floor(math.log(abs(value), 16)) + 1
+    mantissa = abs(value) / 16.0**exponent
+    if mantissa >= 1:
+        mantissa, exponent = mantissa / 16, exponent + 1
+    mantissa = (math.ceil if sign else math.floor)(mantissa * 2**24)
+    if mantissa >= 2**24:
+        mantissa, exponent = mantissa >> 4, exponent + 1
+    encoded = (sign << 24) | ((exponent + 64) << 24) | mantissa
+    decoded = (-1 if sign else 1) * mantissa / 2**24 * 16.0**exponent
+    return encoded.to_bytes(4, "big"), decoded
+
+
+def _signed(value, n_bytes):
+    """Sign and magnitude integer, as used by GRIB1"""
+    sign = 1 << (8 * n_bytes - 1) if value < 0 else 0
+    return (sign | abs(value)).to_bytes(n_bytes, "big")
+
+
+def _grib_message(timestamp, parameter, layer, decimals, values, land):
+    """
+    Encode one GRIB1 message (lat/lon grid, bitmap, simple packing with
+    16 bits per value).
+    """
+    century, year = divmod(timestamp.year - 1, 100)
+    if layer is None:
+        level = bytes([1, 0, 0])
+    else:
+        level = bytes([112, layer[0], layer[1]])
+    pds = (
+        (28).to_bytes(3, "big")
+        + bytes([1, 7, 1, 255, 0xC0, parameter])
+        + level
+        + bytes(
+            [
+                year + 1,
+                timestamp.month,
+                timestamp.day,
+                timestamp.hour,
+                timestamp.minute,
+                1,
+                0,
+                0,
+                0,
+            ]
+        )
+        + bytes([0, 0, 0, century + 1, 0])
+        + _signed(decimals, 2)
+    )
+    gds = (
+        (32).to_bytes(3, "big")
+        + bytes([0, 255, 0])
+        + n_lon.to_bytes(2, "big")
+        + n_lat.to_bytes(2, "big")
+        + _signed(-59875, 3)
+        + _signed(-179875, 3)
+        + bytes([0x80])
+        + _signed(89875, 3)
+        + _signed(179875, 3)
+        + (250).to_bytes(2, "big")
+        + (250).to_bytes(2, "big")
+        + bytes([0x40])
+        + bytes(4)
+    )
+    bitmap = np.packbits(land.ravel()).tobytes()
+    bms = (6 + len(bitmap)).to_bytes(3, "big") + bytes([0, 0, 0]) + bitmap
+
+    # simple packing: value = (R + X * 2**E) / 10**D
+    scaled = np.round(values[land].astype(np.float64) * 10.0**decimals)
+    reference, r = _ibm_float(float(scaled.min()))
+    span = float(scaled.max()) - r
+    scale = max(math.ceil(math.log2(span / 65535)), 0) if span > 0 else 0
+    packed = np.round((scaled - r) / 2.0**scale).astype(">u2").tobytes()
+    # sections have an even length, the padding counts as unused bits
+    pad = (11 + len(packed)) % 2
+    bds = (
+        (11 + len(packed) + pad).to_bytes(3, "big")
+        + bytes([8 * pad])
+        + _signed(scale, 2)
+        + reference
+        + bytes([16])
+        + packed
+        + bytes(pad)
+    )
+
+    body = pds + gds + bms + bds + b"7777"
+    return b"GRIB" + (8 + len(body)).to_bytes(3, "big") + bytes([1]) + body
+
+
+def write_grib_image(filename, timestamp):
+    """
+    Write a synthetic GLDAS Noah v1 GRIB image file with all parameters.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file.
+    timestamp : datetime
+        Time stamp of the image.
+    """
+    land = land_mask()
+    with open(filename, "wb") as f:
+        for i, (parameter, layer, decimals, vmin, vmax) in enumerate(
+            grib_messages
+        ):
+            values = synthetic_field(timestamp, i, vmin, vmax)
+            f.write(
+                _grib_message(
+                    timestamp, parameter, layer, decimals, values, land
+                )
+            )
+
+
+def write_sidecar(filename):
+    """
+    Write the .xml metadata file (size and CRC32 checksum) of a file, as
+    provided by GES DISC.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file.
+    """
+    # imported here, the download module is not needed otherwise
+    from gldas.download import file_checksum
+
+    fname = os.path.basename(filename)
+    with open(filename + ".xml", "w") as f:
+        f.write(
+            "<S4PAGranuleMetaDataFile><DataGranule>"
+            f"<GranuleID>{fname}</GranuleID>"
+            "<SizeBytesDataGranule>"
+            f"{os.path.getsize(filename)}"
+            "</SizeBytesDataGranule>"
+            "<CheckSum><CheckSumType>CRC32</CheckSumType>"
+            f"<CheckSumValue>{file_checksum(filename)}</CheckSumValue>"
+            "</CheckSum></DataGranule></S4PAGranuleMetaDataFile>"
+        )
+
+
+def _write_image(
+    root, timestamp, product, parameters, complevel, sidecars, created
+):
+    folder = os.path.join(root, f"{timestamp:%Y}", f"{timestamp:%j}")
+    os.makedirs(folder, exist_ok=True)
+    filename = os.path.join(
+        folder, products[product].format(timestamp, created)
+    )
+    if product == "GLDAS_Noah_v1_025":
+        write_grib_image(filename, timestamp)
+    else:
+        version = "2.0" if product == "GLDAS_Noah_v20_025" else "2.1"
+        write_nc4_image(filename, timestamp, parameters, complevel, version)
+    if sidecars:
+        write_sidecar(filename)
+    return filename
+
+
+def create_archive(
+    root,
+    start,
+    end,
+    product="GLDAS_Noah_v21_025",
+    parameters=None,
+    complevel=4,
+    sidecars=False,
+    n_proc=1,
+):
+    """
+    Create a synthetic archive of 3-hourly GLDAS Noah images in %Y/%j
+    folders.
+
+    Parameters
+    ----------
+    root : str
+        Root folder of the archive.
+    start : datetime
+        First time stamp.
+    end : datetime
+        Last time stamp.
+    product : str, optional (default: 'GLDAS_Noah_v21_025')
+        One of 'GLDAS_Noah_v20_025', 'GLDAS_Noah_v21_025',
+        'GLDAS_Noah_v21_025_EP' (netCDF4) or 'GLDAS_Noah_v1_025' (GRIB).
+    parameters : list, optional (default: None)
+        Variables to write into the netCDF4 files, all if None is passed.
+        GRIB files always contain all parameters.
+    complevel : int, optional (default: 4)
+        Deflate level of the netCDF4 variables.
+    sidecars : bool, optional (default: False)
+        Also write the .xml metadata files.
+    n_proc : int, optional (default: 1)
+        Number of processes that write the files.
+
+    Returns
+    -------
+    filenames : list
+        Paths of the created image files.
+    """
+    if product not in products:
+        raise ValueError(
+            f"Unknown product: {product}, choose one of {list(products)}"
+        )
+    if parameters is not None:
+        unknown = set(parameters) - set(variables)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+
+    timestamps = tstamps_for_daterange(start, end, as_list=True)
+    args = (product, parameters, complevel, sidecars, datetime.now())
+    if n_proc == 1:
+        return [_write_image(root, t, *args) for t in timestamps]
+
+    with ProcessPoolExecutor(n_proc) as executor:
+        futures = [
+            executor.submit(_write_image, root, t, *args) for t in timestamps
+        ]
+        return [f.result() for f in futures]
+
+
+def parse_args(args):
+    """
+    Parse command line parameters for creating a synthetic archive.
+
+    Parameters
+    ----------
+    args : list of str
+        Command line parameters as list of strings.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Create a synthetic archive of GLDAS Noah image files "
+        "(for tests and benchmarks)."
+    )
+    parser.add_argument("localroot", help="Root folder of the archive.")
+    parser.add_argument(
+        "start",
+        type=datetime.fromisoformat,
+        help="First time stamp, e.g. 2015-01-01 or 2015-01-01T03:00",
+    )
+    parser.add_argument(
+        "end",
+        type=datetime.fromisoformat,
+        help="Last time stamp, e.g. 2015-12-31T21:00",
+    )
+    parser.add_argument(
+        "--product",
+        choices=list(products),
+        default="GLDAS_Noah_v21_025",
+        help="Product (file format and names). Default: GLDAS_Noah_v21_025",
+    )
+    parser.add_argument(
+        "--parameters",
+        nargs="+",
+        choices=list(variables),
+        metavar="PARAMETER",
+        help="Variables to write into the netCDF4 files. Default: all",
+    )
+    parser.add_argument(
+        "--complevel",
+        type=int,
+        default=4,
+        help="Deflate level of the netCDF4 variables. Default: 4",
+    )
+    parser.add_argument(
+        "--sidecars",
+        action="store_true",
+        help="Also write the .xml metadata files (size and checksum).",
+    )
+    parser.add_argument(
+        "--n_proc",
+        type=int,
+        default=1,
+        help="Number of processes that write the files. Default: 1",
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main routine used for command line interface.
+
+    Parameters
+    ----------
+    args : list of str
+        Command line arguments.
+    """
+    args = parse_args(args)
+    filenames = create_archive(
+        args.localroot,
+        args.start,
+        args.end,
+        product=args.product,
+        parameters=args.parameters,
+        complevel=args.complevel,
+        sidecars=args.sidecars,
+        n_proc=args.n_proc,
+    )
+    print(f"Created {len(filenames)} image files in {args.localroot}.")
+
+
+def run():
+    main(sys.argv[1:])
@@ -1,6 +1,9 @@
 import functools
 import inspect
 import warnings
+import numpy as np
+from datetime import datetime, timedelta
+from netCDF4 import num2date
 
 
 class PygribError(ImportError):
@@ -45,3 +48,70 @@ def deprecated(message: str = None):
         return new_func
 
     return decorator
+
+
+def tstamps_for_daterange(start_date, end_date, freq_hours=3, as_list=False):
+    """
+    Get the timestamps of all GLDAS images between two dates. Images are
+    available every `freq_hours` hours starting at 00:00 UTC, the returned
+    timestamps are clipped to the exact start and end instants (inclusive).
+
+    Parameters
+    ----------
+    start_date : datetime or np.datetime64
+        Start of the date range
+    end_date : datetime or np.datetime64
+        End of the date range
+    freq_hours : int, optional (default: 3)
+        Temporal resolution of the images in hours
+    as_list : bool, optional (default: False)
+        Return a list of datetime objects instead of an array
+
+    Returns
+    -------
+    timestamps : np.ndarray or list
+        Image timestamps as datetime64[s] array (or list of datetime objects)
+    """
+    step = np.timedelta64(freq_hours * 3600, "s")
+    start = np.datetime64(start_date, "s")
+    end = np.datetime64(end_date, "s")
+
+    # first and last image time stamp within the range, images are aligned
+    # with 00:00 UTC (which is also the case for the numpy epoch)
+    first = start + (-(start - np.datetime64(0, "s")) % step)
+    last = end - ((end - np.datetime64(0, "s")) % step)
+
+    timestamps = np.arange(first, last + step, step, dtype="datetime64[s]")
+
+    if as_list:
+        return timestamps.tolist()
+    else:
+        return timestamps
+
+
+def last_time(time_var):
+    """
+    Read the last time stamp of a netCDF time variable.
+
+    Parameters
+    ----------
+    time_var : netCDF4.Variable
+        Time variable with a `units` attribute.
+
+    Returns
+    -------
+    timestamp : datetime or None
+        Last time stamp (rounded to minutes), None if the variable is empty.
+    """
+    if time_var.size == 0:
+        return None
+    last = num2date(
+        time_var[-1],
+        units=time_var.units,
+        only_use_cftime_datetimes=False,
+        only_use_python_datetimes=True,
+    )
+    # remove rounding errors of the stored floats
+    return datetime(last.year, last.month, last.day, last.hour) + timedelta(
+        minutes=round(last.minute + last.second / 60)
+    )
@@ -0,0 +1,91 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from gldas.aggregate import (
+    GLDASAggregatedDs,
+    complete_periods,
+    period_images,
+    period_start,
+)
+from gldas.interface import GLDAS_Noah_v21_025Ds
+from gldas.grid import load_grid
+from gldas.synthetic import create_archive
+
+
+def test_periods():
+    assert period_start(datetime(2015, 2, 3, 21), "daily") == datetime(
+        2015, 2, 3
+    )
+    assert period_start(datetime(2015, 2, 3, 21), "monthly") == datetime(
+        2015, 2, 1
+    )
+    with pytest.raises(ValueError):
+        period_start(datetime(2015, 2, 3), "weekly")
+
+    assert len(period_images(datetime(2015, 1, 1), "daily")) == 8
+    images = period_images(datetime(2015, 12, 1), "monthly")
+    assert len(images) == 31 * 8
+    assert images[-1] == datetime(2015, 12, 31, 21)
+
+    assert complete_periods(
+        datetime(2015, 1, 1, 3), datetime(2015, 1, 4, 18), "daily"
+    ) == [datetime(2015, 1, 2), datetime(2015, 1, 3)]
+    assert complete_periods(
+        datetime(2015, 11, 1), datetime(2016, 1, 31, 21), "monthly"
+    ) == [datetime(2015, 11, 1), datetime(2015, 12, 1), datetime(2016, 1, 1)]
+    assert complete_periods(
+        datetime(2015, 1, 1), datetime(2015, 1, 31, 18), "monthly"
+    ) == []
+
+
+def test_aggregated_dataset(tmp_path):
+    root = str(tmp_path)
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    files = create_archive(
+        root,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 2, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    # a missing image
+    missing = datetime(2015, 1, 2, 6)
+    for filename in files:
+        if "A20150102.0600" in filename:
+            os.remove(filename)
+
+    grid = load_grid(land_points=True, bbox=(5, 40, 20, 50))
+    dataset = GLDAS_Noah_v21_025Ds(
+        root, parameters, subgrid=grid, array_1D=True
+    )
+    available = set(period_images(datetime(2015, 1, 1), "monthly"))
+    available.discard(missing)
+    ds = GLDASAggregatedDs(dataset, "daily", available=available)
+    assert ds.grid is dataset.grid
+    assert ds.tstamps_for_daterange(
+        datetime(2015, 1, 1, 3), datetime(2015, 1, 3)
+    ) == [datetime(2015, 1, 2), datetime(2015, 1, 3)]
+
+    for day, n in [(1, 8), (2, 7)]:
+        images = [
+            dataset.read(t)
+            for t in period_images(datetime(2015, 1, day), "daily")
+            if t != missing
+        ]
+        assert len(images) == n
+        mean = ds.read(datetime(2015, 1, day))
+        assert mean.timestamp == datetime(2015, 1, day)
+        assert sorted(mean.data) == sorted(parameters)
+        for param in parameters:
+            stack = np.stack([img.data[param] for img in images])
+            np.testing.assert_allclose(
+                mean.data[param], stack.mean(axis=0), rtol=1e-6
+            )
+
+    # no images in the period
+    with pytest.raises(IOError):
+        ds.read(datetime(2015, 1, 3))
+    ds.close()
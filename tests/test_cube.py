@@ -0,0 +1,73 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset, num2date
+
+from gldas.cube import GLDASCubeWriter, get_cube_last_timestamp
+from gldas.grid import GLDAS025LandGrid, subgrid4bbox
+
+
+def test_cube_writer(tmp_path):
+    grid = subgrid4bbox(GLDAS025LandGrid(), 10.0, 40.0, 15.0, 45.0)
+    gpis = grid.activegpis
+    filename = os.path.join(tmp_path, "cube.nc")
+    writer = GLDASCubeWriter(
+        filename,
+        grid,
+        chunks=(2, 10, 100),
+        attributes={"SWE_inst": {"units": "kg m-2"}},
+    )
+    lons, lats = grid.activearrlon, grid.activearrlat
+    row = np.round((lats - lats.min()) / 0.25).astype(int)
+    col = np.round((lons - lons.min()) / 0.25).astype(int)
+    shape = (row.max() + 1, col.max() + 1)
+    assert writer.shape == shape
+    assert writer.chunks == (2, 10, min(100, shape[1]))
+
+    timestamps = [datetime(2015, 1, 1, h) for h in (0, 3, 6)]
+    data = np.arange(3 * gpis.size, dtype=float).reshape(3, gpis.size)
+    data[1, 0] = 9999.0
+    writer.write({"SWE_inst": data[:2]}, timestamps[:2])
+    writer.write({"SWE_inst": data[2:]}, timestamps[2:])
+
+    with Dataset(filename) as ds:
+        times = num2date(
+            ds["time"][:],
+            ds["time"].units,
+            only_use_cftime_datetimes=False,
+        )
+        assert list(times) == timestamps
+        np.testing.assert_array_equal(ds["lat"][row], lats)
+        np.testing.assert_array_equal(ds["lon"][col], lons)
+        cube = ds["SWE_inst"][:]
+        assert ds["SWE_inst"].units == "kg m-2"
+        assert ds["SWE_inst"].chunking() == list(writer.chunks)
+
+    values = cube[:, row, col]
+    assert values.mask[1, 0]
+    np.testing.assert_array_equal(values[0], data[0])
+    np.testing.assert_array_equal(values[2], data[2])
+    # points outside the grid (water) are masked
+    assert cube.mask[0].sum() == shape[0] * shape[1] - gpis.size
+
+
+def test_cube_writer_append(tmp_path):
+    grid = subgrid4bbox(GLDAS025LandGrid(), 10.0, 40.0, 15.0, 45.0)
+    filename = os.path.join(tmp_path, "cube.nc")
+    data = np.ones((1, grid.activegpis.size))
+
+    writer = GLDASCubeWriter(filename, grid)
+    assert get_cube_last_timestamp(filename) is None
+    writer.write({"SWE_inst": data}, [datetime(2015, 1, 1, 0)])
+
+    writer = GLDASCubeWriter(filename, grid, append=True)
+    writer.write({"SWE_inst": data + 1}, [datetime(2015, 1, 1, 3)])
+    assert get_cube_last_timestamp(filename) == datetime(2015, 1, 1, 3)
+    with Dataset(filename) as ds:
+        assert ds["SWE_inst"].shape[0] == 2
+
+    other_grid = subgrid4bbox(GLDAS025LandGrid(), 10.0, 40.0, 20.0, 45.0)
+    with pytest.raises(ValueError):
+        GLDASCubeWriter(filename, other_grid, append=True)
@@ -6,13 +6,19 @@ import unittest
 from datetime import datetime
 import pytest
 import tempfile
+import threading
+import base64
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 
-from gldas.download import get_last_formatted_dir_in_dir
-from gldas.download import get_first_formatted_dir_in_dir
-from gldas.download import get_last_gldas_folder
-from gldas.download import get_first_gldas_folder
 from gldas.download import gldas_folder_get_version_first_last
 from gldas.download import main as main_download
+from gldas.download import GLDASDownloader, HTTPSession, DownloadError
+from gldas.download import read_sidecar, file_checksum, verify_file
+from gldas.download import plan_downloads
+from gldas.inventory import ArchiveInventory
+import gldas.download
 
 from gldas.interface import GLDAS_Noah_v21_025Ds
 
@@ -41,61 +47,352 @@ class TestDownload(unittest.TestCase):
         ds.close()
 
 
-def test_get_last_dir_in_dir():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "success")
-    last_dir = get_last_formatted_dir_in_dir(path, "{time:%Y}")
-    assert last_dir == "2014"
+def test_gldas_get_start_end():
+    path = os.path.join(
+        os.path.dirname(__file__), "test-data", "GLDAS_NOAH_image_data"
+    )
+    version, start, end = gldas_folder_get_version_first_last(path)
+    version_should = "GLDAS_Noah_v21_025"
+    start_should = datetime(2015, 1, 1)
+    end_should = datetime(2015, 1, 1)
+    assert version == version_should
+    assert end == end_should
+    assert start == start_should
 
 
-def test_get_last_dir_in_dir_failure():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "failure")
-    last_dir = get_last_formatted_dir_in_dir(path, "{time:%Y}")
-    assert last_dir == None
+class GESDISCStandIn(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the GES DISC data server: directory listings, files,
+    a login that requires basic authentication and sets a cookie, and
+    requests that fail once.
+    """
 
+    protocol_version = "HTTP/1.1"
 
-def test_get_first_dir_in_dir():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "success")
-    last_dir = get_first_formatted_dir_in_dir(path, "{time:%Y}")
-    assert last_dir == "2013"
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.n_connections += 1
 
+    def log_message(self, *args):
+        pass
 
-def test_get_last_gldas_folder():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "success")
-    last = get_last_gldas_folder(path, ["{time:%Y}", "{time:%j}"])
-    last_should = os.path.join(path, "2014", "134")
-    assert last == last_should
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        with server.lock:
+            server.requests.append(url.path)
 
-def test_get_last_gldas_folder_no_folder():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "failure")
-    last = get_last_gldas_folder(path, ["{time:%Y}", "{time:%j}"])
-    last_should = None
-    assert last == last_should
+        if url.path == "/login":
+            if self.headers.get("Authorization") != server.auth:
+                self._send(
+                    401, headers={"WWW-Authenticate": 'Basic realm="x"'}
+                )
+            else:
+                self._send(
+                    302,
+                    headers={
+                        "Location": parse_qs(url.query)["next"][0],
+                        "Set-Cookie": "session=ok; Path=/",
+                    },
+                )
+        elif "session=ok" not in self.headers.get("Cookie", ""):
+            self._send(302, headers={"Location": f"/login?next={url.path}"})
+        elif url.path in server.fail_once:
+            server.fail_once.remove(url.path)
+            self._send(503)
+        elif url.path.endswith("/") and url.path in server.dirs:
+            links = "".join(
+                f'<a href="{f}">{f}</a><a href="{f}">{f}</a>'
+                for f in server.dirs[url.path]
+            )
+            self._send(200, f"<html>{links}</html>".encode())
+        elif url.path in server.files:
+            self._send(200, server.files[url.path])
+        else:
+            self._send(404)
 
 
-def test_get_first_gldas_folder():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "success")
-    last = get_first_gldas_folder(path, ["{time:%Y}", "{time:%j}"])
-    last_should = os.path.join(path, "2013", "001")
-    assert last == last_should
+def sidecar(fname, content):
+    return (
+        "<S4PAGranuleMetaDataFile><DataGranule>"
+        f"<GranuleID>{fname}</GranuleID>"
+        f"<SizeBytesDataGranule>{len(content)}</SizeBytesDataGranule>"
+        "<CheckSum><CheckSumType>MD5</CheckSumType>"
+        f"<CheckSumValue>{hashlib.md5(content).hexdigest()}</CheckSumValue>"
+        "</CheckSum></DataGranule></S4PAGranuleMetaDataFile>"
+    ).encode()
 
 
-def test_get_first_gldas_folder_no_folder():
-    path = os.path.join(os.path.dirname(__file__), "folder_test", "failure")
-    last = get_first_gldas_folder(path, ["{time:%Y}", "{time:%j}"])
-    last_should = None
-    assert last == last_should
+@pytest.fixture
+def gesdisc_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GESDISCStandIn)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.n_connections = 0
+    server.requests = []
+    server.fail_once = set()
+    server.auth = "Basic " + base64.b64encode(b"user:pwd").decode()
+    server.dirs, server.files = {}, {}
+    for day in ["061", "062"]:
+        folder = f"/data/GLDAS/GLDAS_NOAH025_3H.2.1/2010/{day}/"
+        date = datetime.strptime(f"2010{day}", "%Y%j")
+        fnames = []
+        for h in range(0, 24, 3):
+            fname = f"GLDAS_NOAH025_3H.A{date:%Y%m%d}.{h:02d}00.021.nc4"
+            fnames += [fname, fname + ".xml"]
+            content = os.urandom(5000 + h)
+            server.files[folder + fname] = content
+            server.files[folder + fname + ".xml"] = sidecar(fname, content)
+        server.dirs[folder] = fnames + ["README.txt"]
 
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
 
-def test_gldas_get_start_end():
-    path = os.path.join(
-        os.path.dirname(__file__), "test-data", "GLDAS_NOAH_image_data"
+
+def test_http_session(gesdisc_server, tmp_path):
+    folder = "/data/GLDAS/GLDAS_NOAH025_3H.2.1/2010/061/"
+    fname = "GLDAS_NOAH025_3H.A20100302.0300.021.nc4"
+
+    session = HTTPSession()
+    with pytest.raises(DownloadError) as e:
+        session.get(gesdisc_server.url + folder + fname)
+    assert e.value.status == 401
+
+    session.close()
+    n_connections = gesdisc_server.n_connections
+
+    session = HTTPSession(username="user", password="pwd")
+    target = str(tmp_path / fname)
+    assert session.get(gesdisc_server.url + folder + fname, target) == target
+    with open(target, "rb") as f:
+        assert f.read() == gesdisc_server.files[folder + fname]
+    assert not os.path.exists(target + ".part")
+
+    # the login cookie is reused, on the same connection
+    n_requests = len(gesdisc_server.requests)
+    content = session.get(gesdisc_server.url + folder + fname + ".xml")
+    assert content == gesdisc_server.files[folder + fname + ".xml"]
+    assert len(gesdisc_server.requests) == n_requests + 1
+    assert gesdisc_server.n_connections == n_connections + 1
+
+    with pytest.raises(DownloadError) as e:
+        session.get(gesdisc_server.url + folder + "missing.nc4")
+    assert e.value.status == 404 and not e.value.retry
+    session.close()
+
+
+def test_downloader(gesdisc_server, tmp_path):
+    root = "/data/GLDAS/GLDAS_NOAH025_3H.2.1/2010/"
+    fname = "GLDAS_NOAH025_3H.A20100302.0600.021.nc4"
+    gesdisc_server.fail_once.update({root + "062/", root + "061/" + fname})
+    os.makedirs(tmp_path / "2010" / "061")
+    existing = "GLDAS_NOAH025_3H.A20100302.0000.021.nc4"
+    for f in [existing, existing + ".xml"]:
+        content = gesdisc_server.files[root + "061/" + f]
+        (tmp_path / "2010" / "061" / f).write_bytes(content)
+
+    downloader = GLDASDownloader(
+        n_workers=3, username="user", password="pwd", backoff=0
+    )
+    dirs = [
+        (gesdisc_server.url + root + day, str(tmp_path / "2010" / day))
+        for day in ["061", "062", "063"]
+    ]
+    failed = downloader.download_dirs(dirs)
+    downloader.close()
+
+    # day 063 does not exist on the server
+    assert len(failed) == 1
+    assert failed[0][0] == gesdisc_server.url + root + "063"
+    assert failed[0][1].status == 404
+
+    for day in ["061", "062"]:
+        files = sorted(os.listdir(tmp_path / "2010" / day))
+        assert files == sorted(gesdisc_server.dirs[root + day + "/"][:-1])
+    with open(tmp_path / "2010" / "061" / fname, "rb") as f:
+        assert f.read() == gesdisc_server.files[root + "061/" + fname]
+
+    # existing files are skipped, the failed requests were repeated
+    assert root + "061/" + existing not in gesdisc_server.requests
+    assert gesdisc_server.requests.count(root + "061/" + fname) >= 2
+    # connections are reused by the workers
+    assert gesdisc_server.n_connections <= 3
+
+
+def test_verify_file(tmp_path):
+    assert file_checksum(__file__, "MD5") == hashlib.md5(
+        open(__file__, "rb").read()
+    ).hexdigest()
+    # check value of the POSIX cksum CRC
+    (tmp_path / "check").write_bytes(b"123456789")
+    assert file_checksum(str(tmp_path / "check")) == "930766865"
+
+    fname = str(tmp_path / "GLDAS_NOAH025_3H.A20100302.0000.021.nc4")
+    content = os.urandom(1000)
+    with open(fname + ".xml", "wb") as f:
+        f.write(sidecar(os.path.basename(fname), content))
+    assert read_sidecar(fname + ".xml") == {
+        "size": 1000,
+        "checksum_type": "MD5",
+        "checksum": hashlib.md5(content).hexdigest(),
+    }
+
+    assert verify_file(fname) == "file is missing"
+    with open(fname, "wb") as f:
+        f.write(content[:500])
+    assert verify_file(fname) == "size is 500 bytes instead of 1000"
+    with open(fname, "wb") as f:
+        f.write(content[:-1] + bytes([content[-1] ^ 1]))
+    assert verify_file(fname) is None
+    assert verify_file(fname, checksum=True).startswith("checksum is")
+    with open(fname, "wb") as f:
+        f.write(content)
+    assert verify_file(fname, checksum=True) is None
+
+
+def test_downloader_verify(gesdisc_server, tmp_path):
+    root = "/data/GLDAS/GLDAS_NOAH025_3H.2.1/2010/"
+    day = tmp_path / "2010" / "061"
+    truncated = "GLDAS_NOAH025_3H.A20100302.0300.021.nc4"
+    corrupt = "GLDAS_NOAH025_3H.A20100302.0600.021.nc4"
+    dirs = [
+        (gesdisc_server.url + root + d, str(tmp_path / "2010" / d), 8)
+        for d in ["061", "062"]
+    ]
+
+    downloader = GLDASDownloader(username="user", password="pwd", backoff=0)
+    assert downloader.download_dirs(dirs) == []
+
+    # complete days are skipped without any request
+    n_requests = len(gesdisc_server.requests)
+    assert downloader.download_dirs(dirs, verify="checksum") == []
+    assert len(gesdisc_server.requests) == n_requests
+
+    with open(day / truncated, "r+b") as f:
+        f.truncate(100)
+    content = bytearray((day / corrupt).read_bytes())
+    content[0] ^= 1
+    (day / corrupt).write_bytes(bytes(content))
+
+    # only the files that fail the verification are downloaded again
+    assert downloader.download_dirs(dirs, verify="checksum") == []
+    requests = gesdisc_server.requests[n_requests:]
+    assert sorted(r for r in requests if r.endswith(".nc4")) == sorted(
+        [root + "061/" + truncated, root + "061/" + corrupt]
+    )
+    assert root + "062/" not in requests
+    for fname in [truncated, corrupt]:
+        assert (day / fname).read_bytes() == gesdisc_server.files[
+            root + "061/" + fname
+        ]
+
+    # files that are still incomplete after all retries are reported
+    corrupt = corrupt.replace("0302", "0303")
+    gesdisc_server.files[root + "062/" + corrupt] = b"x"
+    os.remove(tmp_path / "2010" / "062" / corrupt)
+    failed = downloader.download_dirs(dirs)
+    downloader.close()
+    assert len(failed) == 1
+    assert failed[0][0].endswith(corrupt)
+    assert "verification failed" in str(failed[0][1])
+    assert not os.path.exists(tmp_path / "2010" / "062" / corrupt)
+
+
+def test_plan_downloads(gesdisc_server, tmp_path):
+    root = "/data/GLDAS/GLDAS_NOAH025_3H.2.1/2010/"
+    subdirs = ["data", "GLDAS", "GLDAS_NOAH025_3H.2.1", "%Y", "%j"]
+    fname_templ = "GLDAS_NOAH025_3H.A%Y%m%d.%H%M.021.nc4"
+    # day 061 is complete, day 062 is missing three images
+    for day, hours in [("061", range(0, 24, 3)), ("062", range(0, 15, 3))]:
+        os.makedirs(tmp_path / "2010" / day)
+        date = datetime.strptime(f"2010{day}", "%Y%j")
+        for h in hours:
+            fname = f"GLDAS_NOAH025_3H.A{date:%Y%m%d}.{h:02d}00.021.nc4"
+            for f in [fname, fname + ".xml"]:
+                content = gesdisc_server.files[root + day + "/" + f]
+                (tmp_path / "2010" / day / f).write_bytes(content)
+
+    inventory = ArchiveInventory(str(tmp_path))
+    dirs, files = plan_downloads(
+        inventory,
+        datetime(2010, 3, 2),
+        datetime(2010, 3, 4),
+        datetime(2000, 1, 1, 3),
+        gesdisc_server.url,
+        subdirs,
+        fname_templ,
+    )
+    url = gesdisc_server.url + root
+    assert dirs == [
+        (url + "061", str(tmp_path / "2010" / "061"), 8),
+        (url + "063", str(tmp_path / "2010" / "063"), 8),
+    ]
+    fname = "GLDAS_NOAH025_3H.A20100303.1500.021.nc4"
+    assert len(files) == 8
+    assert files[5] == (
+        url + "062/" + fname, str(tmp_path / "2010" / "062" / fname)
     )
-    version, start, end = gldas_folder_get_version_first_last(path)
-    version_should = "GLDAS_Noah_v21_025"
-    start_should = datetime(2015, 1, 1)
-    end_should = datetime(2015, 1, 1)
-    assert version == version_should
-    assert end == end_should
-    assert start == start_should
 
+    downloader = GLDASDownloader(username="user", password="pwd", backoff=0)
+    failed = downloader.download_dirs(dirs[:1]) + downloader.download_files(
+        files
+    )
+    downloader.close()
+    assert failed == []
+    # only the missing images are requested
+    requests = {r for r in gesdisc_server.requests if r.startswith(root)}
+    assert requests == {
+        root + "062/" + f"GLDAS_NOAH025_3H.A20100303.{h:02d}00.021.nc4" + ext
+        for h in (15, 18, 21)
+        for ext in ["", ".xml"]
+    }
+    assert len(os.listdir(tmp_path / "2010" / "062")) == 16
+
+    # the first day of the product starts at 03:00
+    dirs, files = plan_downloads(
+        inventory,
+        datetime(2010, 3, 1),
+        datetime(2010, 3, 1),
+        datetime(2010, 3, 1, 3),
+        gesdisc_server.url,
+        subdirs,
+        fname_templ,
+    )
+    assert dirs == [
+        (gesdisc_server.url + root + "060", str(tmp_path / "2010" / "060"), 7)
+    ]
+    assert files == []
+
+
+def test_plan_downloads_utcnow(tmp_path, monkeypatch):
+    # images that are not yet produced (in UTC) are not planned
+    monkeypatch.setattr(
+        gldas.download, "utcnow", lambda: datetime(2010, 3, 2, 10)
+    )
+    dirs, files = plan_downloads(
+        ArchiveInventory(str(tmp_path)),
+        datetime(2010, 3, 2),
+        datetime(2010, 3, 3),
+        datetime(2000, 1, 1, 3),
+        "http://localhost",
+        ["data", "%Y", "%j"],
+        "GLDAS_NOAH025_3H.A%Y%m%d.%H%M.021.nc4",
+    )
+    assert dirs == [
+        ("http://localhost/data/2010/061", str(tmp_path / "2010" / "061"), 4)
+    ]
+    assert files == []
+    assert gldas.download.utcnow().tzinfo is None
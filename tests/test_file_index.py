@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import pickle
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from gldas.file_index import FileIndex, templ2regex
+
+
+def create_files(root, day, hours=(0, 3, 6, 9, 12, 15, 18, 21)):
+    folder = os.path.join(root, day.strftime("%Y"), day.strftime("%j"))
+    os.makedirs(folder, exist_ok=True)
+    for h in hours:
+        fname = f"GLDAS_NOAH025_3H.A{day:%Y%m%d}.{h:02d}00.021.nc4"
+        for ext in ["", ".xml"]:
+            with open(os.path.join(folder, fname + ext), "w"):
+                pass
+    return folder
+
+
+def test_templ2regex():
+    regex = templ2regex("GLDAS_NOAH025_3H*.A{datetime}.*.nc4", "%Y%m%d.%H%M")
+    match = regex.match("GLDAS_NOAH025_3H_EP.A20150101.0300.021.nc4")
+    assert match.group("datetime") == "20150101.0300"
+    assert regex.match("GLDAS_NOAH025_3H.A20150101.0300.021.nc4.xml") is None
+
+    regex = templ2regex("GLDAS_NOAH025SUBP_3H.A{datetime}.001.*.grb", "%Y%j.%H%M")
+    match = regex.match("GLDAS_NOAH025SUBP_3H.A2015001.0000.001.2015037193230.grb")
+    assert match.group("datetime") == "2015001.0000"
+
+
+def test_file_index(tmp_path):
+    root = str(tmp_path / "data")
+    index_file = str(tmp_path / "index.json")
+    create_files(root, datetime(2015, 1, 1))
+    create_files(root, datetime(2015, 1, 2), hours=(0, 3))
+
+    index = FileIndex(
+        root,
+        "GLDAS_NOAH025_3H*.A{datetime}.*.nc4",
+        "%Y%m%d.%H%M",
+        index_file=index_file,
+    )
+    assert len(index.timestamps) == 10
+    assert index.timestamps[-1] == datetime(2015, 1, 2, 3)
+    assert index.get(datetime(2015, 1, 1, 3)) == [
+        os.path.join(
+            root, "2015", "001", "GLDAS_NOAH025_3H.A20150101.0300.021.nc4"
+        )
+    ]
+    assert index.get(datetime(2015, 1, 2, 6)) == []
+    assert os.path.isfile(index_file)
+
+    # nothing changed
+    assert index.refresh() == 0
+
+    # download of a new day is detected
+    create_files(root, datetime(2015, 1, 3), hours=(0,))
+    assert index.refresh() == 1
+    assert index.timestamps[-1] == datetime(2015, 1, 3)
+
+    # index is reused from the sidecar file
+    index2 = FileIndex(
+        root,
+        "GLDAS_NOAH025_3H*.A{datetime}.*.nc4",
+        "%Y%m%d.%H%M",
+        index_file=index_file,
+    )
+    assert index2.dirs == index.dirs
+    assert index2.lookup == index.lookup
+
+    # a loaded index is only updated when a time stamp is not found
+    create_files(root, datetime(2015, 1, 4), hours=(0,))
+    index3 = FileIndex(
+        root,
+        "GLDAS_NOAH025_3H*.A{datetime}.*.nc4",
+        "%Y%m%d.%H%M",
+        index_file=index_file,
+    )
+    assert index3.stale
+    assert index3.timestamps[-1] == datetime(2015, 1, 3)
+    assert len(index3.get(datetime(2015, 1, 1))) == 1
+    assert index3.stale
+    assert len(index3.get(datetime(2015, 1, 4))) == 1
+    assert not index3.stale
+    assert index3.timestamps[-1] == datetime(2015, 1, 4)
+
+
+def test_file_index_threads(tmp_path, monkeypatch):
+    root = str(tmp_path / "data")
+    index_file = str(tmp_path / "index.json")
+    args = (root, "GLDAS_NOAH025_3H*.A{datetime}.*.nc4", "%Y%m%d.%H%M")
+    create_files(root, datetime(2015, 1, 1))
+    FileIndex(*args, index_file=index_file)
+    create_files(root, datetime(2015, 1, 2))
+    index = FileIndex(*args, index_file=index_file)
+    assert index.stale
+
+    refresh = FileIndex.refresh
+    n_refresh = []
+
+    def slow_refresh(self):
+        n_refresh.append(1)
+        time.sleep(0.1)
+        return refresh(self)
+
+    # all threads miss the new day at once, the index is updated once
+    monkeypatch.setattr(FileIndex, "refresh", slow_refresh)
+    timestamps = [datetime(2015, 1, 2, h) for h in range(0, 24, 3)]
+    with ThreadPoolExecutor(8) as executor:
+        found = list(executor.map(index.get, timestamps))
+    assert len(n_refresh) == 1
+    assert all(len(f) == 1 for f in found)
+    with open(index_file) as f:
+        assert len(json.load(f)["dirs"]) == 2
+
+    copy = pickle.loads(pickle.dumps(index))
+    assert copy.lookup == index.lookup
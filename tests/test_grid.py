@@ -1,4 +1,9 @@
+import os
+import numpy as np
+import pytest
 from gldas.grid import GLDAS025Cellgrid, GLDAS025LandGrid, subgrid4bbox
+from gldas.grid import image_index, GLDAS025Grids
+import gldas.grid
 
 
 def test_GLDAS025_cell_grid():
@@ -23,3 +28,86 @@ def test_bbox_subgrid():
     bbox = (130.125, -29.875, 134.875, -25.125)  # bbox for cell 2244
     subgrid = subgrid4bbox(GLDAS025Cellgrid(), *bbox)
     assert subgrid == GLDAS025Cellgrid().subgrid_from_cells([2244])
+
+
+def test_image_index():
+    grid = GLDAS025Cellgrid()
+    file_data = np.arange(600 * 1440, dtype=np.float32).reshape(600, 1440)
+    glob_data = np.concatenate((np.full(1440 * 120, 9999.0), file_data.ravel()))
+
+    index = image_index(grid)
+    assert image_index(grid) is index  # cached on grid
+    assert index.window_shape == (600, 1440)
+    np.testing.assert_array_equal(index.gather(file_data), glob_data)
+
+    bbox = (130.125, -69.875, 134.875, -55.125)  # partly below 60 DEG S
+    subgrid = subgrid4bbox(grid, *bbox)
+    index = image_index(subgrid)
+    assert index.window_shape == (20, 20)
+    window = file_data[index.rows, index.cols]
+    should = glob_data[subgrid.activegpis]
+    np.testing.assert_array_equal(index.gather(window), should)
+    np.testing.assert_array_equal(index.gather(file_data, window=False), should)
+    out = np.empty(subgrid.activegpis.size)
+    assert index.gather(window, out=out) is out
+
+    stack = index.gather_stack(np.stack((window, window + 1)))
+    assert stack.shape == (2, subgrid.activegpis.size)
+    np.testing.assert_array_equal(stack[0], should)
+    np.testing.assert_array_equal(
+        stack[1], np.where(should == 9999.0, 9999.0, should + 1)
+    )
+
+
+def test_image_index_flip():
+    grid = GLDAS025Cellgrid()
+    index = image_index(grid)
+    file_data = np.arange(600 * 1440, dtype=np.float32).reshape(600, 1440)
+    glob_data = np.concatenate((np.full(1440 * 120, 9999.0), file_data.ravel()))
+    should = np.flipud(glob_data.reshape(720, 1440))
+
+    flipped = index.gather(file_data, flip=True).reshape(720, 1440)
+    np.testing.assert_array_equal(flipped, should)
+    stack = index.gather_stack(np.stack((file_data, file_data)), flip=True)
+    np.testing.assert_array_equal(stack[1].reshape(720, 1440), should)
+
+    lons, lats = index.lonlat_2d
+    assert index.lonlat_2d[0] is lons  # computed once
+    assert not lons.flags.writeable and not lats.flags.writeable
+    np.testing.assert_array_equal(
+        lons, np.flipud(grid.activearrlon.reshape(720, 1440))
+    )
+    np.testing.assert_array_equal(
+        lats, np.flipud(grid.activearrlat.reshape(720, 1440))
+    )
+    assert lats[0, 0] == 89.875
+
+
+def test_grid_cache(tmp_path):
+    # grids are only created once per process
+    assert GLDAS025Cellgrid() is GLDAS025Cellgrid()
+    assert GLDAS025LandGrid() is GLDAS025Grids(only_land=True)
+
+    cache_dir = str(tmp_path / "grid_cache")
+    land_grid = GLDAS025LandGrid(cache_dir=cache_dir)
+    assert land_grid == GLDAS025LandGrid()
+    assert os.path.isfile(os.path.join(cache_dir, "gldas025_grid.npz"))
+
+    # load from the cache file in a "new" process
+    gldas.grid._load_grid_arrays.cache_clear()
+    gldas.grid._cached_grid.cache_clear()
+    assert GLDAS025LandGrid(cache_dir=cache_dir) == land_grid
+    assert GLDAS025Cellgrid(cache_dir=cache_dir) == GLDAS025Cellgrid()
+
+
+def test_grid_cache_read_only():
+    # the cached grid is shared, its arrays can not be changed
+    grid = GLDAS025LandGrid()
+    for name in ["activegpis", "activearrlon", "activearrlat", "arrcell"]:
+        arr = getattr(grid, name)
+        assert not arr.flags.writeable
+        with pytest.raises(ValueError):
+            arr[0] = 0
+    subgrid = grid.subgrid_from_gpis(grid.activegpis[:10])
+    np.testing.assert_array_equal(subgrid.activegpis, grid.activegpis[:10])
+    assert grid.find_nearest_gpi(10.0, 45.0)[0] in grid.activegpis
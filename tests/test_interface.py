@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
+import pickle
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 import pytest
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
 
 from gldas.interface import GLDAS_Noah_v1_025Ds, GLDAS_Noah_v1_025Img
 from gldas.interface import GLDAS_Noah_v21_025Ds, GLDAS_Noah_v21_025Img
-from gldas.grid import GLDAS025LandGrid
-from gldas.interface import pygrib_available
+from gldas.grid import GLDAS025Cellgrid, GLDAS025LandGrid, subgrid4bbox
+import gldas.interface
+from gldas.interface import pygrib_available, GLDASTs
+from gldas.grid import load_grid
+from gldas.reshuffle import reshuffle
+from gldas.synthetic import create_archive
 
 @pytest.mark.pygrib
 @pytest.mark.skipif(not pygrib_available, reason="Pygrib not installed.")
@@ -135,7 +147,7 @@ def test_GLDAS_Noah_v1_025Ds_timestamps_for_daterange():
     )
 
     tstamps = img.tstamps_for_daterange(
-        datetime(2000, 1, 1), datetime(2000, 1, 1)
+        datetime(2000, 1, 1), datetime(2000, 1, 1, 21)
     )
     assert len(tstamps) == 8
     assert tstamps == [
@@ -170,7 +182,7 @@ def test_GLDAS_Noah_v21_025Ds_timestamps_for_daterange():
     )
 
     tstamps = img.tstamps_for_daterange(
-        datetime(2000, 1, 1), datetime(2000, 1, 1)
+        datetime(2000, 1, 1), datetime(2000, 1, 1, 21)
     )
     assert len(tstamps) == 8
     assert tstamps == [
@@ -183,6 +195,21 @@ def test_GLDAS_Noah_v21_025Ds_timestamps_for_daterange():
         datetime(2000, 1, 1, 18),
         datetime(2000, 1, 1, 21),
     ]
+
+    # timestamps are clipped to the exact start and end
+    tstamps = img.tstamps_for_daterange(
+        datetime(2000, 1, 1, 1), datetime(2000, 1, 2, 3), as_datetime64=True
+    )
+    assert tstamps.dtype == np.dtype("datetime64[s]")
+    np.testing.assert_array_equal(
+        tstamps,
+        np.arange(
+            "2000-01-01T03", "2000-01-02T06", 3, dtype="datetime64[h]"
+        ).astype("datetime64[s]"),
+    )
+    assert img.tstamps_for_daterange(
+        datetime(2000, 1, 1, 1), datetime(2000, 1, 1, 2)
+    ) == []
     img.close()
 
 @pytest.mark.pygrib
@@ -327,3 +354,398 @@ def test_GLDAS_Noah_v21_025Img_img_reading_2D():
     assert image.lon.shape == image.lat.shape
     img.close()
 
+
+
+def test_GLDAS_Noah_v21_025Img_img_reading_bbox():
+    landgrid = GLDAS025LandGrid()
+    bboxgrid = subgrid4bbox(landgrid, -60.125, -10.125, -50.125, 10.125)
+    parameter = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    filename = os.path.join(
+        os.path.dirname(__file__),
+        "test-data",
+        "GLDAS_NOAH_image_data",
+        "2015",
+        "001",
+        "GLDAS_NOAH025_3H.A20150101.0000.021.nc4",
+    )
+    img = GLDAS_Noah_v21_025Img(
+        filename, parameter=parameter, subgrid=bboxgrid, array_1D=True
+    )
+    image = img.read()
+
+    # only the bbox window is read from the file
+    assert img.index.window_shape[0] < 600
+    assert img.index.window_shape[1] < 1440
+    assert image.data["SoilMoi0_10cm_inst"].size == bboxgrid.activegpis.size
+    # gpi 527549 (lat: 1.625, lon: -52.625) is in the bbox
+    i = np.where(bboxgrid.activegpis == 527549)[0][0]
+    assert round(image.data["SoilMoi0_10cm_inst"][i], 3) == 26.181
+    assert round(image.data["SWE_inst"][i], 3) == 0
+
+    land_image = GLDAS_Noah_v21_025Img(
+        filename, parameter=parameter, subgrid=landgrid, array_1D=True
+    ).read()
+    idx = np.searchsorted(landgrid.activegpis, bboxgrid.activegpis)
+    for p in parameter:
+        np.testing.assert_array_equal(image.data[p], land_image.data[p][idx])
+    # all parameters are views on one stacked array
+    assert image.data["SWE_inst"].base is image.data["SoilMoi0_10cm_inst"].base
+    img.close()
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_GLDAS_Noah_v21_025Ds_prefetch(executor):
+    parameter = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    kwargs = dict(
+        data_path=os.path.join(
+            os.path.dirname(__file__), "test-data", "GLDAS_NOAH_image_data"
+        ),
+        parameter=parameter,
+        subgrid=GLDAS025LandGrid(),
+        array_1D=True,
+    )
+    ds = GLDAS_Noah_v21_025Ds(**kwargs)
+    prefetch_ds = GLDAS_Noah_v21_025Ds(
+        prefetch=3, prefetch_executor=executor, **kwargs
+    )
+
+    image = ds.read(datetime(2015, 1, 1, 0))
+    # the following (missing) images are read in the background
+    prefetch_image = prefetch_ds.read(datetime(2015, 1, 1, 0))
+    assert prefetch_image.timestamp == datetime(2015, 1, 1, 0)
+    for p in parameter:
+        np.testing.assert_array_equal(
+            image.data[p], prefetch_image.data[p]
+        )
+    with pytest.raises(IOError):
+        prefetch_ds.read(datetime(2015, 1, 1, 3))
+
+    ds.close()
+    prefetch_ds.close()
+
+
+def test_GLDAS_Noah_v21_025Ds_prefetch_range(tmp_path):
+    img_path = str(tmp_path / "img")
+    filenames = create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 1, 21),
+        parameters=["SWE_inst"],
+        complevel=1,
+    )
+    # image at 06:00 is missing
+    os.remove([f for f in filenames if ".A20150101.0600." in f][0])
+
+    ds = GLDAS_Noah_v21_025Ds(
+        img_path, parameter="SWE_inst", array_1D=True, prefetch=4
+    )
+    submitted = []
+    submit = ds._submit
+
+    def record_submit(timestamp):
+        submitted.append(timestamp)
+        return submit(timestamp)
+
+    ds._submit = record_submit
+    # the missing image is not read ahead
+    ds.read(datetime(2015, 1, 1))
+    assert submitted == [datetime(2015, 1, 1, h) for h in (0, 3, 9, 12)]
+
+    # images after the end of the range are not read ahead
+    submitted.clear()
+    timestamps = ds.tstamps_for_daterange(
+        datetime(2015, 1, 1, 9), datetime(2015, 1, 1, 15)
+    )
+    for timestamp in timestamps:
+        ds.read(timestamp)
+    ds.close()
+    assert submitted == [datetime(2015, 1, 1, 15)]
+
+
+def test_GLDAS_Noah_v21_025Ds_file_index(tmp_path):
+    data_path = os.path.join(
+        os.path.dirname(__file__), "test-data", "GLDAS_NOAH_image_data"
+    )
+    index_file = str(tmp_path / "index.json")
+    ds = GLDAS_Noah_v21_025Ds(
+        data_path,
+        subgrid=GLDAS025LandGrid(),
+        array_1D=True,
+        index_file=index_file,
+    )
+    assert os.path.isfile(index_file)
+    assert ds.file_index.get(datetime(2015, 1, 1, 0)) == [
+        os.path.join(
+            data_path,
+            "2015",
+            "001",
+            "GLDAS_NOAH025_3H.A20150101.0000.021.nc4",
+        )
+    ]
+    image = ds.read(datetime(2015, 1, 1, 0))
+    assert image.timestamp == datetime(2015, 1, 1, 0)
+    with pytest.raises(IOError):
+        ds.read(datetime(2015, 1, 1, 3))
+    ds.refresh_file_index()
+    ds.close()
+
+
+def test_GLDAS_Noah_v21_025Ds_shared_grid(tmp_path):
+    ds = GLDAS_Noah_v21_025Ds(str(tmp_path))
+    assert ds.grid is GLDAS025Cellgrid()
+
+    subgrid = subgrid4bbox(GLDAS025LandGrid(), 10, 40, 15, 45)
+    ds = GLDAS_Noah_v21_025Ds(str(tmp_path), subgrid=subgrid)
+    assert ds.grid is subgrid
+    img1 = ds.ioclass("file1.nc4", mode="r", **ds.ioclass_kws)
+    img2 = ds.ioclass("file2.nc4", mode="r", **ds.ioclass_kws)
+    assert img1.grid is img2.grid is subgrid
+    assert img1.index is img2.index
+
+
+@pytest.fixture(scope="module")
+def ts_path(tmp_path_factory):
+    """Time series of 2 days of synthetic images, in 6 cells"""
+    img_path = str(tmp_path_factory.mktemp("img"))
+    ts_path = str(tmp_path_factory.mktemp("ts"))
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    start, end = datetime(2015, 1, 1), datetime(2015, 1, 2, 21)
+    create_archive(img_path, start, end, parameters=parameters, complevel=1)
+    grid = load_grid(land_points=True, bbox=(5, 40, 20, 50))
+    reshuffle(img_path, ts_path, start, end, parameters, input_grid=grid)
+    return ts_path
+
+
+@pytest.mark.parametrize("slab_factor", [1, np.inf])
+def test_GLDASTs_read_multi(ts_path, monkeypatch, slab_factor):
+    # read row by row or as one hyperslab per cell
+    monkeypatch.setattr(GLDASTs, "slab_factor", slab_factor)
+    ds = GLDASTs(ts_path)
+    gpis = ds.grid.activegpis[::50]
+    # a duplicate location and a location that is not in the grid
+    gpis = np.concatenate([gpis, gpis[:1], [12]])
+    data = ds.read_multi(gpis)
+    assert sorted(data) == ["SWE_inst", "SoilMoi0_10cm_inst"]
+
+    swe = data["SWE_inst"]
+    assert swe.shape == (16, gpis.size)
+    assert swe.index[0] == datetime(2015, 1, 1)
+    for i, gpi in enumerate(gpis[:-1]):
+        np.testing.assert_allclose(
+            swe.iloc[:, i].values, ds.read(int(gpi))["SWE_inst"].values
+        )
+    assert swe.iloc[:, -1].isna().all()
+
+    data = ds.read_multi(
+        [10.0, 100.0], [45.0, 45.0], parameters=["SWE_inst"], max_dist=20000
+    )
+    assert list(data) == ["SWE_inst"]
+    np.testing.assert_allclose(
+        data["SWE_inst"].iloc[:, 0].values,
+        ds.read(10.0, 45.0)["SWE_inst"].values,
+    )
+    assert data["SWE_inst"].iloc[:, 1].isna().all()
+    ds.close()
+
+
+def test_GLDASTs_read_multi_missing(ts_path, tmp_path):
+    # a location of the grid that is missing in its cell file
+    shutil.copytree(ts_path, tmp_path / "ts")
+    ds = GLDASTs(str(tmp_path / "ts"))
+    cell = ds.grid.activearrcell[0]
+    filename = ds._cell_filename(cell)
+    with Dataset(filename, "a") as nc:
+        missing, other = nc["location_id"][:2]
+        nc["location_id"][0] = -1
+
+    with pytest.warns(RuntimeWarning, match=str(missing)):
+        data = ds.read_multi([missing, other])
+    swe = data["SWE_inst"]
+    assert swe.iloc[:, 0].isna().all()
+    np.testing.assert_allclose(
+        swe.iloc[:, 1].values, ds.read(int(other))["SWE_inst"].values
+    )
+    ds.close()
+
+
+def test_GLDASTs_cache(ts_path, monkeypatch):
+    decoded = []
+    num2date = gldas.interface.num2date
+
+    def counting_num2date(*args, **kwargs):
+        decoded.append(1)
+        return num2date(*args, **kwargs)
+
+    monkeypatch.setattr(gldas.interface, "num2date", counting_num2date)
+
+    ds = GLDASTs(ts_path, cache_size=2)
+    cells = np.unique(ds.grid.activearrcell)
+    gpis = [ds.grid.grid_points_for_cell(c)[0][:2] for c in cells[:3]]
+
+    for gpi in gpis[0]:
+        ts = ds.read(int(gpi))
+    assert ts.index[-1] == datetime(2015, 1, 2, 21)
+    ds.read(int(gpis[1][0]))
+    assert list(ds._fids) == list(cells[:2])
+    fid = ds._fids[cells[0]]
+
+    # recently used cells are neither opened nor decoded again
+    for gpi in np.concatenate(gpis[:2]):
+        ds.read(int(gpi))
+    assert ds._fids[cells[0]] is fid
+    assert len(decoded) == 2
+
+    # the least recently used cell is closed
+    ds.read(int(gpis[2][0]))
+    assert list(ds._fids) == list(cells[1:3])
+    assert fid.dataset is None
+    assert len(decoded) == 3
+
+    ds.read_multi(np.concatenate(gpis[1:]))
+    assert len(decoded) == 3
+
+    ds.close()
+    assert len(ds._fids) == 0
+
+
+def test_GLDASTs_cell_info(ts_path, tmp_path, monkeypatch):
+    calendars = []
+    num2date = gldas.interface.num2date
+
+    def recording_num2date(*args, **kwargs):
+        calendars.append(kwargs["calendar"])
+        return num2date(*args, **kwargs)
+
+    monkeypatch.setattr(gldas.interface, "num2date", recording_num2date)
+
+    # the calendar of the time variable is used
+    shutil.copytree(ts_path, tmp_path / "ts")
+    ds = GLDASTs(str(tmp_path / "ts"), ioclass_kws={"read_dates": True})
+    gpi = int(ds.grid.activegpis[0])
+    with Dataset(ds._cell_filename(ds.grid.gpi2cell(gpi)), "a") as nc:
+        nc["time"].calendar = "proleptic_gregorian"
+    ts = ds.read(gpi)
+    assert calendars == ["proleptic_gregorian"]
+    # with read_dates, the time stamps are decoded for each read
+    pd.testing.assert_frame_equal(ds.read(gpi), ts)
+    assert len(calendars) == 2
+    ds.close()
+
+    # the current file of the base class is reset if it is closed
+    ds = GLDASTs(ts_path, cache_size=1)
+    cells = np.unique(ds.grid.activearrcell)
+    assert ds._open(ds.grid.grid_points_for_cell(cells[0])[0][0])
+    ds.read(int(ds.grid.grid_points_for_cell(cells[1])[0][0]))
+    assert ds.fid is None and ds.previous_cell is None
+    ds.close()
+
+
+@pytest.mark.parametrize("read_bulk", [False, True])
+def test_GLDASTs_read_period(ts_path, read_bulk):
+    ds = GLDASTs(ts_path, ioclass_kws={"read_bulk": read_bulk})
+    gpi = int(ds.grid.activegpis[10])
+    full = ds.read(gpi)
+
+    period = [datetime(2015, 1, 1, 5), datetime(2015, 1, 2)]
+    ts = ds.read(gpi, period=period)
+    assert ts.index[0] == datetime(2015, 1, 1, 6)
+    assert ts.index[-1] == datetime(2015, 1, 2)
+    np.testing.assert_array_equal(ts.values, full.loc[period[0] : period[1]])
+
+    assert ds.read(gpi, period=["2015-01-02T18:00", None]).shape == (2, 2)
+    assert ds.read(gpi, period=[None, datetime(2015, 1, 1)]).shape == (1, 2)
+    assert ds.read(gpi, period=[datetime(2016, 1, 1), None]).empty
+    raw = ds.read(gpi, period=period, dates_direct=True)
+    np.testing.assert_array_equal(raw.values, ts.values)
+
+    data = ds.read_multi([gpi, gpi + 1], period=period)
+    assert data["SWE_inst"].shape == (7, 2)
+    np.testing.assert_array_equal(
+        data["SWE_inst"][gpi].values, ts["SWE_inst"].values
+    )
+    ds.close()
+
+
+def _read_values(reader, gpi):
+    return reader.read(int(gpi)).values
+
+
+# reader that is inherited by forked processes
+_forked_reader = None
+
+
+def _read_forked(gpi):
+    assert len(_forked_reader._fids) == 0
+    return _read_values(_forked_reader, gpi)
+
+
+def test_GLDASTs_shared(ts_path):
+    ds = GLDASTs(ts_path, cache_size=2)
+    gpis = ds.grid.activegpis[::20]
+    expected = [ds.read(int(gpi)).values for gpi in gpis]
+
+    # one instance used by several threads, with cells opened and closed
+    with ThreadPoolExecutor(8) as executor:
+        values = list(executor.map(_read_values, [ds] * gpis.size, gpis))
+    for v, e in zip(values, expected):
+        np.testing.assert_array_equal(v, e)
+
+    # the open files are not pickled, the copy opens them again
+    copy = pickle.loads(pickle.dumps(ds))
+    assert len(copy._fids) == 0 and len(ds._fids) == 2
+    np.testing.assert_array_equal(_read_values(copy, gpis[0]), expected[0])
+    copy.close()
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        global _forked_reader
+        _forked_reader = ds
+        context = multiprocessing.get_context("fork")
+        # the lock is held by the parent while forking, the child gets a
+        # new one
+        with gldas.interface.netcdf_lock:
+            executor = ProcessPoolExecutor(1, mp_context=context)
+            future = executor.submit(_read_forked, gpis[0])
+            values = [future.result(timeout=60)]
+        executor.shutdown()
+        for v, e in zip(values, expected):
+            np.testing.assert_array_equal(v, e)
+        assert len(ds._fids) == 2
+        np.testing.assert_array_equal(_read_values(ds, gpis[0]), expected[0])
+    ds.close()
+
+
+def test_GLDASTs_pickle_lonlat(ts_path):
+    ds = GLDASTs(ts_path)
+    expected = ds.read(10.0, 45.0)
+    assert ds.grid.kdTree is not None
+    # the kd-tree of the grid is not pickled, the copy builds it again
+    copy = pickle.loads(pickle.dumps(ds))
+    assert copy.grid.kdTree is None and ds.grid.kdTree is not None
+    pd.testing.assert_frame_equal(copy.read(10.0, 45.0), expected)
+    copy.close()
+    ds.close()
+
+
+def test_GLDASTs_threads_overlap(ts_path, monkeypatch):
+    # both threads must be decoding time stamps at the same time to pass
+    # the barrier, which is impossible if the reads are serialized
+    barrier = threading.Barrier(2, timeout=30)
+    num2date = gldas.interface.num2date
+
+    def waiting_num2date(*args, **kwargs):
+        barrier.wait()
+        return num2date(*args, **kwargs)
+
+    monkeypatch.setattr(gldas.interface, "num2date", waiting_num2date)
+    ds = GLDASTs(ts_path)
+    cells = np.unique(ds.grid.activearrcell)[:2]
+    gpis = [ds.grid.grid_points_for_cell(cell)[0][0] for cell in cells]
+    with ThreadPoolExecutor(2) as executor:
+        values = list(executor.map(_read_values, [ds] * 2, gpis))
+    monkeypatch.setattr(gldas.interface, "num2date", num2date)
+    for v, gpi in zip(values, gpis):
+        np.testing.assert_array_equal(v, _read_values(ds, gpi))
+    # each thread has its own open files
+    assert len(ds._pools) == 3
+    ds.close()
+    assert all(len(pool) == 0 for pool in ds._pools.values())
@@ -0,0 +1,127 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from gldas.inventory import ArchiveInventory, parse_filename, main
+
+
+def create_files(root, day, hours=(0, 3, 6, 9, 12, 15, 18, 21), ep=""):
+    folder = os.path.join(root, day.strftime("%Y"), day.strftime("%j"))
+    os.makedirs(folder, exist_ok=True)
+    for h in hours:
+        fname = f"GLDAS_NOAH025_3H{ep}.A{day:%Y%m%d}.{h:02d}00.021.nc4"
+        for ext in ["", ".xml"]:
+            with open(os.path.join(folder, fname + ext), "w"):
+                pass
+    return folder
+
+
+def test_parse_filename():
+    assert parse_filename("GLDAS_NOAH025_3H.A20150101.0300.021.nc4") == (
+        "GLDAS_Noah_v21_025",
+        datetime(2015, 1, 1, 3),
+    )
+    assert parse_filename("GLDAS_NOAH025_3H_EP.A20150101.0300.021.nc4") == (
+        "GLDAS_Noah_v21_025_EP",
+        datetime(2015, 1, 1, 3),
+    )
+    assert parse_filename("GLDAS_NOAH025_3H.A19480101.0300.020.nc4")[0] == (
+        "GLDAS_Noah_v20_025"
+    )
+    assert parse_filename(
+        "GLDAS_NOAH025SUBP_3H.A2015032.0600.001.2015037193230.grb"
+    ) == ("GLDAS_Noah_v1_025", datetime(2015, 2, 1, 6))
+    assert parse_filename("GLDAS_NOAH025_3H.A20150101.0300.021.nc4.xml") == (
+        None,
+        None,
+    )
+
+
+def test_inventory(tmp_path):
+    root = str(tmp_path)
+    create_files(root, datetime(2014, 12, 31), hours=(18, 21))
+    create_files(root, datetime(2015, 1, 1), hours=(0, 3, 12, 15, 18, 21))
+    create_files(root, datetime(2015, 1, 2), hours=(0,))
+    os.makedirs(os.path.join(root, "2015", "notes"))
+
+    inventory = ArchiveInventory(root, n_workers=2)
+    assert inventory.version == "GLDAS_Noah_v21_025"
+    assert inventory.versions == {"GLDAS_Noah_v21_025": 9}
+    assert inventory.first == datetime(2014, 12, 31, 18)
+    assert inventory.last == datetime(2015, 1, 2)
+    assert len(inventory.timestamps) == 9
+    assert inventory.missing() == [
+        datetime(2015, 1, 1, 6),
+        datetime(2015, 1, 1, 9),
+    ]
+    assert inventory.missing(end=datetime(2015, 1, 2, 6)) == [
+        datetime(2015, 1, 1, 6),
+        datetime(2015, 1, 1, 9),
+        datetime(2015, 1, 2, 3),
+        datetime(2015, 1, 2, 6),
+    ]
+    assert inventory.coverage() == pytest.approx(9 / 11)
+    assert inventory.available(datetime(2015, 1, 1, 18)) == [
+        datetime(2015, 1, 1, 18),
+        datetime(2015, 1, 1, 21),
+        datetime(2015, 1, 2),
+    ]
+    assert inventory.duplicates == {}
+
+    # early production files next to the final ones
+    create_files(root, datetime(2015, 1, 2), hours=(0, 3), ep="_EP")
+    inventory.scan()
+    assert inventory.version is None
+    assert inventory.versions == {
+        "GLDAS_Noah_v21_025": 9,
+        "GLDAS_Noah_v21_025_EP": 2,
+    }
+    assert list(inventory.duplicates) == [datetime(2015, 1, 2)]
+    assert len(inventory.duplicates[datetime(2015, 1, 2)]) == 2
+
+    report = inventory.report()
+    assert "Missing images: 2" in report
+    assert "Duplicate images: 1" in report
+
+
+def test_inventory_period(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    create_files(root, datetime(2014, 12, 31))
+    create_files(root, datetime(2015, 1, 1))
+    create_files(root, datetime(2015, 3, 1))
+
+    scanned = []
+    scan_dir = ArchiveInventory._scan_dir
+
+    def counting_scan_dir(path):
+        scanned.append(path)
+        return scan_dir(path)
+
+    monkeypatch.setattr(
+        ArchiveInventory, "_scan_dir", staticmethod(counting_scan_dir)
+    )
+    inventory = ArchiveInventory(
+        root, start=datetime(2015, 1, 1, 6), end=datetime(2015, 1, 2)
+    )
+    # only the directories within the period are scanned
+    assert scanned == [os.path.join(root, "2015", "001")]
+    assert inventory.first == datetime(2015, 1, 1, 6)
+    assert inventory.last == datetime(2015, 1, 1, 21)
+    assert inventory.versions == {"GLDAS_Noah_v21_025": 6}
+
+    inventory = ArchiveInventory(root, start=datetime(2015, 1, 1))
+    assert inventory.first == datetime(2015, 1, 1)
+    assert inventory.last == datetime(2015, 3, 1, 21)
+
+
+def test_inventory_empty(tmp_path, capsys):
+    inventory = ArchiveInventory(str(tmp_path / "missing"))
+    assert inventory.first is None and inventory.version is None
+    assert inventory.missing() == []
+
+    create_files(str(tmp_path), datetime(2015, 1, 1), hours=(0, 6))
+    main([str(tmp_path), "-e", "2015-01-01T09:00"])
+    out = capsys.readouterr().out
+    assert "Coverage: 50.00 %" in out
+    assert "Missing images: 2" in out
@@ -4,8 +4,19 @@ import tempfile
 import numpy as np
 import numpy.testing as nptest
 
-from gldas.reshuffle import main
-from gldas.interface import GLDASTs
+from datetime import datetime, timedelta
+
+from repurpose.img2ts import Img2Ts
+from gldas.reshuffle import main, get_last_timestamp, ReshuffleJournal
+from gldas.reshuffle import reshuffle, parse_args
+from gldas.grid import load_grid
+from gldas.utils import last_time
+from gldas.reshuffle import parse_memory, estimate_imgbuffer
+from gldas.cube import get_cube_last_timestamp
+from gldas.interface import GLDASTs, GLDAS_Noah_v21_025Ds
+from gldas.synthetic import create_archive
+import gldas.reshuffle
+from netCDF4 import Dataset
 
 from tempfile import TemporaryDirectory
 
@@ -13,11 +24,11 @@ import pytest
 
 
 @pytest.mark.parametrize(
-    "landpoints,bbox,n_files_should",
+    "landpoints,bbox,n_files_should,n_proc",
     # 15 cells, 4 with out landpoints, 1 grid file
-    [(True, True, 15-4+1), (False, True, 15+1)],
+    [(True, True, 15-4+1, 1), (False, True, 15+1, 1), (True, True, 15-4+1, 2)],
 )
-def test_reshuffle(landpoints, bbox, n_files_should):
+def test_reshuffle(landpoints, bbox, n_files_should, n_proc):
     if bbox is True:
         bbox = ["41.125", "11.125", "63.875", "23.875"]
     inpath = os.path.join(
@@ -35,6 +46,7 @@ def test_reshuffle(landpoints, bbox, n_files_should):
             [inpath, ts_path, startdate, enddate]
             + parameters
             + ["--land_points", str(landpoints)]
+            + ["--n_proc", str(n_proc)]
         )
         if bbox:
             args += ["--bbox", *bbox]
@@ -62,3 +74,470 @@ def test_reshuffle(landpoints, bbox, n_files_should):
             ts["SoilMoi10_40cm_inst"].values, ts_SM10_40_values_should, rtol=1e-5
         )
         ds.close()
+
+
+@pytest.mark.parametrize("cube_only", [True, False])
+def test_reshuffle_cube(cube_only):
+    inpath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test-data",
+        "img2ts_test",
+        "netcdf",
+    )
+    bbox = ["41.125", "11.125", "63.875", "23.875"]
+
+    with TemporaryDirectory() as ts_path:
+        cube_file = os.path.join(ts_path, "cube", "gldas_cube.nc")
+        os.makedirs(os.path.dirname(cube_file))
+        args = [
+            inpath,
+            ts_path,
+            "2016-01-01T03:00",
+            "2016-01-01T21:00",
+            "SoilMoi0_10cm_inst",
+            "--land_points",
+            "True",
+            "--bbox",
+            *bbox,
+            "--cube_file",
+            cube_file,
+            "--cube_chunks",
+            "2",
+            "20",
+            "20",
+            "--cube_only",
+            str(cube_only),
+        ]
+        main(args)
+        n_files = len(glob.glob(os.path.join(ts_path, "*.nc")))
+        assert n_files == (0 if cube_only else 15 - 4 + 1)
+
+        with Dataset(cube_file) as ds:
+            assert ds["SoilMoi0_10cm_inst"].shape == (7, 52, 75)
+            assert ds["SoilMoi0_10cm_inst"].chunking() == [2, 20, 20]
+            assert ds["SoilMoi0_10cm_inst"].units == "kg m-2"
+            lat = int(np.flatnonzero(ds["lat"][:] == 15.125)[0])
+            lon = int(np.flatnonzero(ds["lon"][:] == 45.125)[0])
+            nptest.assert_allclose(
+                ds["SoilMoi0_10cm_inst"][:, lat, lon],
+                [9.595, 9.593, 9.578, 9.562, 9.555, 9.555, 9.556],
+                rtol=1e-5,
+            )
+
+
+def test_reshuffle_append():
+    inpath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test-data",
+        "img2ts_test",
+        "netcdf",
+    )
+    parameters = ["SoilMoi0_10cm_inst", "SoilMoi10_40cm_inst"]
+    bbox = ["41.125", "11.125", "63.875", "23.875"]
+
+    with TemporaryDirectory() as ts_path:
+        cube_file = os.path.join(ts_path, "cube.nc")
+        args = parameters + ["--bbox", *bbox, "--cube_file", cube_file]
+        main([inpath, ts_path, "2016-01-01T03:00", "2016-01-01T12:00"] + args)
+        assert get_last_timestamp(ts_path) == datetime(2016, 1, 1, 12)
+
+        args += ["--append", "True"]
+        main([inpath, ts_path, "2016-01-01T03:00", "2016-01-01T21:00"] + args)
+        assert get_last_timestamp(ts_path) == datetime(2016, 1, 1, 21)
+        assert get_cube_last_timestamp(cube_file) == datetime(2016, 1, 1, 21)
+        # nothing left to append
+        main([inpath, ts_path, "2016-01-01T03:00", "2016-01-01T21:00"] + args)
+
+        ds = GLDASTs(
+            ts_path,
+            ioclass_kws={"read_bulk": True, "read_dates": False},
+            parameters=parameters,
+        )
+        ts = ds.read(45.08, 15.1)
+        assert ts.index[0] == datetime(2016, 1, 1, 3)
+        assert ts.index[-1] == datetime(2016, 1, 1, 21)
+        nptest.assert_allclose(
+            ts["SoilMoi0_10cm_inst"].values,
+            [9.595, 9.593, 9.578, 9.562, 9.555, 9.555, 9.556],
+            rtol=1e-5,
+        )
+        ds.close()
+
+        with Dataset(cube_file) as cube:
+            assert cube["SoilMoi0_10cm_inst"].shape[0] == 7
+
+
+def test_reshuffle_journal(tmp_path):
+    filename = str(tmp_path / "journal.txt")
+    config = {
+        "startdate": "2016-01-01T03:00:00",
+        "period": ["2016-01-01T03:00:00", "2016-01-01T21:00:00"],
+        "imgbuffer": 3,
+    }
+    journal = ReshuffleJournal(filename, config)
+    assert not journal.resumed
+    journal.cube_done(0, 3)
+    journal.cell_done(0, 1)
+    journal.bulk_done(0)
+    journal.cell_done(1, 1)
+    journal.cell_done(1, 2)
+    with open(filename, "a") as f:
+        f.write("cell 1 3")  # interrupted while writing the record
+
+    # the period is taken from the journal
+    config["period"] = ["2016-01-01T03:00:00", "2016-01-02T21:00:00"]
+    journal = ReshuffleJournal(filename, config)
+    assert journal.resumed
+    assert journal.config["period"][1] == "2016-01-01T21:00:00"
+    assert journal.bulks == {0}
+    assert journal.cells == {1: {1, 2}}
+    assert (journal.cube_bulk, journal.cube_len) == (0, 3)
+
+    with pytest.raises(ValueError):
+        ReshuffleJournal(filename, dict(config, imgbuffer=5))
+    with pytest.raises(ValueError, match="startdate"):
+        ReshuffleJournal(filename, dict(config, startdate=None))
+
+    journal.remove()
+    assert not os.path.exists(filename)
+
+
+def test_reshuffle_resume(monkeypatch):
+    inpath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test-data",
+        "img2ts_test",
+        "netcdf",
+    )
+    parameters = ["SoilMoi0_10cm_inst", "SoilMoi10_40cm_inst"]
+    bbox = ["41.125", "11.125", "63.875", "23.875"]
+    write_orthogonal = Img2Ts._write_orthogonal
+    n_calls = []
+
+    def interrupted_write(self, cell, **kwargs):
+        n_calls.append(cell)
+        if len(n_calls) == 20:  # in the second buffer
+            raise KeyboardInterrupt
+        write_orthogonal(self, cell=cell, **kwargs)
+
+    with TemporaryDirectory() as ts_path:
+        args = [inpath, ts_path, "2016-01-01T03:00", "2016-01-01T21:00"]
+        args += parameters + ["--bbox", *bbox, "--imgbuffer", "3"]
+        with monkeypatch.context() as m:
+            m.setattr(Img2Ts, "_write_orthogonal", interrupted_write)
+            with pytest.raises(KeyboardInterrupt):
+                main(args)
+        journal_file = os.path.join(ts_path, "reshuffle_journal.txt")
+        assert os.path.isfile(journal_file)
+
+        main(args)
+        assert not os.path.isfile(journal_file)
+
+        ds = GLDASTs(
+            ts_path,
+            ioclass_kws={"read_bulk": True, "read_dates": False},
+            parameters=parameters,
+        )
+        ts = ds.read(45.08, 15.1)
+        nptest.assert_allclose(
+            ts["SoilMoi0_10cm_inst"].values,
+            [9.595, 9.593, 9.578, 9.562, 9.555, 9.555, 9.556],
+            rtol=1e-5,
+        )
+        ds.close()
+
+        for filename in glob.glob(os.path.join(ts_path, "[0-9]*.nc")):
+            with Dataset(filename) as cell:
+                assert cell["time"].size == 7
+                assert np.all(np.diff(cell["time"][:]) > 0)
+
+
+@pytest.mark.parametrize("partial", [False, True])
+def test_reshuffle_resume_unrecorded_cell(tmp_path, monkeypatch, partial):
+    # the run is killed after a cell was written, but before it was recorded
+    # in the journal
+    img_path = str(tmp_path / "img")
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 1, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    args = ["2015-01-01", "2015-01-01T21:00"] + parameters
+    args += ["--bbox", "5", "40", "20", "50", "--imgbuffer", "3"]
+    clean_path, ts_path = str(tmp_path / "clean"), str(tmp_path / "ts")
+    main([img_path, clean_path] + args)
+    n_cells = len(glob.glob(os.path.join(clean_path, "[0-9]*.nc")))
+
+    cell_done = ReshuffleJournal.cell_done
+    cells = []
+
+    def interrupted_cell_done(self, bulk, cell):
+        cells.append(cell)
+        if len(cells) == n_cells + 1:  # first cell of the second buffer
+            raise KeyboardInterrupt
+        cell_done(self, bulk, cell)
+
+    with monkeypatch.context() as m:
+        m.setattr(ReshuffleJournal, "cell_done", interrupted_cell_done)
+        with pytest.raises(KeyboardInterrupt):
+            main([img_path, ts_path] + args)
+
+    filename = os.path.join(ts_path, "%04d.nc" % cells[-1])
+    if partial:
+        # the data of the buffer was written, but not its time stamps
+        with Dataset(filename, "a") as ds:
+            ds["time"][-3:] = np.ma.masked
+            ds["SWE_inst"][:, -3:] = -1
+
+    # the conversion can only be resumed for the same period
+    with pytest.raises(ValueError, match="enddate"):
+        main([img_path, ts_path, "2015-01-01", "2015-01-01T18:00"] + args[2:])
+
+    main([img_path, ts_path] + args)
+    assert not os.path.isfile(
+        os.path.join(ts_path, "reshuffle_journal.txt")
+    )
+    for clean in glob.glob(os.path.join(clean_path, "[0-9]*.nc")):
+        resumed = os.path.join(ts_path, os.path.basename(clean))
+        with Dataset(clean) as ds_clean, Dataset(resumed) as ds:
+            assert ds["time"].size == 8
+            nptest.assert_array_equal(ds["time"][:], ds_clean["time"][:])
+            for param in parameters:
+                nptest.assert_array_equal(ds[param][:], ds_clean[param][:])
+
+
+def test_reshuffle_restart(tmp_path, monkeypatch):
+    img_path, ts_path = str(tmp_path / "img"), str(tmp_path / "ts")
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 1, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    args = parameters + ["--bbox", "5", "40", "20", "50", "--imgbuffer", "3"]
+
+    def interrupted_cell_done(self, bulk, cell):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(ReshuffleJournal, "cell_done", interrupted_cell_done)
+        with pytest.raises(KeyboardInterrupt):
+            main([img_path, ts_path, "2015-01-01", "2015-01-01"] + args)
+    journal_file = os.path.join(ts_path, "reshuffle_journal.txt")
+    assert os.path.isfile(journal_file)
+
+    # a conversion with other settings discards the journal if requested
+    with pytest.raises(ValueError, match="restart"):
+        main([img_path, ts_path, "2015-01-01", "2015-01-01T09:00"] + args)
+    for filename in glob.glob(os.path.join(ts_path, "[0-9]*.nc")):
+        os.remove(filename)
+    main(
+        [img_path, ts_path, "2015-01-01", "2015-01-01T09:00"]
+        + args
+        + ["--restart", "True"]
+    )
+    assert not os.path.isfile(journal_file)
+    filenames = glob.glob(os.path.join(ts_path, "[0-9]*.nc"))
+    assert filenames
+    for filename in filenames:
+        with Dataset(filename) as ds:
+            assert ds["time"].size == 4
+
+
+def test_parse_args_enddate():
+    # the end date is used as passed, like in reshuffle
+    args = parse_args(["img", "ts", "2002-01-01", "2002-01-01", "SWE_inst"])
+    assert args.start == datetime(2002, 1, 1)
+    assert args.end == datetime(2002, 1, 1)
+    args = parse_args(
+        ["img", "ts", "2002-01-01", "2002-01-01T21:00", "SWE_inst"]
+    )
+    assert args.end == datetime(2002, 1, 1, 21)
+
+
+def test_estimate_imgbuffer():
+    assert parse_memory("16GB") == 16 * 1024**3
+    assert parse_memory("512 MB") == 512 * 1024**2
+    assert parse_memory("1.5g") == int(1.5 * 1024**3)
+    assert parse_memory("2GiB") == 2 * 1024**3
+    assert parse_memory(1000) == 1000
+    with pytest.raises(ValueError):
+        parse_memory("16 apples")
+
+    # 2 parameters on the global grid, 26 bytes per value
+    assert estimate_imgbuffer(parse_memory("16GB"), 1036800, 2) == 318
+    assert estimate_imgbuffer(parse_memory("16GB"), 1036800, 4) == 159
+    assert estimate_imgbuffer(1000, 1036800, 2) == 1
+    assert estimate_imgbuffer(
+        parse_memory("16GB"), 1036800, 2, dtype=np.float32
+    ) == 16 * 1024**3 // (1036800 * 2 * 14)
+
+    # images read ahead and parallel processes
+    n_values = 1036800 * 2
+    assert estimate_imgbuffer(
+        parse_memory("16GB"), 1036800, 2, prefetch=4
+    ) == (16 * 1024**3 - 4 * n_values * 8) // (n_values * 26)
+    assert estimate_imgbuffer(
+        parse_memory("16GB"), 1036800, 2, n_proc=4
+    ) == (16 * 1024**3 - 4 * n_values * 8) // (n_values * 35)
+
+
+def test_reshuffle_daterange():
+    inpath = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "test-data",
+        "img2ts_test",
+        "netcdf",
+    )
+    grid = load_grid(bbox=(41.125, 11.125, 63.875, 23.875))
+
+    with TemporaryDirectory() as ts_path:
+        # the period is limited to the images in the archive
+        reshuffle(
+            inpath,
+            ts_path,
+            None,
+            datetime(2016, 1, 5),
+            ["SoilMoi0_10cm_inst"],
+            input_grid=grid,
+        )
+        for filename in glob.glob(os.path.join(ts_path, "[0-9]*.nc")):
+            with Dataset(filename) as cell:
+                assert last_time(cell["time"]) == datetime(2016, 1, 1, 21)
+                assert cell["time"].size == 8
+
+        with pytest.raises(ValueError):
+            reshuffle(
+                inpath,
+                ts_path,
+                datetime(2016, 1, 2),
+                datetime(2016, 1, 5),
+                ["SoilMoi0_10cm_inst"],
+                input_grid=grid,
+            )
+
+
+def test_reshuffle_inventory_fallback(tmp_path):
+    img_path = str(tmp_path / "img")
+    parameters = ["SWE_inst"]
+    filenames = create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 1, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    grid = load_grid(bbox=(5, 40, 20, 50))
+
+    # the end date is limited to the last image, with a warning
+    ts_path = str(tmp_path / "ts")
+    with pytest.warns(UserWarning, match="after the last image"):
+        reshuffle(
+            img_path, ts_path, datetime(2015, 1, 1), datetime(2015, 1, 2),
+            parameters, input_grid=grid,
+        )
+    ds = GLDASTs(ts_path)
+    assert ds.read(784127).index[-1] == datetime(2015, 1, 1, 21)
+    ds.close()
+
+    # file names that the dataset finds, but the inventory does not know
+    for filename in filenames:
+        os.rename(filename, filename.replace(".nc4", ".1.nc4"))
+    ts_path = str(tmp_path / "ts_unknown")
+    with pytest.raises(ValueError, match="pass startdate and enddate"):
+        reshuffle(img_path, ts_path, None, None, parameters, input_grid=grid)
+    with pytest.warns(UserWarning, match="by the inventory"):
+        reshuffle(
+            img_path, ts_path, datetime(2015, 1, 1), datetime(2015, 1, 2),
+            parameters, input_grid=grid,
+        )
+    ds = GLDASTs(ts_path)
+    assert len(ds.read(784127).index) == 8
+    ds.close()
+
+
+def test_reshuffle_check_archive(tmp_path, monkeypatch):
+    img_path = str(tmp_path / "img")
+    parameters = ["SWE_inst"]
+    create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 1, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    grid = load_grid(bbox=(5, 40, 20, 50))
+
+    def no_inventory(*args, **kwargs):
+        raise AssertionError("the archive must not be scanned")
+
+    monkeypatch.setattr(gldas.reshuffle, "ArchiveInventory", no_inventory)
+    ts_path = str(tmp_path / "ts")
+    reshuffle(
+        img_path, ts_path, datetime(2015, 1, 1), datetime(2015, 1, 1, 9),
+        parameters, input_grid=grid, check_archive=False,
+    )
+    ds = GLDASTs(ts_path)
+    assert len(ds.read(784127).index) == 4
+    ds.close()
+
+    # without a start or end date, the inventory is needed
+    with pytest.raises(AssertionError, match="scanned"):
+        reshuffle(
+            img_path, ts_path, None, datetime(2015, 1, 1, 9),
+            parameters, input_grid=grid, check_archive=False,
+        )
+
+
+def test_reshuffle_aggregation(tmp_path):
+    img_path, ts_path = str(tmp_path / "img"), str(tmp_path / "ts")
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    create_archive(
+        img_path,
+        datetime(2015, 1, 1),
+        datetime(2015, 1, 2, 21),
+        parameters=parameters,
+        complevel=1,
+    )
+    args = [img_path, ts_path, "2015-01-01", "2015-01-01T21:00"]
+    args += parameters + ["--land_points", "True"]
+    args += ["--bbox", "5", "40", "20", "50", "--aggregation", "daily"]
+    main(args)
+    # the next day is appended, the incomplete day after it is skipped
+    main(
+        args[:2] + ["2015-01-01", "2015-01-03"] + args[4:]
+        + ["--append", "True"]
+    )
+
+    gpi = 784127
+    ds = GLDASTs(ts_path)
+    ts = ds.read(gpi)
+    ds.close()
+    assert list(ts.index) == [datetime(2015, 1, 1), datetime(2015, 1, 2)]
+
+    images = GLDAS_Noah_v21_025Ds(img_path, parameters, array_1D=True)
+    for day in ts.index:
+        values = [
+            images.read(day + timedelta(hours=h)).data["SWE_inst"][gpi]
+            for h in range(0, 24, 3)
+        ]
+        nptest.assert_allclose(
+            ts.loc[day, "SWE_inst"], np.mean(values), rtol=1e-5
+        )
+    images.close()
+
+    cell_files = glob.glob(os.path.join(ts_path, "[0-9]*.nc"))
+    with Dataset(cell_files[0]) as cell:
+        assert cell.time_aggregation == "daily"
+        assert cell["SWE_inst"].cell_methods == "time: mean"
+
+    with pytest.raises(ValueError, match="No complete monthly period"):
+        reshuffle(
+            img_path, str(tmp_path / "ts_m"), None, None, parameters,
+            aggregation="monthly",
+        )
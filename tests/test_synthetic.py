@@ -0,0 +1,89 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+from gldas.synthetic import create_archive, main, grib_messages
+from gldas.interface import GLDAS_Noah_v21_025Ds, GLDAS_Noah_v1_025Ds
+from gldas.interface import pygrib_available
+from gldas.inventory import ArchiveInventory
+from gldas.download import verify_file
+
+
+def test_create_archive(tmp_path):
+    root = str(tmp_path)
+    parameters = ["SoilMoi0_10cm_inst", "SWE_inst"]
+    filenames = create_archive(
+        root,
+        datetime(2015, 1, 1, 18),
+        datetime(2015, 1, 2, 3),
+        parameters=parameters,
+        complevel=1,
+        sidecars=True,
+        n_proc=2,
+    )
+    assert len(filenames) == 4
+    assert filenames[-1] == os.path.join(
+        root, "2015", "002", "GLDAS_NOAH025_3H.A20150102.0300.021.nc4"
+    )
+    assert all(verify_file(f, checksum=True) is None for f in filenames)
+
+    inventory = ArchiveInventory(root)
+    assert inventory.version == "GLDAS_Noah_v21_025"
+    assert inventory.missing() == []
+
+    with Dataset(filenames[0]) as ds:
+        var = ds["SoilMoi0_10cm_inst"]
+        assert var.shape == (1, 600, 1440)
+        assert var._FillValue == -9999.0
+        assert var.filters()["complevel"] == 1
+        assert var.units == "kg m-2"
+        assert ds["lat"][0] == -59.875 and ds["lat"][-1] == 89.875
+
+    ds = GLDAS_Noah_v21_025Ds(root, parameter=parameters, array_1D=True)
+    img = ds.read(datetime(2015, 1, 2))
+    ds.close()
+    data = img.data["SoilMoi0_10cm_inst"]
+    land = data != 9999.0
+    # the southern rows and the ocean are missing
+    assert 0 < land.sum() < 600 * 1440 / 2
+    assert np.all((data[land] >= 2) & (data[land] <= 50))
+
+
+def test_create_archive_invalid(tmp_path):
+    with pytest.raises(ValueError):
+        create_archive(
+            str(tmp_path), datetime(2015, 1, 1), datetime(2015, 1, 1),
+            product="GLDAS_Noah_v3",
+        )
+    with pytest.raises(ValueError):
+        create_archive(
+            str(tmp_path), datetime(2015, 1, 1), datetime(2015, 1, 1),
+            parameters=["SoilMoisture"],
+        )
+
+
+def test_create_grib_archive(tmp_path):
+    root = str(tmp_path)
+    main([root, "2015-01-01", "2015-01-01T03:00",
+          "--product", "GLDAS_Noah_v1_025"])
+    inventory = ArchiveInventory(root)
+    assert inventory.version == "GLDAS_Noah_v1_025"
+    assert len(inventory.timestamps) == 2
+
+    with open(inventory.files[datetime(2015, 1, 1)][0], "rb") as f:
+        content = f.read()
+    assert content.count(b"GRIB") == len(grib_messages)
+    assert content.startswith(b"GRIB") and content.endswith(b"7777")
+    assert int.from_bytes(content[4:7], "big") == len(content) // len(
+        grib_messages
+    )
+
+    if pygrib_available:
+        ds = GLDAS_Noah_v1_025Ds(root, parameter=["086_L1", "086_L4", "138"])
+        img = ds.read(datetime(2015, 1, 1, 3))
+        data = img.data["086_L4"]
+        assert data.shape == (720, 1440)
+        assert np.all((data[data != 9999] >= 20) & (data[data != 9999] <= 500))